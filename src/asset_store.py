@@ -0,0 +1,103 @@
+"""
+Keeps the decoded, trimmed overlays in files that each process maps into memory read-only, so
+processes rendering side by side (like the shards of a run) share one copy of every overlay
+through the page cache instead of each decoding and holding their own, and a new process can
+use the overlays right away without decoding anything.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+from PIL import Image
+
+from common import file_fingerprint
+from constants import ASSET_STORE
+
+STORE_VERSION = 1
+
+# the pixels start on a page boundary after the header
+HEADER_SIZE = 4096
+
+# the modes Pillow can use straight out of a buffer, without copying it
+MAPPABLE_MODES = ("L", "RGBA", "RGBX", "CMYK")
+
+
+def get_store_path(path: str, scale: float) -> str:
+    key = f"{os.path.abspath(path)}|{scale}"
+    return f"{ASSET_STORE}{hashlib.sha1(key.encode("utf8")).hexdigest()}.asset"
+
+
+def _get_header(path: str, scale: float) -> dict:
+    return {"version": STORE_VERSION, "source": file_fingerprint(path), "scale": scale}
+
+
+def open_stored_asset(
+    path: str, scale: float = 1
+) -> tuple[Image.Image, tuple[int, int]] | None:
+    """
+    Map the stored copy of the asset into memory, as a read-only image backed by the store's
+    file. Returns the image and the position of its top left corner in the untrimmed asset,
+    or None if there's no stored copy from the current version of the asset.
+    """
+
+    try:
+        expected_header = _get_header(path, scale)
+        with open(get_store_path(path, scale), "rb") as store_file:
+            header = json.loads(store_file.read(HEADER_SIZE).rstrip(b"\x00"))
+            if any(header.get(key) != value for key, value in expected_header.items()):
+                return None
+
+            mode, size = header["mode"], tuple(header["size"])
+            num_bytes = size[0] * size[1] * Image.getmodebands(mode)
+            if os.fstat(store_file.fileno()).st_size != HEADER_SIZE + num_bytes:
+                return None
+            if num_bytes == 0:
+                return Image.new(mode, size), tuple(header["origin"])
+
+            # the mapping stays open for as long as the image uses it
+            mapped_file = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    image = Image.frombuffer(
+        mode, size, memoryview(mapped_file)[HEADER_SIZE:], "raw", mode, 0, 1
+    )
+    return image, tuple(header["origin"])
+
+
+def store_asset(
+    path: str, scale: float, image: Image.Image, origin: tuple[int, int]
+) -> bool:
+    """
+    Write the decoded asset to the store, replacing any copy from an older version of it.
+    Returns whether it was stored; assets in modes that can't be mapped aren't.
+    """
+
+    if image.mode not in MAPPABLE_MODES:
+        return False
+
+    header = _get_header(path, scale)
+    header.update(
+        {"mode": image.mode, "size": list(image.size), "origin": list(origin)}
+    )
+
+    store_path = get_store_path(path, scale)
+    temp_path = f"{store_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(ASSET_STORE, exist_ok=True)
+        with open(temp_path, "wb") as store_file:
+            store_file.write(
+                json.dumps(header).encode("utf8").ljust(HEADER_SIZE, b"\x00")
+            )
+            store_file.write(image.tobytes())
+        os.replace(temp_path, store_path)
+    except OSError:
+        # e.g. another process has the old copy mapped on a system that won't replace it
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return True
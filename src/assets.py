@@ -0,0 +1,74 @@
+"""
+Keeps the overlay images from the `images` folder in memory, so each one is only
+opened, checked, and trimmed once (and once per scale when rendering proofs). Decoded
+overlays are kept in the asset store, which every process maps rather than decoding its own.
+"""
+
+from functools import cache
+from PIL import Image
+
+from asset_store import open_stored_asset, store_asset
+from common import image_is_opaque, scale_image
+from memory import track_image
+
+
+@cache
+def load_asset(path: str, scale: float = 1) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Load the asset at the given path, scaled down if asked, and trimmed to the part of it
+    that isn't fully transparent (most overlays only cover a small part of the card).
+    The asset is mapped read-only from the asset store, after being decoded into it if
+    it isn't there yet; mapped assets aren't counted against the memory budget, since
+    they're shared with every other process using them.
+    Returns the image and the position of its top left corner in the untrimmed asset.
+    Raises an AttributeError if the image can't be read.
+    """
+
+    stored_asset = open_stored_asset(path, scale)
+    if stored_asset is not None:
+        return stored_asset
+
+    image, origin = decode_asset(path, scale)
+    if store_asset(path, scale, image, origin):
+        # use the stored copy, so this process shares it with the others too
+        stored_asset = open_stored_asset(path, scale)
+        if stored_asset is not None:
+            image.close()
+            return stored_asset
+
+    return track_image(image), origin
+
+
+def decode_asset(path: str, scale: float = 1) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decode and trim the asset at the given path. Raises an AttributeError if the image
+    can't be read.
+    """
+
+    image = Image.open(path)
+    if scale != 1:
+        try:
+            image = scale_image(image, scale)
+        except OSError:
+            raise AttributeError
+
+    # decoding the whole image is what catches a corrupted or truncated file
+    try:
+        image.load()
+    except (OSError, SyntaxError, ValueError):
+        raise AttributeError
+
+    if image.has_transparency_data:
+        if "A" not in image.getbands():
+            image = image.convert("RGBA")
+        box = image.getchannel("A").getbbox() or (0, 0, 0, 0)
+        if box != (0, 0, image.width, image.height):
+            image = image.crop(box)
+        return image, box[:2]
+
+    return image, (0, 0)
+
+
+@cache
+def asset_is_opaque(path: str, scale: float = 1) -> bool:
+    return image_is_opaque(load_asset(path, scale)[0])
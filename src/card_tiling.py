@@ -3,33 +3,77 @@ Takes the processed cards and tiles them.
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
+import json
+import os
+import threading
 from PIL import Image
 
-from common import cardname_to_filename, open_card_file, process_spreadsheets
+from common import (
+    cardname_to_filename,
+    find_card_file,
+    get_card_path,
+    get_saved_info,
+    list_card_files,
+    parse_proof_scale,
+    report_unchanged_writes,
+    save_json,
+    scale_length,
+)
 from constants import (
     CARD_DATE,
     CARD_HEIGHT,
     CARD_NAME,
     CARD_TYPES,
     CARD_WIDTH,
+    SHEET_CANVAS_POOL,
     TILING_HEIGHT,
     TILING_WIDTH,
+    TILING_WORKERS,
     UPDATED,
+    WHERE_FIELDS,
 )
+from image_cache import open_tile_image
+from journal import finish_journal, is_journaled, record_done, start_journal
 from log import log, reset_log
-from model.Card import Card
+from memory import memory_stage, report_memory, set_memory_limit, track_image
+from model.Spreadsheets import Spreadsheets
+from model.TileSheet import TileSheet
+from numbering import (
+    get_sheet_contents,
+    get_table_path,
+    load_table,
+    merge_shard_tables,
+    report_sheet_changes,
+)
+from pdf_export import export_sheets_pdf
+from png_export import save_png_bands_if_changed
+from selection import parse_where, select_cards
+from shards import in_shard, merge_shard_manifests, parse_shard, write_shard_manifest
+from startup import begin_startup, in_background, report_startup
+from tiff_export import (
+    SHEET_INDEX,
+    get_card_regions,
+    load_sheet_index,
+    write_tiled_tiff_bands,
+)
 
+SHEET_LABELS = {
+    "cards": "Card",
+    "tokens": "Token",
+    "basic_lands": "Basic Land",
+    "alt_arts": "Alt Art",
+}
 
-def tile_cards(
-    cards: dict[str, dict[str, str | dict[str, str]]],
-    only_updated: bool = False,
-    min_tile_num: int = 1,
-    max_tile_num: int = float('inf'),
-    quarantine: bool = True,
-):
-    log(f"\n----- PROCESSING{" UPDATED" if only_updated else ""} CARDS -----\n")
+# the canvases of finished bands of sheets, kept for the next bands of the same size,
+# each with the boxes that were drawn on it
+_canvases_lock = threading.Lock()
+_canvases: list[tuple[Image.Image, set[tuple[int, int, int, int]]]] = []
 
+
+def sort_by_date(cards: dict[str, dict[str, str]]) -> list[str]:
     card_name_list = list(cards.keys())
     card_name_list.sort(
         key=lambda card_name: (
@@ -37,317 +81,573 @@ def tile_cards(
             cards[card_name][CARD_NAME],
         )
     )
-
-    tile_num = 1
-    tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-
-    num = 0
-    for card_name in card_name_list:
-        card = cards[card_name]
-        if only_updated and card[UPDATED] == "FALSE":
-            continue
-
-        tile_row = num // TILING_WIDTH
-        tile_col = num % TILING_WIDTH
-
-        if tile_num < min_tile_num:
-            if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-                log(f"Skipping Card Tile Set {tile_num}")
-                tile_num += 1
-                num = 0
-            else:
-                num += 1
-
-            for backside in card["Transform Backsides"]:
-                if tile_num < min_tile_num:
-                    tile_row = num // TILING_WIDTH
-                    tile_col = num % TILING_WIDTH
-
-                    if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-                        log(f"Skipping Card Tile Set {tile_num}")
-                        tile_num += 1
-                        num = 0
-                    else:
-                        num += 1
+    return card_name_list
+
+
+def get_source_path(
+    quarantine: bool = False, proof: bool = False, merged_view: bool = False
+) -> str | list[str]:
+    """
+    Get the folder (relative to "cards/") the processed cards are tiled from. With a merged
+    view, that's the quarantine folder followed by the main one, so quarantined cards are
+    tiled alongside the approved ones (and in place of their approved versions).
+    """
+
+    if merged_view:
+        return [
+            get_card_path("processed_cards", quarantine=True, proof=proof),
+            get_card_path("processed_cards", quarantine=False, proof=proof),
+        ]
+    return get_card_path("processed_cards", quarantine, proof)
+
+
+def load_numbers(card_path: str | list[str]) -> dict[str, dict[str, str]]:
+    """
+    Load the collector numbers the cards were last rendered with, preferring the numbers from
+    earlier folders of a merged view.
+    """
+
+    card_paths = [card_path] if isinstance(card_path, str) else card_path
+    numbers = {}
+    for path in reversed(card_paths):
+        table = load_table(get_table_path("collector_numbers", path))
+        for kind, kind_numbers in table.items():
+            numbers.setdefault(kind, {}).update(kind_numbers)
+    return numbers
+
+
+def plan_tile_sheets(
+    kind: str,
+    groups: list[list[tuple[str, bool]]],
+    card_path: str | list[str],
+    min_tile_num: int = 1,
+    max_tile_num: int = float("inf"),
+) -> list[TileSheet]:
+    """
+    Lay the cards out on sheets, in order. Each group is a card followed by its backsides, as
+    (card name, whether to rotate it); a group whose card can't be found is left out entirely,
+    as are backsides that can't be found. Groups on sheets before `min_tile_num` are counted
+    without checking for their files.
+    """
+
+    sheet_size = TILING_WIDTH * TILING_HEIGHT
+    sheets: list[TileSheet] = []
+
+    index = 0
+    for group in groups:
+        if index // sheet_size + 1 < min_tile_num:
+            for card_index, _ in enumerate(group):
+                if card_index > 0 and index // sheet_size + 1 >= min_tile_num:
+                    break
+                if index % sheet_size == sheet_size - 1:
+                    log(
+                        f"Skipping {SHEET_LABELS[kind]} Tile Set {index // sheet_size + 1}"
+                    )
+                index += 1
             continue
 
-        if tile_num > max_tile_num:
+        if index // sheet_size + 1 > max_tile_num:
             break
 
-        log(f"""Tiling "{card_name}".""", do_print=False)
-
-        file_name = cardname_to_filename(card_name)
-        card_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-        if card_image is None:
-            continue
-
-        if "Battle" in card[CARD_TYPES]:
-            card_image = card_image.rotate(90, expand=True)
-            card_image = card_image.resize(
-                (CARD_WIDTH, CARD_HEIGHT), Image.Resampling.LANCZOS
-            )
-
-        try:
-            tiles.add_layer(
-                card_image, position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT)
-            )
-        except AttributeError:
-            log(
-                f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
-            )
-
-        if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-            finished_tiles = tiles.merge_layers()
-            if finished_tiles is not None:
-                log(f"\nCreating Card Tile Set {tile_num}.\n")
-                finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}cards{tile_num}.png")
-                tile_num += 1
-            tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-            num = 0
-        else:
-            num += 1
-
-        for backside in card["Transform Backsides"]:
-
-            backside_name = backside[CARD_NAME]
-            log(f"""\tTiling "{backside_name}".""", do_print=False)
-
-            tile_row = num // TILING_WIDTH
-            tile_col = num % TILING_WIDTH
-
-            file_name = cardname_to_filename(backside_name)
-            backside_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-            if backside_image is None:
+        for card_index, (card_name, rotate) in enumerate(group):
+            if find_card_file(cardname_to_filename(card_name), card_path) is None:
+                if card_index == 0:
+                    break
                 continue
 
-            try:
-                tiles.add_layer(
-                    backside_image,
-                    position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT),
-                )
-            except AttributeError:
-                log(
-                    f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
-                )
-
-            if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-                finished_tiles = tiles.merge_layers()
-                if finished_tiles is not None:
-                    log(f"\nCreating Card Tile Set {tile_num}.\n")
-                    finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}cards{tile_num}.png")
-                    tile_num += 1
-                tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-                num = 0
-            else:
-                num += 1
-
-    finished_tiles = tiles.merge_layers()
-    if finished_tiles is not None:
-        log(f"\nCreating Card Tile Set {tile_num} (Final Tileset).\n")
-        finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}cards{tile_num}.png")
-
-
-def tile_tokens(tokens: dict[str, dict[str, str]], quarantine: bool = True):
-    log(f"\n----- PROCESSING TOKENS -----\n")
-
-    token_name_list = list(tokens.keys())
-    token_name_list.sort(
-        key=lambda token_name: (
-            datetime.strptime(tokens[token_name][CARD_DATE], "%m/%d/%Y"),
-            tokens[token_name][CARD_NAME],
-        )
+            tile_num = index // sheet_size + 1
+            if tile_num > max_tile_num:
+                break
+            if len(sheets) == 0 or sheets[-1].num != tile_num:
+                sheets.append(TileSheet(kind, tile_num))
+            sheets[-1].slots.append(
+                (index % sheet_size, card_name, rotate, card_index > 0)
+            )
+            index += 1
+
+    if len(sheets) > 0 and len(sheets[-1].slots) < sheet_size:
+        sheets[-1].final = True
+
+    return sheets
+
+
+def take_canvas(
+    size: tuple[int, int],
+) -> tuple[Image.Image, set[tuple[int, int, int, int]]]:
+    """
+    Get a canvas for a band of a sheet, reusing a finished band's if there's one of the same
+    size. Returns the canvas along with the boxes drawn on it, which aren't blank.
+    """
+
+    with _canvases_lock:
+        for index, (canvas, drawn_boxes) in enumerate(_canvases):
+            if canvas.size == size:
+                del _canvases[index]
+                return canvas, drawn_boxes
+
+    return track_image(Image.new("RGBA", size)), set()
+
+
+def return_canvas(canvas: Image.Image, drawn_boxes: set[tuple[int, int, int, int]]):
+    """
+    Keep the finished band's canvas for the next band, letting go of the oldest one kept
+    if there are too many.
+    """
+
+    with _canvases_lock:
+        _canvases.append((canvas, drawn_boxes))
+        if len(_canvases) > SHEET_CANVAS_POOL:
+            del _canvases[0]
+
+
+def clear_boxes(canvas: Image.Image, boxes: set[tuple[int, int, int, int]]):
+    blank = (0,) * len(canvas.getbands())
+    for box in boxes:
+        canvas.paste(blank, box)
+
+
+def tile_band(
+    placements: list[tuple[str, bool, tuple[int, int]]],
+    card_path: str | list[str],
+    band_size: tuple[int, int],
+    size: tuple[int, int],
+) -> tuple[Image.Image, set[tuple[int, int, int, int]]]:
+    """
+    Tile the cards placed in a band of a sheet (a row of slots), decoding them on several
+    threads at once, each pasting its card straight into its own part of the band. The band
+    is built on a finished band's canvas where possible. Returns the band along with the
+    boxes drawn on it.
+    """
+
+    # at some proof scales, neighbouring cards share a column of pixels, so then the cards are
+    # pasted one after another in order instead
+    boxes = [
+        (left, top, left + size[0], top + size[1]) for _, _, (left, top) in placements
+    ]
+    in_place = not any(
+        left < other_right
+        and other_left < right
+        and top < other_bottom
+        and other_top < bottom
+        for index, (left, top, right, bottom) in enumerate(boxes)
+        for other_left, other_top, other_right, other_bottom in boxes[index + 1 :]
     )
 
-    tile_num = 1
-    tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-
-    num = 0
-    for token_name in token_name_list:
-
-        log(f"""Tiling Token "{token_name}".""", do_print=False)
-
-        tile_row = num // TILING_WIDTH
-        tile_col = num % TILING_WIDTH
-
-        file_name = cardname_to_filename(token_name)
-        token_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-        if token_image is None:
-            continue
+    finished_tiles, drawn_boxes = take_canvas(band_size)
+    # the cards are charged to this thread, which holds the canvas while it waits on them
+    thread_id = threading.get_ident()
+    # transparent cards are blended with what's under them, so the slots have to be blank first
+    clear_boxes(finished_tiles, drawn_boxes)
+    pasted_boxes = set()
 
+    def paste_card(image: Image.Image, position: tuple[int, int]):
+        if not image.has_transparency_data:
+            finished_tiles.paste(image, position)
+        else:
+            finished_tiles.paste(image, position, mask=image)
+        image.close()
+        left, top = position
+        pasted_boxes.add((left, top, left + size[0], top + size[1]))
+
+    def place_card(
+        file_name: str, rotate: bool, position: tuple[int, int]
+    ) -> Image.Image | None:
         try:
-            tiles.add_layer(
-                token_image, position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT)
-            )
-        except AttributeError:
+            image = open_tile_image(file_name, card_path, rotate, size)
+            if image is None:
+                return None
+            image.load()
+        except (OSError, SyntaxError, ValueError):
             log(
                 f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
             )
+            return None
+
+        track_image(image, thread_id)
+        if not in_place:
+            return image
+        paste_card(image, position)
+        return None
+
+    with ThreadPoolExecutor(max_workers=TILING_WORKERS) as pool:
+        for image, (_, _, position) in zip(
+            pool.map(lambda placement: place_card(*placement), placements), placements
+        ):
+            if image is not None:
+                paste_card(image, position)
+
+    return finished_tiles, pasted_boxes
+
+
+def build_tile_sheet(
+    sheet: TileSheet,
+    card_path: str | list[str],
+    tilings_path: str,
+    scale: float = 1,
+    tiff: bool = False,
+) -> str | None:
+    """
+    Tile the sheet's cards and save the sheet, as a tiled TIFF if asked. The sheet is built
+    and encoded one row of slots at a time, each row streamed to the file as soon as it's
+    tiled, so only about a row of the sheet is ever in memory. A PNG sheet's digest is made
+    from the digests of its cards and where they're placed, so an unchanged sheet isn't tiled
+    at all. Returns the path of the saved sheet.
+    """
+
+    size = (scale_length(CARD_WIDTH, scale), scale_length(CARD_HEIGHT, scale))
+    placements = [[] for _ in range(TILING_HEIGHT)]
+    card_digests = []
+    for slot, card_name, rotate, backside in sheet.slots:
+        log(f"""{"\t" if backside else ""}Tiling "{card_name}".""", do_print=False)
 
-        if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-            finished_tiles = tiles.merge_layers()
-            if finished_tiles is not None:
-                log(f"\nCreating Token Tile Set {tile_num}.\n")
-                finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}tokens{tile_num}.png")
-                tile_num += 1
-            tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-            num = 0
-        else:
-            num += 1
+        file_name = cardname_to_filename(card_name)
+        source_path = find_card_file(file_name, card_path)
+        if source_path is None:
+            continue
 
-    finished_tiles = tiles.merge_layers()
-    if finished_tiles is not None:
-        log(f"\nCreating Token Tile Set {tile_num} (Final Tileset).\n")
-        finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}tokens{tile_num}.png")
+        left, top = sheet.get_position(slot)
+        position = (round(left * scale), round(top * scale))
+        placements[slot // TILING_WIDTH].append((file_name, rotate, position))
+        card_digests.append(get_saved_info(source_path).get("Digest"))
 
+    if not any(placements):
+        return None
 
-def tile_basic_lands(basic_lands: dict[str, dict[str, str]], quarantine: bool = True):
-    log(f"\n----- PROCESSING BASIC LANDS -----\n")
+    sheet_size = (
+        scale_length(CARD_WIDTH * TILING_WIDTH, scale),
+        scale_length(CARD_HEIGHT * TILING_HEIGHT, scale),
+    )
+    # the pixels are hashed while they're encoded instead if any card was saved without one
+    digest = None
+    if None not in card_digests:
+        digest = hashlib.sha1(
+            json.dumps([sheet_size, size, placements, card_digests]).encode("utf8")
+        ).hexdigest()
+    # at some proof scales, a card runs a row of pixels into the band below, where the card
+    # below covers it
+    band_tops = [round(row * CARD_HEIGHT * scale) for row in range(TILING_HEIGHT)]
+    band_tops.append(sheet_size[1])
+
+    def tile_bands():
+        for row, row_placements in enumerate(placements):
+            band_top = band_tops[row]
+            band, drawn_boxes = tile_band(
+                [
+                    (file_name, rotate, (left, top - band_top))
+                    for file_name, rotate, (left, top) in row_placements
+                ],
+                card_path,
+                (sheet_size[0], band_tops[row + 1] - band_top),
+                size,
+            )
+            yield band
+            return_canvas(band, drawn_boxes)
 
-    basic_land_name_list = list(basic_lands.keys())
-    basic_land_name_list.sort(
-        key=lambda basic_land_name: (
-            datetime.strptime(basic_lands[basic_land_name][CARD_DATE], "%m/%d/%Y"),
-            basic_lands[basic_land_name][CARD_NAME],
-        )
+    log(
+        f"\nCreating {SHEET_LABELS[sheet.kind]} Tile Set {sheet.num}{" (Final Tileset)" if sheet.final else ""}.\n"
     )
+    path = f"cards/{tilings_path}{sheet.file_name}.{"tif" if tiff else "png"}"
+    if tiff:
+        write_tiled_tiff_bands(tile_bands(), sheet_size, "RGBA", path)
+    else:
+        save_png_bands_if_changed(tile_bands(), sheet_size, "RGBA", path, digest)
+    return path
 
-    tile_num = 1
-    tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
 
-    num = 0
-    for basic_land_name in basic_land_name_list:
+def build_tile_sheets(
+    sheets: list[TileSheet],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    card_names: set[str] = None,
+    tiff: bool = False,
+    merged_view: bool = False,
+) -> list[str]:
+    """
+    Tile and save the sheets, remembering what was on each one. If `only_renumbered` is set,
+    only the sheets whose cards or collector numbers changed since they were last tiled are
+    tiled again, and if `card_names` is given, only the sheets with any of those cards on
+    them are. If `pdf` is set, the sheets are instead exported as the pages of one PDF, and
+    if `tiff` is set, they're saved as tiled TIFFs, with where each card is recorded in the
+    sheet index. If `merged_view` is set, the quarantined cards are tiled alongside the
+    approved ones. Returns the paths of the saved sheets.
+    """
+
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    tilings_path = get_card_path("card_tilings", quarantine, proof_scale is not None)
+
+    if card_names is not None:
+        sheets = [
+            sheet
+            for sheet in sheets
+            if any(card_name in card_names for _, card_name, _, _ in sheet.slots)
+        ]
+
+    if pdf:
+        sheets = [sheet for sheet in sheets if in_shard(sheet.num - 1, shard)]
+        if len(sheets) == 0:
+            return []
+
+        path = f"cards/{tilings_path}{sheets[0].kind}{f".shard{shard[0]}of{shard[1]}" if shard else ""}.pdf"
+        journal_item = f"{path}:{[sheet.num for sheet in sheets]}"
+        if is_journaled(journal_item):
+            return [path]
+
+        num_embedded = export_sheets_pdf(sheets, card_path, path)
+        record_done(journal_item, path)
+        num_cards = sum(len(sheet.slots) for sheet in sheets)
+        log(
+            f"Exported {len(sheets)} pages to {path} ({num_embedded} of {num_cards} cards embedded without re-encoding)."
+        )
+        return [path]
+
+    numbers = load_numbers(card_path)
+    sheets_table_path = get_table_path("tile_sheets", tilings_path)
+    sheet_contents = load_table(sheets_table_path)
+    sheet_index = load_sheet_index(tilings_path) if tiff else None
+
+    def index_sheet(sheet: TileSheet):
+        if sheet_index is None:
+            return
+
+        sheet_file = f"{sheet.file_name}.tif"
+        for card_name in [
+            card_name
+            for card_name, region in sheet_index.items()
+            if region["sheet"] == sheet_file
+        ]:
+            del sheet_index[card_name]
+        sheet_index.update(get_card_regions(sheet, proof_scale or 1))
+
+    paths = []
+    tiled_contents = {}
+    for sheet in sheets:
+        if not in_shard(sheet.num - 1, shard):
+            continue
 
-        log(f"""Tiling Basic Land "{basic_land_name}".""", do_print=False)
+        contents = get_sheet_contents(sheet, numbers)
+        if only_renumbered:
+            if sheet_contents.get(sheet.file_name) == contents:
+                continue
+            report_sheet_changes(sheet, sheet_contents.get(sheet.file_name), contents)
 
-        tile_row = num // TILING_WIDTH
-        tile_col = num % TILING_WIDTH
+        # finished by an earlier run that was interrupted
+        journal_item = f"{sheet.file_name}:{json.dumps(contents)}"
+        if is_journaled(journal_item):
+            paths.append(
+                f"cards/{tilings_path}{sheet.file_name}.{"tif" if tiff else "png"}"
+            )
+            tiled_contents[sheet.file_name] = contents
+            index_sheet(sheet)
+            continue
 
-        file_name = cardname_to_filename(basic_land_name)
-        basic_land_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-        if basic_land_image is None:
+        path = build_tile_sheet(sheet, card_path, tilings_path, proof_scale or 1, tiff)
+        if path is not None:
+            paths.append(path)
+            tiled_contents[sheet.file_name] = contents
+            index_sheet(sheet)
+            record_done(journal_item, path)
+
+    if shard is not None:
+        # each shard saves what's on the sheets it tiled to its own part of the table, so shards
+        # running at once don't overwrite each other's; the parts are merged with the manifests
+        shard_table_path = get_table_path("tile_sheets", tilings_path, shard)
+        save_json(shard_table_path, load_table(shard_table_path) | tiled_contents)
+    else:
+        save_json(sheets_table_path, sheet_contents | tiled_contents)
+    if sheet_index is not None:
+        save_json(f"cards/{tilings_path}{SHEET_INDEX}", sheet_index)
+    return paths
+
+
+def plan_card_sheets(
+    cards: dict[str, dict[str, str | dict[str, str]]],
+    only_updated: bool = False,
+    min_tile_num: int = 1,
+    max_tile_num: int = float("inf"),
+    quarantine: bool = True,
+    proof_scale: float = None,
+    merged_view: bool = False,
+) -> list[TileSheet]:
+    groups = []
+    for card_name in sort_by_date(cards):
+        card = cards[card_name]
+        if only_updated and card[UPDATED] == "FALSE":
             continue
 
-        try:
-            tiles.add_layer(
-                basic_land_image,
-                position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT),
-            )
-        except AttributeError:
-            log(
-                f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
-            )
+        groups.append(
+            [(card_name, "Battle" in card[CARD_TYPES])]
+            + [(backside[CARD_NAME], False) for backside in card["Transform Backsides"]]
+        )
 
-        if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-            finished_tiles = tiles.merge_layers()
-            if finished_tiles is not None:
-                log(f"\nCreating Basic Land Tile Set {tile_num}.\n")
-                finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}basic_lands{tile_num}.png")
-                tile_num += 1
-            tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-            num = 0
-        else:
-            num += 1
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    return plan_tile_sheets("cards", groups, card_path, min_tile_num, max_tile_num)
 
-    finished_tiles = tiles.merge_layers()
-    if finished_tiles is not None:
-        log(f"\nCreating Basic Land Tile Set {tile_num} (Final Tileset).\n")
-        finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}basic_lands{tile_num}.png")
 
+def plan_token_sheets(
+    tokens: dict[str, dict[str, str]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    merged_view: bool = False,
+) -> list[TileSheet]:
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    groups = [[(token_name, False)] for token_name in sort_by_date(tokens)]
+    return plan_tile_sheets("tokens", groups, card_path)
 
-def tile_alt_arts(
-    alt_arts: dict[str, dict[str, str | dict[str, str]]], quarantine: bool = True
-):
-    log(f"\n----- PROCESSING CARDS -----\n")
 
-    alt_art_name_list = list(alt_arts.keys())
-    alt_art_name_list.sort(
-        key=lambda alt_art_name: (
-            datetime.strptime(alt_arts[alt_art_name][CARD_DATE], "%m/%d/%Y"),
-            alt_arts[alt_art_name][CARD_NAME],
+def plan_basic_land_sheets(
+    basic_lands: dict[str, dict[str, str]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    merged_view: bool = False,
+) -> list[TileSheet]:
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    groups = [
+        [(basic_land_name, False)] for basic_land_name in sort_by_date(basic_lands)
+    ]
+    return plan_tile_sheets("basic_lands", groups, card_path)
+
+
+def plan_alt_art_sheets(
+    alt_arts: dict[str, dict[str, str | dict[str, str]]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    merged_view: bool = False,
+) -> list[TileSheet]:
+    groups = []
+    for alt_art_name in sort_by_date(alt_arts):
+        alt_art = alt_arts[alt_art_name]
+        groups.append(
+            [(alt_art_name, "Battle" in alt_art[CARD_TYPES])]
+            + [
+                (backside[CARD_NAME], False)
+                for backside in alt_art.get("Transform Backsides", [])
+            ]
         )
-    )
-
-    tile_num = 1
-    tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
 
-    num = 0
-    for alt_art_name in alt_art_name_list:
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    return plan_tile_sheets("alt_arts", groups, card_path)
 
-        alt_art = alt_arts[alt_art_name]
-        log(f"""Tiling "{alt_art_name}".""", do_print=False)
 
-        tile_row = num // TILING_WIDTH
-        tile_col = num % TILING_WIDTH
+def tile_cards(
+    cards: dict[str, dict[str, str | dict[str, str]]],
+    only_updated: bool = False,
+    min_tile_num: int = 1,
+    max_tile_num: int = float("inf"),
+    quarantine: bool = True,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    card_names: set[str] = None,
+    tiff: bool = False,
+    merged_view: bool = False,
+) -> list[str]:
+    log(f"\n----- PROCESSING{" UPDATED" if only_updated else ""} CARDS -----\n")
 
-        file_name = cardname_to_filename(alt_art_name)
-        alt_art_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-        if alt_art_image is None:
-            continue
+    sheets = plan_card_sheets(
+        cards,
+        only_updated,
+        min_tile_num,
+        max_tile_num,
+        quarantine,
+        proof_scale,
+        merged_view,
+    )
+    return build_tile_sheets(
+        sheets,
+        quarantine,
+        proof_scale,
+        shard,
+        only_renumbered,
+        pdf,
+        card_names,
+        tiff,
+        merged_view,
+    )
 
-        if "Battle" in alt_art[CARD_TYPES]:
-            alt_art_image = alt_art_image.rotate(90, expand=True)
-            alt_art_image = alt_art_image.resize(
-                (CARD_WIDTH, CARD_HEIGHT), Image.Resampling.LANCZOS
-            )
 
-        try:
-            tiles.add_layer(
-                alt_art_image, position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT)
-            )
-        except AttributeError:
-            log(
-                f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
-            )
+def tile_tokens(
+    tokens: dict[str, dict[str, str]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    card_names: set[str] = None,
+    tiff: bool = False,
+    merged_view: bool = False,
+) -> list[str]:
+    log(f"\n----- PROCESSING TOKENS -----\n")
 
-        if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-            finished_tiles = tiles.merge_layers()
-            if finished_tiles is not None:
-                log(f"\nCreating Alt Art Tile Set {tile_num}.\n")
-                finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}alt_arts{tile_num}.png")
-                tile_num += 1
-            tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-            num = 0
-        else:
-            num += 1
+    sheets = plan_token_sheets(tokens, quarantine, proof_scale, merged_view)
+    return build_tile_sheets(
+        sheets,
+        quarantine,
+        proof_scale,
+        shard,
+        only_renumbered,
+        pdf,
+        card_names,
+        tiff,
+        merged_view,
+    )
 
-        for backside in alt_art.get("Transform Backsides", []):
 
-            backside_name = backside[CARD_NAME]
-            log(f"""\tTiling "{backside_name}".""", do_print=False)
+def tile_basic_lands(
+    basic_lands: dict[str, dict[str, str]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    card_names: set[str] = None,
+    tiff: bool = False,
+    merged_view: bool = False,
+) -> list[str]:
+    log(f"\n----- PROCESSING BASIC LANDS -----\n")
 
-            tile_row = num // TILING_WIDTH
-            tile_col = num % TILING_WIDTH
+    sheets = plan_basic_land_sheets(basic_lands, quarantine, proof_scale, merged_view)
+    return build_tile_sheets(
+        sheets,
+        quarantine,
+        proof_scale,
+        shard,
+        only_renumbered,
+        pdf,
+        card_names,
+        tiff,
+        merged_view,
+    )
 
-            file_name = cardname_to_filename(backside_name)
-            backside_image = open_card_file(file_name, f"processed_cards/{"quarantine/" if quarantine else ""}")
-            if backside_image is None:
-                continue
 
-            try:
-                tiles.add_layer(
-                    backside_image,
-                    position=(tile_col * CARD_WIDTH, tile_row * CARD_HEIGHT),
-                )
-            except AttributeError:
-                log(
-                    f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
-                )
-
-            if tile_row == TILING_HEIGHT - 1 and tile_col == TILING_WIDTH - 1:
-                finished_tiles = tiles.merge_layers()
-                if finished_tiles is not None:
-                    log(f"\nCreating Alt Art Tile Set {tile_num}.\n")
-                    finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}alt_arts{tile_num}.png")
-                    tile_num += 1
-                tiles = Card(CARD_WIDTH * TILING_WIDTH, CARD_HEIGHT * TILING_HEIGHT)
-                num = 0
-            else:
-                num += 1
-
-    finished_tiles = tiles.merge_layers()
-    if finished_tiles is not None:
-        log(f"\nCreating Alt Art Tile Set {tile_num} (Final Tileset).\n")
-        finished_tiles.save(f"cards/card_tilings/{"quarantine/" if quarantine else ""}alt_arts{tile_num}.png")
+def tile_alt_arts(
+    alt_arts: dict[str, dict[str, str | dict[str, str]]],
+    quarantine: bool = True,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    card_names: set[str] = None,
+    tiff: bool = False,
+    merged_view: bool = False,
+) -> list[str]:
+    log(f"\n----- PROCESSING ALT ARTS -----\n")
+
+    sheets = plan_alt_art_sheets(alt_arts, quarantine, proof_scale, merged_view)
+    return build_tile_sheets(
+        sheets,
+        quarantine,
+        proof_scale,
+        shard,
+        only_renumbered,
+        pdf,
+        card_names,
+        tiff,
+        merged_view,
+    )
 
 
 def main(
@@ -357,24 +657,141 @@ def main(
     do_alt_arts: bool = True,
     only_updated: bool = False,
     starting_card_num: int = 1,
-    ending_card_num: int = float('inf'),
+    ending_card_num: int = float("inf"),
     quarantine: bool = False,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    merge_shards: bool = False,
+    max_memory: int = None,
+    only_renumbered: bool = False,
+    pdf: bool = False,
+    where: list[tuple] = None,
+    resume: bool = False,
+    tiff: bool = False,
+    merged_view: bool = False,
 ):
+    begin_startup()
+    if not resume:
+        reset_log()
+    set_memory_limit(max_memory * 2**20 if max_memory is not None else None)
+
+    if merge_shards:
+        if merge_shard_manifests("card_tiling"):
+            merge_shard_tables("tile_sheets")
+        return
+
+    start_journal(
+        "card_tiling",
+        {
+            "kinds": [do_cards, do_tokens, do_basic_lands, do_alt_arts],
+            "only_updated": only_updated,
+            "tile_nums": [starting_card_num, ending_card_num],
+            "quarantine": quarantine,
+            "proof_scale": proof_scale,
+            "shard": shard,
+            "only_renumbered": only_renumbered,
+            "pdf": pdf,
+            "where": where,
+            "tiff": tiff,
+            "merged_view": merged_view,
+        },
+        resume,
+    )
 
-    reset_log()
-    cards, tokens, basic_lands, alt_arts = process_spreadsheets()
+    # start reading the spreadsheets and listing the processed cards while the run gets going
+    spreadsheets = Spreadsheets()
+    spreadsheets.read_in_background(
+        *(["cards"] if do_cards else []),
+        *(["tokens"] if do_tokens else []),
+        *(["basic_lands"] if do_basic_lands else []),
+        *(["alt_arts"] if do_alt_arts else []),
+    )
+    card_path = get_source_path(quarantine, proof_scale is not None, merged_view)
+    for path in [card_path] if isinstance(card_path, str) else card_path:
+        in_background(f"Listing {path[:-1]}", list_card_files, path)
+
+    def get_card_names(kind: str) -> set[str] | None:
+        if where is None:
+            return None
+        return select_cards(spreadsheets, (kind,), where)
+
+    if proof_scale is not None:
+        os.makedirs(
+            f"cards/{get_card_path("card_tilings", quarantine, proof=True)}",
+            exist_ok=True,
+        )
 
+    paths = []
     if do_cards:
-        tile_cards(cards, only_updated, starting_card_num, ending_card_num, quarantine)
+        with memory_stage("Card Sheets"):
+            paths += tile_cards(
+                spreadsheets.cards,
+                only_updated,
+                starting_card_num,
+                ending_card_num,
+                quarantine,
+                proof_scale,
+                shard,
+                only_renumbered,
+                pdf,
+                get_card_names("cards"),
+                tiff,
+                merged_view,
+            )
 
     if do_tokens:
-        tile_tokens(tokens, quarantine)
+        with memory_stage("Token Sheets"):
+            paths += tile_tokens(
+                spreadsheets.tokens,
+                quarantine,
+                proof_scale,
+                shard,
+                only_renumbered,
+                pdf,
+                get_card_names("tokens"),
+                tiff,
+                merged_view,
+            )
 
     if do_basic_lands:
-        tile_basic_lands(basic_lands, quarantine)
+        with memory_stage("Basic Land Sheets"):
+            paths += tile_basic_lands(
+                spreadsheets.basic_lands,
+                quarantine,
+                proof_scale,
+                shard,
+                only_renumbered,
+                pdf,
+                get_card_names("basic_lands"),
+                tiff,
+                merged_view,
+            )
 
     if do_alt_arts:
-        tile_alt_arts(alt_arts, quarantine)
+        with memory_stage("Alt Art Sheets"):
+            paths += tile_alt_arts(
+                spreadsheets.alt_arts,
+                quarantine,
+                proof_scale,
+                shard,
+                only_renumbered,
+                pdf,
+                get_card_names("alt_arts"),
+                tiff,
+                merged_view,
+            )
+
+    if shard is not None:
+        write_shard_manifest(
+            "card_tiling",
+            shard,
+            {os.path.basename(path)[:-4]: path for path in paths},
+        )
+    finish_journal()
+
+    report_unchanged_writes()
+    report_startup()
+    report_memory()
 
 
 if __name__ == "__main__":
@@ -427,7 +844,7 @@ if __name__ == "__main__":
         "-ecn",
         "--ending-card-num",
         type=int,
-        default=float('inf'),
+        default=float("inf"),
         help="Put all the cards generated into a quarantine folder.",
         dest="ending_card_num",
     )
@@ -438,6 +855,87 @@ if __name__ == "__main__":
         help="Put all the cards generated into a quarantine folder.",
         dest="quarantine",
     )
+    parser.add_argument(
+        "-p",
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Tile the proofs rendered at this fraction of full size (e.g. 0.25) from 'cards/proof'.",
+        dest="proof_scale",
+    )
+    parser.add_argument(
+        "-s",
+        "--shard",
+        type=parse_shard,
+        metavar="i/N",
+        help="Only tile every Nth sheet of each kind, starting from the ith.",
+        dest="shard",
+    )
+    parser.add_argument(
+        "-ms",
+        "--merge-shards",
+        action="store_true",
+        help="Merge the manifests written by every shard of a run, then exit.",
+        dest="merge_shards",
+    )
+    parser.add_argument(
+        "-mm",
+        "--max-memory",
+        type=int,
+        metavar="MB",
+        help="Keep the images in memory under this many megabytes where possible.",
+        dest="max_memory",
+    )
+
+    parser.add_argument(
+        "-rn",
+        "--renumbered",
+        action="store_true",
+        help="Only tile the sheets whose cards or collector numbers changed since they were last tiled.",
+        dest="only_renumbered",
+    )
+
+    parser.add_argument(
+        "-pdf",
+        "--pdf",
+        action="store_true",
+        help="Export each kind of sheet as a print-ready PDF, one page per sheet, instead of tiling them into images.",
+        dest="pdf",
+    )
+
+    parser.add_argument(
+        "-tif",
+        "--tiff",
+        action="store_true",
+        help="Save the sheets as tiled TIFFs with an index of where each card is, so single cards can be extracted with tiff_export.py.",
+        dest="tiff",
+    )
+
+    parser.add_argument(
+        "-mv",
+        "--merged-view",
+        action="store_true",
+        help="Tile the quarantined cards alongside the approved ones, using the quarantined version of a card where there are both.",
+        dest="merged_view",
+    )
+
+    parser.add_argument(
+        "-wh",
+        "--where",
+        nargs="+",
+        type=parse_where,
+        metavar="FIELD=VALUE",
+        help=f"Only tile the sheets with a card meeting every condition, e.g. 'archetype=Poker' 'date>=2024-01-01'. Fields: {", ".join(WHERE_FIELDS)}.",
+        dest="where",
+    )
+
+    parser.add_argument(
+        "-re",
+        "--resume",
+        action="store_true",
+        help="Pick up an interrupted run where it left off, skipping the sheets it already finished (run with the same options).",
+        dest="resume",
+    )
 
     args = parser.parse_args()
     main(
@@ -449,4 +947,14 @@ if __name__ == "__main__":
         args.starting_card_num,
         args.ending_card_num,
         args.quarantine,
+        args.proof_scale,
+        args.shard,
+        args.merge_shards,
+        args.max_memory,
+        args.only_renumbered,
+        args.pdf,
+        args.where,
+        args.resume,
+        args.tiff,
+        args.merged_view,
     )
@@ -5,8 +5,20 @@ Automatically adds collection info to cards based on our ranking spreadsheet.
 import argparse
 from datetime import datetime
 import os
-
-from common import cardname_to_filename, open_card_file, process_spreadsheets
+import time
+from typing import TYPE_CHECKING
+
+from common import (
+    cardname_to_filename,
+    find_card_file,
+    forget_card_files,
+    get_card_path,
+    list_card_files,
+    parse_proof_scale,
+    process_spreadsheets,
+    report_unchanged_writes,
+    save_json,
+)
 from constants import (
     ARCHETYPE,
     BATTLE_CARD_MULT,
@@ -15,25 +27,59 @@ from constants import (
     CARD_NAME,
     CARD_RARITY,
     CARD_TYPES,
+    KIND_ALT_ART,
+    KIND_BASIC_LAND,
+    KIND_CARD,
+    KIND_TOKEN,
     NUMBER_WIDTHS,
+    OUTPUT_TARGETS,
     POKER_BORDERS,
+    SPREADSHEETS,
     UPDATED,
+    WATCH_DEBOUNCE,
+    WATCH_POLL_INTERVAL,
+    WHERE_FIELDS,
 )
+from journal import finish_journal, is_journaled, record_done, start_journal
 from log import log, reset_log
-from model.Card import Card
+from memory import memory_stage, report_memory, set_memory_limit
+from model.RenderJob import RenderJob
+from model.Spreadsheets import Spreadsheets
+from numbering import (
+    get_table_path,
+    is_renumbered,
+    load_table,
+    merge_shard_tables,
+    record_numbers,
+    report_renumbering,
+)
+from outputs import save_card, set_output_targets
+from preflight import failed_preflight, run_preflight
+from selection import parse_where, select_cards
+from shards import in_shard, merge_shard_manifests, parse_shard, write_shard_manifest
+from startup import begin_startup, in_background, report_startup
 
+if TYPE_CHECKING:
+    # Pillow and everything that renders or tiles cards are imported the first time a card
+    # is rendered or tiled, so runs that don't (like only writing the report) start faster
+    from PIL import Image
 
-def process_card(
+    from model.Card import Card
+
+
+def layout_card(
     card: dict[str, str | dict[str, str]],
     card_num: int,
     num_cards: int,
     parent_card: dict[str, str | dict[str, str]] = None,
-    quarantine: bool = False,
-):
+    proof_scale: float = None,
+) -> "Card | None":
+    from model.Card import Card
+
     file_name = cardname_to_filename(card[CARD_NAME])
 
-    base_card = open_card_file(file_name)
-    if base_card is None:
+    base_card_path = find_card_file(file_name)
+    if base_card_path is None:
         return
 
     if "Battle" in card[CARD_TYPES]:
@@ -49,7 +95,7 @@ def process_card(
         width_mult = 1
         orientation = "vertical"
 
-    card_overlay = Card(card_width, card_height)
+    card_overlay = Card(card_width, card_height, scale=proof_scale or 1)
 
     if parent_card is None:
         archetype = card[ARCHETYPE]
@@ -92,27 +138,51 @@ def process_card(
             )
         offset += NUMBER_WIDTHS[char]
 
-    card_overlay.add_layer(base_card, 0)
+    card_overlay.add_layer(base_card_path, 0, asset=False)
+
+    return card_overlay
+
+
+def process_card(
+    card: dict[str, str | dict[str, str]],
+    card_num: int,
+    num_cards: int,
+    parent_card: dict[str, str | dict[str, str]] = None,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    save: bool = True,
+) -> "Image.Image | None":
+    card_overlay = layout_card(card, card_num, num_cards, parent_card, proof_scale)
+    if card_overlay is None:
+        return
+
+    file_name = cardname_to_filename(card[CARD_NAME])
 
     final_card = card_overlay.merge_layers()
-    final_card.save(
-        f"cards/processed_cards/{"quarantine/" if quarantine else ""}{file_name}.png"
-    )
-    log(
-        f"""{"\t" if parent_card is not None else ""}Successfully processed "{card[CARD_NAME]}"."""
-    )
+    if save:
+        save_card(final_card, file_name, quarantine, proof_scale is not None)
+        log(
+            f"""{"\t" if parent_card is not None else ""}Successfully processed "{card[CARD_NAME]}"."""
+        )
 
+    return final_card
+
+
+def layout_token(
+    token: dict[str, str],
+    token_num: int,
+    num_tokens: int,
+    proof_scale: float = None,
+) -> "Card | None":
+    from model.Card import Card
 
-def process_token(
-    token: dict[str, str], token_num: int, num_tokens: int, quarantine: bool = False
-):
     file_name = cardname_to_filename(token[CARD_NAME])
 
-    base_token = open_card_file(file_name)
-    if base_token is None:
+    base_token_path = find_card_file(file_name)
+    if base_token_path is None:
         return
 
-    token_overlay = Card()
+    token_overlay = Card(scale=proof_scale or 1)
 
     token_overlay.add_layer("images/standard/borders/black.png")
 
@@ -132,28 +202,48 @@ def process_token(
         )
         offset += NUMBER_WIDTHS[char]
 
-    token_overlay.add_layer(base_token, 0)
+    token_overlay.add_layer(base_token_path, 0, asset=False)
+
+    return token_overlay
+
+
+def process_token(
+    token: dict[str, str],
+    token_num: int,
+    num_tokens: int,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    save: bool = True,
+) -> "Image.Image | None":
+    token_overlay = layout_token(token, token_num, num_tokens, proof_scale)
+    if token_overlay is None:
+        return
+
+    file_name = cardname_to_filename(token[CARD_NAME])
 
     final_token = token_overlay.merge_layers()
-    final_token.save(
-        f"cards/processed_cards/{"quarantine/" if quarantine else ""}{file_name}.png"
-    )
-    log(f"""Successfully processed "{file_name}".""")
+    if save:
+        save_card(final_token, file_name, quarantine, proof_scale is not None)
+        log(f"""Successfully processed "{file_name}".""")
 
+    return final_token
 
-def process_basic_land(
+
+def layout_basic_land(
     basic_land: dict[str, str],
     basic_land_num: int,
     num_cards: int,
-    quarantine: bool = False,
-):
+    proof_scale: float = None,
+) -> "Card | None":
+    from model.Card import Card
+
     file_name = cardname_to_filename(basic_land[CARD_NAME])
 
-    base_basic_land = open_card_file(file_name)
-    if base_basic_land is None:
+    base_basic_land_path = find_card_file(file_name)
+    if base_basic_land_path is None:
         return
 
-    basic_land_overlay = Card()
+    basic_land_overlay = Card(scale=proof_scale or 1)
 
     basic_land_overlay.add_layer("images/standard/borders/black.png")
 
@@ -173,26 +263,48 @@ def process_basic_land(
         )
         offset += NUMBER_WIDTHS[char]
 
-    basic_land_overlay.add_layer(base_basic_land, 0)
+    basic_land_overlay.add_layer(base_basic_land_path, 0, asset=False)
 
-    final_basic_land = basic_land_overlay.merge_layers()
-    final_basic_land.save(
-        f"cards/processed_cards/{"quarantine/" if quarantine else ""}{file_name}.png"
+    return basic_land_overlay
+
+
+def process_basic_land(
+    basic_land: dict[str, str],
+    basic_land_num: int,
+    num_cards: int,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    save: bool = True,
+) -> "Image.Image | None":
+    basic_land_overlay = layout_basic_land(
+        basic_land, basic_land_num, num_cards, proof_scale
     )
-    log(f"""Successfully processed "{file_name}".""")
+    if basic_land_overlay is None:
+        return
+
+    file_name = cardname_to_filename(basic_land[CARD_NAME])
+
+    final_basic_land = basic_land_overlay.merge_layers()
+    if save:
+        save_card(final_basic_land, file_name, quarantine, proof_scale is not None)
+        log(f"""Successfully processed "{file_name}".""")
 
+    return final_basic_land
 
-def process_alt_art(
+
+def layout_alt_art(
     alt_art: dict[str, str],
     alt_art_num: int,
     num_alt_arts: int,
     parent_alt_art: dict[str, str] = None,
-    quarantine: bool = False,
-):
+    proof_scale: float = None,
+) -> "Card | None":
+    from model.Card import Card
+
     file_name = cardname_to_filename(alt_art[CARD_NAME])
 
-    base_alt_art = open_card_file(file_name)
-    if base_alt_art is None:
+    base_alt_art_path = find_card_file(file_name)
+    if base_alt_art_path is None:
         return
 
     if "Battle" in alt_art[CARD_TYPES]:
@@ -208,7 +320,7 @@ def process_alt_art(
         width_mult = 1
         orientation = "vertical"
 
-    alt_art_overlay = Card(card_width, card_height)
+    alt_art_overlay = Card(card_width, card_height, scale=proof_scale or 1)
 
     if parent_alt_art is None:
         archetype = alt_art[ARCHETYPE]
@@ -250,45 +362,275 @@ def process_alt_art(
     if "Foil" in file_name:
         alt_art_overlay.add_layer(f"images/{frame_type}/overlays/foil.png")
 
-    alt_art_overlay.add_layer(base_alt_art, 0)
+    alt_art_overlay.add_layer(base_alt_art_path, 0, asset=False)
 
-    final_alt_art = alt_art_overlay.merge_layers()
-    final_alt_art.save(
-        f"cards/processed_cards/{"quarantine/" if quarantine else ""}{file_name}.png"
-    )
-    log(
-        f"""{"\t" if parent_alt_art is not None else ""}Successfully processed "{file_name}"."""
+    return alt_art_overlay
+
+
+def process_alt_art(
+    alt_art: dict[str, str],
+    alt_art_num: int,
+    num_alt_arts: int,
+    parent_alt_art: dict[str, str] = None,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    save: bool = True,
+) -> "Image.Image | None":
+    alt_art_overlay = layout_alt_art(
+        alt_art, alt_art_num, num_alt_arts, parent_alt_art, proof_scale
     )
+    if alt_art_overlay is None:
+        return
 
+    file_name = cardname_to_filename(alt_art[CARD_NAME])
 
-def process_cards(
+    final_alt_art = alt_art_overlay.merge_layers()
+    if save:
+        save_card(final_alt_art, file_name, quarantine, proof_scale is not None)
+        log(
+            f"""{"\t" if parent_alt_art is not None else ""}Successfully processed "{file_name}"."""
+        )
+
+    return final_alt_art
+
+
+def sort_by_date(
+    cards: dict[str, dict[str, str]], name_first: bool = False
+) -> list[str]:
+    card_name_list = list(cards.keys())
+    if name_first:
+        card_name_list.sort(
+            key=lambda card_name: (
+                cards[card_name][CARD_NAME],
+                datetime.strptime(cards[card_name][CARD_DATE], "%m/%d/%Y"),
+            )
+        )
+    else:
+        card_name_list.sort(
+            key=lambda card_name: (
+                datetime.strptime(cards[card_name][CARD_DATE], "%m/%d/%Y"),
+                cards[card_name][CARD_NAME],
+            )
+        )
+    return card_name_list
+
+
+def get_card_jobs(
+    cards: dict[str, dict[str, str | dict[str, str]]], num_cards: int
+) -> list[RenderJob]:
+    jobs = []
+    for num, card_name in enumerate(sort_by_date(cards)):
+        card = cards[card_name]
+        jobs.append(RenderJob(KIND_CARD, card, num + 1, len(cards)))
+        for backside in card["Transform Backsides"]:
+            jobs.append(RenderJob(KIND_CARD, backside, num + 1, num_cards, card))
+    return jobs
+
+
+def get_token_jobs(
+    tokens: dict[str, dict[str, str]], num_tokens: int
+) -> list[RenderJob]:
+    return [
+        RenderJob(KIND_TOKEN, tokens[token_name], num + 1, num_tokens)
+        for num, token_name in enumerate(sort_by_date(tokens))
+    ]
+
+
+def get_basic_land_jobs(
+    basic_lands: dict[str, dict[str, str]], num_cards: int, num_basic_lands: int
+) -> list[RenderJob]:
+    return [
+        RenderJob(
+            KIND_BASIC_LAND,
+            basic_lands[basic_land_name],
+            num_cards - num_basic_lands + num + 1,
+            num_cards,
+        )
+        for num, basic_land_name in enumerate(
+            sort_by_date(basic_lands, name_first=True)
+        )
+    ]
+
+
+def get_alt_art_jobs(
+    alt_arts: dict[str, dict[str, str | dict[str, str]]], num_alt_arts: int
+) -> list[RenderJob]:
+    jobs = []
+    for num, alt_art_name in enumerate(sort_by_date(alt_arts)):
+        alt_art = alt_arts[alt_art_name]
+        jobs.append(RenderJob(KIND_ALT_ART, alt_art, num + 1, num_alt_arts))
+        for backside in alt_art.get("Transform Backsides", []):
+            jobs.append(
+                RenderJob(KIND_ALT_ART, backside, num + 1, num_alt_arts, alt_art)
+            )
+    return jobs
+
+
+def get_render_jobs(
     cards: dict[str, dict[str, str | dict[str, str]]],
-    num_cards: int,
+    tokens: dict[str, dict[str, str]],
+    basic_lands: dict[str, dict[str, str]],
+    alt_arts: dict[str, dict[str, str | dict[str, str]]],
+) -> list[RenderJob]:
+    """
+    Get every card that can be rendered, numbered, in the order they get rendered in.
+    """
+
+    num_mainline_cards = len(cards) + len(basic_lands)
+    return (
+        get_card_jobs(cards, num_mainline_cards)
+        + get_token_jobs(tokens, len(tokens))
+        + get_basic_land_jobs(basic_lands, num_mainline_cards, len(basic_lands))
+        + get_alt_art_jobs(alt_arts, len(alt_arts))
+    )
+
+
+def layout_job(job: RenderJob, proof_scale: float = None) -> "Card | None":
+    """
+    Lay out the job's card without decoding any of its layers.
+    Returns None if its source image couldn't be found.
+    """
+
+    if job.kind == KIND_CARD:
+        return layout_card(
+            job.card, job.number, job.num_cards, job.parent_card, proof_scale
+        )
+    elif job.kind == KIND_TOKEN:
+        return layout_token(job.card, job.number, job.num_cards, proof_scale)
+    elif job.kind == KIND_BASIC_LAND:
+        return layout_basic_land(job.card, job.number, job.num_cards, proof_scale)
+    elif job.kind == KIND_ALT_ART:
+        return layout_alt_art(
+            job.card, job.number, job.num_cards, job.parent_card, proof_scale
+        )
+
+
+def render_job(
+    job: RenderJob,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    save: bool = True,
+) -> "Image.Image | None":
+    """
+    Render the job's card, saving it to the processed cards unless told not to.
+    Returns the rendered card, or None if its source image couldn't be found.
+    """
+
+    if job.kind == KIND_CARD:
+        return process_card(
+            job.card,
+            job.number,
+            job.num_cards,
+            parent_card=job.parent_card,
+            quarantine=quarantine,
+            proof_scale=proof_scale,
+            save=save,
+        )
+    elif job.kind == KIND_TOKEN:
+        return process_token(
+            job.card,
+            job.number,
+            job.num_cards,
+            quarantine=quarantine,
+            proof_scale=proof_scale,
+            save=save,
+        )
+    elif job.kind == KIND_BASIC_LAND:
+        return process_basic_land(
+            job.card,
+            job.number,
+            job.num_cards,
+            quarantine=quarantine,
+            proof_scale=proof_scale,
+            save=save,
+        )
+    elif job.kind == KIND_ALT_ART:
+        return process_alt_art(
+            job.card,
+            job.number,
+            job.num_cards,
+            parent_alt_art=job.parent_card,
+            quarantine=quarantine,
+            proof_scale=proof_scale,
+            save=save,
+        )
+
+
+def render_jobs(
+    jobs: list[RenderJob],
     only_updated: bool = False,
     card_names_to_process: list[str] = None,
     quarantine: bool = False,
-):
-    log(f"\n----- PROCESSING{" UPDATED" if only_updated else ""} CARDS -----\n")
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    previous_numbers: dict[str, dict[str, str]] = None,
+) -> list[RenderJob]:
+    """
+    Render the jobs that pass the filters. If `previous_numbers` is given, only the jobs whose
+    collector number differs from the one they were last rendered with are rendered.
+    Returns the jobs that were rendered.
+    """
+
+    if previous_numbers is not None:
+        report_renumbering(previous_numbers, jobs)
+
+    card_path = get_card_path("processed_cards", quarantine, proof_scale is not None)
+    rendered_jobs = []
+    for index, job in enumerate(jobs):
+        if not in_shard(index, shard):
+            continue
 
-    card_name_list = list(cards.keys())
-    card_name_list.sort(
-        key=lambda card_name: (
-            datetime.strptime(cards[card_name][CARD_DATE], "%m/%d/%Y"),
-            cards[card_name][CARD_NAME],
-        )
-    )
+        if (
+            card_names_to_process is not None
+            and job.root_name not in card_names_to_process
+        ):
+            continue
 
-    for num, card_name in enumerate(card_name_list):
-        if card_names_to_process is not None and card_name not in card_names_to_process:
+        root_card = job.parent_card if job.parent_card is not None else job.card
+        if only_updated and root_card[UPDATED] == "FALSE":
             continue
 
-        card = cards[card_name]
-        if only_updated and card[UPDATED] == "FALSE":
+        if previous_numbers is not None and not is_renumbered(previous_numbers, job):
             continue
 
-        process_card(card, num + 1, len(cards), quarantine=quarantine)
-        for backside in card["Transform Backsides"]:
-            process_card(backside, num + 1, num_cards, parent_card=card, quarantine=quarantine)
+        if failed_preflight(job.name):
+            log(f"""Skipping "{job.name}", which failed preflight.""")
+            continue
+
+        # finished by an earlier run that was interrupted
+        journal_item = f"{job.kind}:{job.name}:{job.collector_number}"
+        if is_journaled(journal_item):
+            rendered_jobs.append(job)
+            continue
+
+        if render_job(job, quarantine, proof_scale) is not None:
+            rendered_jobs.append(job)
+            record_done(journal_item, f"cards/{card_path}{job.file_name}.png")
+
+    return rendered_jobs
+
+
+def process_cards(
+    cards: dict[str, dict[str, str | dict[str, str]]],
+    num_cards: int,
+    only_updated: bool = False,
+    card_names_to_process: list[str] = None,
+    quarantine: bool = False,
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    previous_numbers: dict[str, dict[str, str]] = None,
+) -> list[RenderJob]:
+    log(f"\n----- PROCESSING{" UPDATED" if only_updated else ""} CARDS -----\n")
+
+    return render_jobs(
+        get_card_jobs(cards, num_cards),
+        only_updated,
+        card_names_to_process,
+        quarantine,
+        proof_scale,
+        shard,
+        previous_numbers,
+    )
 
 
 def process_tokens(
@@ -296,27 +638,21 @@ def process_tokens(
     num_tokens: int,
     card_names_to_process: list[str] = None,
     quarantine: bool = False,
-):
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    previous_numbers: dict[str, dict[str, str]] = None,
+) -> list[RenderJob]:
     log("\n----- PROCESSING TOKENS -----\n")
 
-    token_name_list = list(tokens.keys())
-    token_name_list.sort(
-        key=lambda token_name: (
-            datetime.strptime(tokens[token_name][CARD_DATE], "%m/%d/%Y"),
-            tokens[token_name][CARD_NAME],
-        )
+    return render_jobs(
+        get_token_jobs(tokens, num_tokens),
+        card_names_to_process=card_names_to_process,
+        quarantine=quarantine,
+        proof_scale=proof_scale,
+        shard=shard,
+        previous_numbers=previous_numbers,
     )
 
-    for num, token_name in enumerate(token_name_list):
-        if (
-            card_names_to_process is not None
-            and token_name not in card_names_to_process
-        ):
-            continue
-
-        token = tokens[token_name]
-        process_token(token, num + 1, num_tokens, quarantine=quarantine)
-
 
 def process_basic_lands(
     basic_lands: dict[str, dict[str, str]],
@@ -324,58 +660,42 @@ def process_basic_lands(
     num_basic_lands: int,
     card_names_to_process: list[str] = None,
     quarantine: bool = False,
-):
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    previous_numbers: dict[str, dict[str, str]] = None,
+) -> list[RenderJob]:
     log("\n----- PROCESSING BASIC LANDS -----\n")
 
-    basic_land_name_list = list(basic_lands.keys())
-    basic_land_name_list.sort(
-        key=lambda basic_land_name: (
-            basic_lands[basic_land_name][CARD_NAME],
-            datetime.strptime(basic_lands[basic_land_name][CARD_DATE], "%m/%d/%Y"),
-        )
+    return render_jobs(
+        get_basic_land_jobs(basic_lands, num_cards, num_basic_lands),
+        card_names_to_process=card_names_to_process,
+        quarantine=quarantine,
+        proof_scale=proof_scale,
+        shard=shard,
+        previous_numbers=previous_numbers,
     )
 
-    for num, basic_land_name in enumerate(basic_land_name_list):
-        if (
-            card_names_to_process is not None
-            and basic_land_name not in card_names_to_process
-        ):
-            continue
-
-        basic_land = basic_lands[basic_land_name]
-        process_basic_land(
-            basic_land, num_cards - num_basic_lands + num + 1, num_cards, quarantine=quarantine
-        )
-
 
 def process_alt_arts(
     alt_arts: dict[str, dict[str, str]],
     num_alt_arts: int,
     card_names_to_process: list[str] = None,
     quarantine: bool = False,
-):
+    proof_scale: float = None,
+    shard: tuple[int, int] = None,
+    previous_numbers: dict[str, dict[str, str]] = None,
+) -> list[RenderJob]:
     log("\n----- PROCESSING ALT ARTS -----\n")
 
-    alt_arts_name_list = list(alt_arts.keys())
-    alt_arts_name_list.sort(
-        key=lambda alt_art_name: (
-            datetime.strptime(alt_arts[alt_art_name][CARD_DATE], "%m/%d/%Y"),
-            alt_arts[alt_art_name][CARD_NAME],
-        )
+    return render_jobs(
+        get_alt_art_jobs(alt_arts, num_alt_arts),
+        card_names_to_process=card_names_to_process,
+        quarantine=quarantine,
+        proof_scale=proof_scale,
+        shard=shard,
+        previous_numbers=previous_numbers,
     )
 
-    for num, alt_art_name in enumerate(alt_arts_name_list):
-        if (
-            card_names_to_process is not None
-            and alt_art_name not in card_names_to_process
-        ):
-            continue
-
-        alt_art = alt_arts[alt_art_name]
-        process_alt_art(alt_art, num + 1, num_alt_arts, quarantine=quarantine)
-        for backside in alt_art.get("Transform Backsides", []):
-            process_alt_art(backside, num + 1, num_alt_arts, parent_alt_art=alt_art, quarantine=quarantine)
-
 
 def generate_report(
     cards: dict[str, dict[str, str | dict[str, str]]],
@@ -385,7 +705,7 @@ def generate_report(
 ):
     unprocessed_cards = [
         f[:-4].replace("’", "'")
-        for f in os.listdir("cards/unprocessed_cards")
+        for f in list_card_files("unprocessed_cards/")
         if f.endswith(".png")
     ]
 
@@ -415,7 +735,7 @@ def generate_report(
 
     processed_cards = [
         f[:-4].replace("’", "'")
-        for f in os.listdir("cards/processed_cards")
+        for f in list_card_files("processed_cards/")
         if f.endswith(".png")
     ]
 
@@ -423,11 +743,13 @@ def generate_report(
 
     quarantined_processed_cards = [
         f[:-4].replace("’", "'")
-        for f in os.listdir("cards/processed_cards/quarantine")
+        for f in list_card_files("processed_cards/quarantine/")
         if f.endswith(".png")
     ]
 
-    extra3 = set(unprocessed_cards) - set(processed_cards) - set(quarantined_processed_cards)
+    extra3 = (
+        set(unprocessed_cards) - set(processed_cards) - set(quarantined_processed_cards)
+    )
 
     with open("report.txt", "w", encoding="utf8") as report_file:
         report_file.write("----- UNPROCESSED CARDS NOT IN SPREADSHEETS -----\n\n")
@@ -438,11 +760,15 @@ def generate_report(
         for name in extra2:
             report_file.write(f"{name}\n")
 
-        report_file.write("\n\n----- CARDS NOT PROCESSED NORMALLY OR QUARANTINED -----\n\n")
+        report_file.write(
+            "\n\n----- CARDS NOT PROCESSED NORMALLY OR QUARANTINED -----\n\n"
+        )
         for name in extra3:
             report_file.write(f"{name}\n")
 
-        report_file.write("\n\n----- PROCESSED CARDS BOTH IN AND OUT OF QUARANTINE -----\n\n")
+        report_file.write(
+            "\n\n----- PROCESSED CARDS BOTH IN AND OUT OF QUARANTINE -----\n\n"
+        )
         for name in quarantined_processed_cards:
             if name in processed_cards:
                 report_file.write(f"{name}\n")
@@ -450,6 +776,196 @@ def generate_report(
     log("\n----- PROCESSED REPORT -----\n")
 
 
+def get_job_signature(job: RenderJob) -> tuple:
+    """
+    Get everything about a job that ends up on the rendered card, so changed cards can be spotted.
+    """
+
+    rows = [job.card] if job.parent_card is None else [job.card, job.parent_card]
+    return (
+        job.kind,
+        job.collector_number,
+        tuple(
+            tuple((key, value) for key, value in row.items() if isinstance(value, str))
+            for row in rows
+        ),
+    )
+
+
+def get_file_states(paths: list[str]) -> dict[str, tuple[int, int]]:
+    file_states = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        file_states[path] = (stat.st_size, stat.st_mtime_ns)
+    return file_states
+
+
+def get_source_states() -> dict[str, tuple[int, int]]:
+    return get_file_states(
+        [
+            f"cards/unprocessed_cards/{f}"
+            for f in os.listdir("cards/unprocessed_cards")
+            if f.endswith(".png")
+        ]
+    )
+
+
+def watch(
+    spreadsheets: tuple[dict, dict, dict, dict],
+    kinds: set[str],
+    quarantine: bool = False,
+    proof_scale: float = None,
+    retile: bool = False,
+):
+    """
+    Re-render cards whenever their source image or spreadsheet row changes (including their
+    collector number shifting), until interrupted.
+    """
+
+    log("\n----- WATCHING FOR CHANGES -----\n")
+
+    jobs = [job for job in get_render_jobs(*spreadsheets) if job.kind in kinds]
+    signatures = {job.name: get_job_signature(job) for job in jobs}
+    sheet_states = get_file_states(SPREADSHEETS)
+    source_states = get_source_states()
+
+    changed_sources = set()
+    spreadsheets_changed = False
+    last_change = None
+
+    try:
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+
+            new_sheet_states = get_file_states(SPREADSHEETS)
+            if new_sheet_states != sheet_states:
+                sheet_states = new_sheet_states
+                spreadsheets_changed = True
+                last_change = time.monotonic()
+
+            new_source_states = get_source_states()
+            for path, state in new_source_states.items():
+                if source_states.get(path) != state:
+                    changed_sources.add(path)
+                    last_change = time.monotonic()
+            source_states = new_source_states
+
+            if last_change is None or time.monotonic() - last_change < WATCH_DEBOUNCE:
+                continue
+            last_change = None
+
+            names_to_render = set()
+
+            if spreadsheets_changed:
+                spreadsheets_changed = False
+                try:
+                    new_spreadsheets = process_spreadsheets()
+                    new_jobs = [
+                        job
+                        for job in get_render_jobs(*new_spreadsheets)
+                        if job.kind in kinds
+                    ]
+                except Exception as e:
+                    log(
+                        f"Couldn't read the spreadsheets ({e}), waiting for the next change."
+                    )
+                    continue
+
+                spreadsheets = new_spreadsheets
+                jobs = new_jobs
+                new_signatures = {job.name: get_job_signature(job) for job in jobs}
+                for name, signature in new_signatures.items():
+                    if signatures.get(name) != signature:
+                        names_to_render.add(name)
+                for name in signatures.keys() - new_signatures.keys():
+                    log(f"""\"{name}" was removed from the spreadsheets.""")
+                signatures = new_signatures
+
+            if len(changed_sources) > 0:
+                forget_card_files()
+            jobs_by_file_name = {job.file_name: job for job in jobs}
+            for path in changed_sources:
+                file_name = os.path.basename(path)[:-4].replace("’", "'")
+                job = jobs_by_file_name.get(file_name)
+                if job is None:
+                    log(f"""\"{file_name}" isn't in the spreadsheets.""")
+                else:
+                    names_to_render.add(job.name)
+            changed_sources.clear()
+
+            if len(names_to_render) == 0:
+                continue
+
+            log(f"\n----- RE-RENDERING {len(names_to_render)} CARD(S) -----\n")
+            rendered_jobs = []
+            for job in jobs:
+                if job.name not in names_to_render:
+                    continue
+
+                # a source image still being saved, or a bad row, fails only its own card, which
+                # is tried again the next time it changes
+                try:
+                    render_job(job, quarantine, proof_scale)
+                except (OSError, ValueError, AttributeError) as e:
+                    log(
+                        f"""Couldn't render "{job.name}" ({str(e) or type(e).__name__}), waiting for its next change."""
+                    )
+                    continue
+                rendered_jobs.append(job)
+
+            if retile and len(rendered_jobs) > 0:
+                try:
+                    retile_jobs(spreadsheets, rendered_jobs, quarantine, proof_scale)
+                except (OSError, ValueError, AttributeError) as e:
+                    log(
+                        f"Couldn't re-tile the sheets ({str(e) or type(e).__name__}), waiting for the next change."
+                    )
+
+    except KeyboardInterrupt:
+        log("\n----- STOPPED WATCHING -----\n")
+
+
+def retile_jobs(
+    spreadsheets: tuple[dict, dict, dict, dict],
+    rendered_jobs: list[RenderJob],
+    quarantine: bool = False,
+    proof_scale: float = None,
+):
+    """
+    Re-tile the sheets the rendered cards are on, finding them on the same sheet plans
+    `card_tiling.py` tiles from; the other sheets are left as they are.
+    """
+
+    from card_tiling import (
+        build_tile_sheets,
+        plan_alt_art_sheets,
+        plan_basic_land_sheets,
+        plan_card_sheets,
+        plan_token_sheets,
+    )
+
+    cards, tokens, basic_lands, alt_arts = spreadsheets
+    rendered_kinds = {job.kind for job in rendered_jobs}
+    rendered_names = {job.name for job in rendered_jobs}
+
+    for kind, plan_sheets, cards_of_kind in (
+        (KIND_CARD, plan_card_sheets, cards),
+        (KIND_TOKEN, plan_token_sheets, tokens),
+        (KIND_BASIC_LAND, plan_basic_land_sheets, basic_lands),
+        (KIND_ALT_ART, plan_alt_art_sheets, alt_arts),
+    ):
+        if kind not in rendered_kinds:
+            continue
+
+        sheets = plan_sheets(
+            cards_of_kind, quarantine=quarantine, proof_scale=proof_scale
+        )
+        build_tile_sheets(sheets, quarantine, proof_scale, card_names=rendered_names)
+
+
 def main(
     do_cards: bool = True,
     do_tokens: bool = True,
@@ -459,34 +975,178 @@ def main(
     report: bool = False,
     card_names_to_process: list[str] = None,
     quarantine: bool = False,
+    proof_scale: float = None,
+    do_watch: bool = False,
+    retile: bool = False,
+    shard: tuple[int, int] = None,
+    merge_shards: bool = False,
+    max_memory: int = None,
+    only_renumbered: bool = False,
+    where: list[tuple] = None,
+    resume: bool = False,
+    preflight: bool = False,
+    outputs: list[str] = None,
 ):
-    reset_log()
-    cards, tokens, basic_lands, alt_arts = process_spreadsheets()
+    begin_startup()
+    if not resume:
+        reset_log()
+    set_memory_limit(max_memory * 2**20 if max_memory is not None else None)
+    set_output_targets(outputs)
+
+    if merge_shards:
+        if merge_shard_manifests("collection_info"):
+            merge_shard_tables("collector_numbers")
+        return
 
-    num_mainline_cards = len(cards) + len(basic_lands)
-    num_tokens = len(tokens)
-    num_basic_lands = len(basic_lands)
-    num_alt_arts = len(alt_arts)
+    if not do_watch:
+        start_journal(
+            "collection_info",
+            {
+                "kinds": [do_cards, do_tokens, do_basic_lands, do_alt_arts],
+                "only_updated": only_updated,
+                "card_names": sorted(card_names_to_process or []),
+                "quarantine": quarantine,
+                "proof_scale": proof_scale,
+                "shard": shard,
+                "only_renumbered": only_renumbered,
+                "where": where,
+                "outputs": sorted(outputs or []),
+            },
+            resume,
+        )
 
-    if do_cards:
-        process_cards(
-            cards, num_mainline_cards, only_updated, card_names_to_process, quarantine
+    # start reading the spreadsheets and listing the folders the run needs while it gets going
+    spreadsheets = Spreadsheets()
+    if do_watch or report or preflight:
+        spreadsheets.read_in_background("cards", "tokens", "basic_lands", "alt_arts")
+    else:
+        spreadsheets.read_in_background(
+            *(["cards", "basic_lands"] if do_cards or do_basic_lands else []),
+            *(["tokens"] if do_tokens else []),
+            *(["alt_arts"] if do_alt_arts else []),
+        )
+
+    # looking a few cards up is quicker than listing every source image
+    rendering = do_cards or do_tokens or do_basic_lands or do_alt_arts
+    if report or (rendering and card_names_to_process is None):
+        in_background(
+            "Listing unprocessed_cards", list_card_files, "unprocessed_cards/"
+        )
+    if report:
+        for card_path in ("processed_cards/", "processed_cards/quarantine/"):
+            in_background(f"Listing {card_path[:-1]}", list_card_files, card_path)
+
+    if proof_scale is not None:
+        os.makedirs(
+            f"cards/{get_card_path("processed_cards", quarantine, proof=True)}",
+            exist_ok=True,
         )
+
+    if preflight:
+        run_preflight(*spreadsheets)
+
+    if do_watch:
+        kinds = {
+            kind
+            for kind, do_kind in (
+                (KIND_CARD, do_cards),
+                (KIND_TOKEN, do_tokens),
+                (KIND_BASIC_LAND, do_basic_lands),
+                (KIND_ALT_ART, do_alt_arts),
+            )
+            if do_kind
+        }
+        watch(tuple(spreadsheets), kinds, quarantine, proof_scale, retile)
+        return
+
+    def get_card_names(kind: str) -> set[str] | list[str] | None:
+        if where is None:
+            return card_names_to_process
+
+        selected_names = select_cards(spreadsheets, (kind,), where)
+        if card_names_to_process is not None:
+            selected_names &= set(card_names_to_process)
+        return selected_names
+
+    card_path = get_card_path("processed_cards", quarantine, proof_scale is not None)
+    numbers_path = get_table_path("collector_numbers", card_path)
+    numbers = load_table(numbers_path)
+    previous_numbers = numbers if only_renumbered else None
+
+    # each kind of card is read from the spreadsheets just before it's rendered
+    rendered_jobs = []
+    if do_cards:
+        with memory_stage("Cards"):
+            rendered_jobs += process_cards(
+                spreadsheets.cards,
+                spreadsheets.num_mainline_cards,
+                only_updated,
+                get_card_names("cards"),
+                quarantine,
+                proof_scale,
+                shard,
+                previous_numbers,
+            )
     if do_tokens:
-        process_tokens(tokens, num_tokens, card_names_to_process, quarantine)
+        with memory_stage("Tokens"):
+            rendered_jobs += process_tokens(
+                spreadsheets.tokens,
+                len(spreadsheets.tokens),
+                get_card_names("tokens"),
+                quarantine,
+                proof_scale,
+                shard,
+                previous_numbers,
+            )
     if do_basic_lands:
-        process_basic_lands(
-            basic_lands,
-            num_mainline_cards,
-            num_basic_lands,
-            card_names_to_process,
-            quarantine,
-        )
+        with memory_stage("Basic Lands"):
+            rendered_jobs += process_basic_lands(
+                spreadsheets.basic_lands,
+                spreadsheets.num_mainline_cards,
+                len(spreadsheets.basic_lands),
+                get_card_names("basic_lands"),
+                quarantine,
+                proof_scale,
+                shard,
+                previous_numbers,
+            )
     if do_alt_arts:
-        process_alt_arts(alt_arts, num_alt_arts, card_names_to_process, quarantine)
+        with memory_stage("Alt Arts"):
+            rendered_jobs += process_alt_arts(
+                spreadsheets.alt_arts,
+                len(spreadsheets.alt_arts),
+                get_card_names("alt_arts"),
+                quarantine,
+                proof_scale,
+                shard,
+                previous_numbers,
+            )
+
+    if shard is not None:
+        # each shard saves the numbers it rendered with to its own part of the table, so shards
+        # running at once don't overwrite each other's; the parts are merged with the manifests
+        numbers_path = get_table_path("collector_numbers", card_path, shard)
+        numbers = load_table(numbers_path)
+    record_numbers(numbers, rendered_jobs)
+    save_json(numbers_path, numbers)
+
+    if shard is not None:
+        write_shard_manifest(
+            "collection_info",
+            shard,
+            {
+                job.name: f"cards/{card_path}{job.file_name}.png"
+                for job in rendered_jobs
+            },
+        )
+    finish_journal()
 
     if report:
-        generate_report(cards, tokens, basic_lands, alt_arts)
+        generate_report(*spreadsheets)
+
+    report_unchanged_writes()
+    report_startup()
+    report_memory()
 
 
 if __name__ == "__main__":
@@ -548,6 +1208,93 @@ if __name__ == "__main__":
         help="Put all the cards generated into a quarantine folder.",
         dest="quarantine",
     )
+    parser.add_argument(
+        "-p",
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Render quick proofs at this fraction of full size (e.g. 0.25) into 'cards/proof'.",
+        dest="proof_scale",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running and re-render cards whenever their source image or spreadsheet row changes.",
+        dest="watch",
+    )
+    parser.add_argument(
+        "-wt",
+        "--watch-tiles",
+        action="store_true",
+        help="While watching, also re-tile the sheets of the re-rendered cards.",
+        dest="retile",
+    )
+    parser.add_argument(
+        "-s",
+        "--shard",
+        type=parse_shard,
+        metavar="i/N",
+        help="Only render every Nth card, starting from the ith, keeping the full run's numbering.",
+        dest="shard",
+    )
+    parser.add_argument(
+        "-ms",
+        "--merge-shards",
+        action="store_true",
+        help="Merge the manifests written by every shard of a run, then exit.",
+        dest="merge_shards",
+    )
+    parser.add_argument(
+        "-mm",
+        "--max-memory",
+        type=int,
+        metavar="MB",
+        help="Keep the images in memory under this many megabytes where possible.",
+        dest="max_memory",
+    )
+
+    parser.add_argument(
+        "-rn",
+        "--renumbered",
+        action="store_true",
+        help="Only render the cards whose collector number changed since they were last rendered.",
+        dest="only_renumbered",
+    )
+
+    parser.add_argument(
+        "-wh",
+        "--where",
+        nargs="+",
+        type=parse_where,
+        metavar="FIELD=VALUE",
+        help=f"Only process the cards meeting every condition, e.g. 'archetype=Poker' 'rarity=rare,mythic' 'date>=2024-01-01'. Fields: {", ".join(WHERE_FIELDS)}.",
+        dest="where",
+    )
+
+    parser.add_argument(
+        "-re",
+        "--resume",
+        action="store_true",
+        help="Pick up an interrupted run where it left off, skipping the cards it already finished (run with the same options).",
+        dest="resume",
+    )
+    parser.add_argument(
+        "-pf",
+        "--preflight",
+        action="store_true",
+        help="Check the spreadsheets, source images and overlays before rendering, skipping the cards with problems.",
+        dest="preflight",
+    )
+    parser.add_argument(
+        "-o",
+        "--outputs",
+        nargs="+",
+        choices=list(OUTPUT_TARGETS),
+        metavar="OUTPUT",
+        help=f"Also save every card as these outputs, made from the same render: {", ".join(OUTPUT_TARGETS)}.",
+        dest="outputs",
+    )
 
     args = parser.parse_args()
     main(
@@ -559,4 +1306,15 @@ if __name__ == "__main__":
         args.report,
         args.card_names_to_process,
         args.quarantine,
+        args.proof_scale,
+        args.watch,
+        args.retile,
+        args.shard,
+        args.merge_shards,
+        args.max_memory,
+        args.only_renumbered,
+        args.where,
+        args.resume,
+        args.preflight,
+        args.outputs,
     )
@@ -1,5 +1,11 @@
+import argparse
+from collections.abc import Iterator
 import csv
-from PIL import Image
+import hashlib
+import json
+import os
+import threading
+from typing import TYPE_CHECKING
 from constants import (
     ALT_ARTS,
     BASIC_LANDS,
@@ -18,6 +24,21 @@ from constants import (
 )
 from log import log
 
+if TYPE_CHECKING:
+    # Pillow is imported by the functions that use it, so runs that never touch an image
+    # (like only writing the report) don't have to wait for it to load
+    from PIL import Image
+
+_card_files_lock = threading.Lock()
+_card_files: dict[str, set[str]] = {}
+
+_writes_lock = threading.Lock()
+_num_writes = 0
+_num_unchanged_writes = 0
+
+# how many rows of an image are hashed at a time, so hashing doesn't copy the whole image
+DIGEST_ROWS = 256
+
 
 def get_token_full_name(token: dict[str, str]) -> str:
     color = token[CARD_COLOR]
@@ -46,82 +67,98 @@ def get_token_full_name(token: dict[str, str]) -> str:
     return f"{token_color}{token_supertypes} {token[CARD_NAME]} {token_types}{token_descriptor}"
 
 
-def process_spreadsheets() -> tuple[
-    dict[str, dict[str, str | dict[str, str]]],
-    dict[str, dict[str, str]],
-    dict[str, dict[str, str]],
-    dict[str, dict[str, str | dict[str, str]]],
-]:
-    cards = {}
-    with open(CARDS, "r", encoding="utf8") as cards_sheet:
-        cards_sheet_reader = csv.reader(cards_sheet)
-        columns = next(cards_sheet_reader)
-        for row in cards_sheet_reader:
-            values = dict(zip(columns, row))
-            if len(values[CARD_NAME]) > 0:
-                values["Transform Backsides"] = []
-                cards[values[CARD_NAME]] = values
+def read_spreadsheet(path: str) -> Iterator[dict[str, str]]:
+    """
+    Read the spreadsheet's rows one at a time, skipping the ones without a card name.
+    """
 
-    with open(TRANSFORM_BACKSIDES) as transform_sheet:
-        transform_sheet_reader = csv.reader(transform_sheet)
-        columns = next(transform_sheet_reader)
-        for row in transform_sheet_reader:
+    with open(path, "r", encoding="utf8") as sheet:
+        sheet_reader = csv.reader(sheet)
+        columns = next(sheet_reader)
+        for row in sheet_reader:
             values = dict(zip(columns, row))
             if len(values[CARD_NAME]) > 0:
-                cards[values[FRONT_CARD_NAME]]["Transform Backsides"].append(values)
+                yield values
+
 
+def read_cards() -> dict[str, dict[str, str | dict[str, str]]]:
+    cards = {}
+    for values in read_spreadsheet(CARDS):
+        values["Transform Backsides"] = []
+        cards[values[CARD_NAME]] = values
+
+    for values in read_spreadsheet(TRANSFORM_BACKSIDES):
+        front_card = cards.get(values[FRONT_CARD_NAME])
+        if front_card is None:
+            log(
+                f"""Transform backside "{values[CARD_NAME]}" has no front card "{values[FRONT_CARD_NAME]}"."""
+            )
+            continue
+        front_card["Transform Backsides"].append(values)
+
+    return cards
+
+
+def read_tokens() -> dict[str, dict[str, str]]:
     tokens = {}
-    with open(TOKENS, "r", encoding="utf8") as tokens_sheet:
-        tokens_sheet_reader = csv.reader(tokens_sheet)
-        columns = next(tokens_sheet_reader)
-        for row in tokens_sheet_reader:
-            values = dict(zip(columns, row))
-            if len(values[CARD_NAME]) > 0:
-                full_token_name = get_token_full_name(values)
-                if full_token_name is not None:
-                    values[CARD_NAME] = full_token_name
-                    tokens[full_token_name] = values
+    for values in read_spreadsheet(TOKENS):
+        full_token_name = get_token_full_name(values)
+        if full_token_name is not None:
+            values[CARD_NAME] = full_token_name
+            tokens[full_token_name] = values
+
+    return tokens
+
 
+def read_basic_lands() -> dict[str, dict[str, str]]:
     basic_lands = {}
-    with open(BASIC_LANDS, "r", encoding="utf8") as basic_lands_sheet:
-        basic_lands_sheet_reader = csv.reader(basic_lands_sheet)
-        columns = next(basic_lands_sheet_reader)
-        for row in basic_lands_sheet_reader:
-            values = dict(zip(columns, row))
-            if len(values[CARD_NAME]) > 0:
-                full_basic_land_name = f"{values[CARD_NAME]} - {values[DESCRIPTOR]}"
-                values[CARD_NAME] = full_basic_land_name
-                basic_lands[full_basic_land_name] = values
+    for values in read_spreadsheet(BASIC_LANDS):
+        full_basic_land_name = f"{values[CARD_NAME]} - {values[DESCRIPTOR]}"
+        values[CARD_NAME] = full_basic_land_name
+        basic_lands[full_basic_land_name] = values
+
+    return basic_lands
 
+
+def read_alt_arts() -> dict[str, dict[str, str | dict[str, str]]]:
     alt_arts = {}
     transform_backsides: list[dict[str, str]] = []
-    with open(ALT_ARTS, "r", encoding="utf8") as alt_arts_sheet:
-        alt_arts_sheet_reader = csv.reader(alt_arts_sheet)
-        columns = next(alt_arts_sheet_reader)
-        for row in alt_arts_sheet_reader:
-            values = dict(zip(columns, row))
-            if len(values[CARD_NAME]) > 0:
-                full_alt_art_name = f"{values[CARD_NAME]} - {values[DESCRIPTOR]}"
-                values[CARD_NAME] = full_alt_art_name
+    for values in read_spreadsheet(ALT_ARTS):
+        full_alt_art_name = f"{values[CARD_NAME]} - {values[DESCRIPTOR]}"
+        values[CARD_NAME] = full_alt_art_name
+
+        front_card_name = values[FRONT_CARD_NAME].strip()
+        if len(front_card_name) > 0:
+            full_front_card_name = (
+                f"{front_card_name} - {values[FRONT_CARD_DESCRIPTOR]}"
+            )
+            values[FRONT_CARD_NAME] = full_front_card_name
+            transform_backsides.append(values)
+        else:
+            alt_arts[full_alt_art_name] = values
+
+    for backside in transform_backsides:
+        front_side_name = backside[FRONT_CARD_NAME]
+        front_side = alt_arts.get(front_side_name)
+        if front_side is None:
+            log(
+                f"""Transform backside "{backside[CARD_NAME]}" has no front card "{front_side_name}"."""
+            )
+            continue
+        if not front_side.get("Transform Backsides", False):
+            front_side["Transform Backsides"] = []
+        front_side["Transform Backsides"].append(backside)
 
-                front_card_name = values[FRONT_CARD_NAME].strip()
-                if len(front_card_name) > 0:
-                    full_front_card_name = (
-                        f"{front_card_name} - {values[FRONT_CARD_DESCRIPTOR]}"
-                    )
-                    values[FRONT_CARD_NAME] = full_front_card_name
-                    transform_backsides.append(values)
-                else:
-                    alt_arts[full_alt_art_name] = values
+    return alt_arts
 
-        for backside in transform_backsides:
-            front_side_name = backside[FRONT_CARD_NAME]
-            front_side = alt_arts[front_side_name]
-            if not front_side.get("Transform Backsides", False):
-                front_side["Transform Backsides"] = []
-            front_side["Transform Backsides"].append(backside)
 
-    return cards, tokens, basic_lands, alt_arts
+def process_spreadsheets() -> tuple[
+    dict[str, dict[str, str | dict[str, str]]],
+    dict[str, dict[str, str]],
+    dict[str, dict[str, str]],
+    dict[str, dict[str, str | dict[str, str]]],
+]:
+    return read_cards(), read_tokens(), read_basic_lands(), read_alt_arts()
 
 
 def cardname_to_filename(card_name: str) -> str:
@@ -131,27 +168,263 @@ def cardname_to_filename(card_name: str) -> str:
     return file_name
 
 
-def open_card_file(
-    file_name: str, card_path: str = "unprocessed_cards/"
-) -> Image.Image | None:
-    try:
+def list_card_files(card_path: str = "unprocessed_cards/") -> set[str]:
+    """
+    Get the names of the files in the folder (relative to "cards/"), listing it only the first
+    time it's asked for; files saved there with `save_image` are added as they're saved.
+    Once a folder has been listed, `find_card_file` looks cards up in the listing.
+    """
 
-        if len(file_name) > 0:
-            base_card = Image.open(
-                f"cards/{card_path}{file_name}.png"
-            )
-        else:
-            return None
+    directory = os.path.normpath(f"cards/{card_path}")
+    with _card_files_lock:
+        if directory in _card_files:
+            return set(_card_files[directory])
 
+    try:
+        with os.scandir(directory) as entries:
+            file_names = {entry.name for entry in entries if entry.is_file()}
     except FileNotFoundError:
+        file_names = set()
+
+    with _card_files_lock:
+        return set(_card_files.setdefault(directory, file_names))
+
+
+def forget_card_files():
+    """
+    Forget the folder listings, e.g. once files may have been added or removed by someone else.
+    """
+
+    with _card_files_lock:
+        _card_files.clear()
+
+
+def _is_listed(path: str) -> bool:
+    directory, file_name = os.path.split(path)
+    with _card_files_lock:
+        file_names = _card_files.get(os.path.normpath(directory))
+        return file_names is not None and file_name in file_names
+
+
+def find_card_file(
+    file_name: str,
+    card_path: str | list[str] = "unprocessed_cards/",
+    log_missing: bool = True,
+) -> str | None:
+    """
+    Find the card's file in the folder (relative to "cards/"), or in the first of several
+    folders that has it. Missing files are logged unless told not to.
+    """
+
+    if len(file_name) == 0:
+        return None
+
+    card_paths = [card_path] if isinstance(card_path, str) else card_path
+    for card_path in card_paths:
+        path = _find_card_file_in(file_name, card_path)
+        if path is not None:
+            return path
+
+    if log_missing:
+        log(f"""Couldn't find "{file_name}" in "{'" or "'.join(card_paths)}".""")
+    return None
+
+
+def _find_card_file_in(file_name: str, card_path: str) -> str | None:
+    path = f"cards/{card_path}{file_name}.png"
+    if _is_listed(path):
+        return path
+
+    new_file_name = file_name.replace("'", "’")
+    new_path = f"cards/{card_path}{new_file_name}.png"
+    if _is_listed(new_path):
+        return new_path
+
+    # not listed, or saved by something else since it was (or only matching case-insensitively)
+    if os.path.isfile(path):
+        return path
+
+    if os.path.isfile(new_path):
+        return new_path
+
+    return None
+
+
+def image_is_opaque(image: "Image.Image") -> bool:
+    if not image.has_transparency_data:
+        return True
+
+    if "A" not in image.getbands():
+        image = image.convert("RGBA")
+    return image.getchannel("A").getextrema()[0] == 255
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Get the file's size and modification time, which change whenever the file does.
+    """
+
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def scale_length(length: int, scale: float) -> int:
+    return max(round(length * scale), 1)
+
+
+def scale_image(image: "Image.Image", scale: float) -> "Image.Image":
+    from PIL import Image
+
+    size = (scale_length(image.width, scale), scale_length(image.height, scale))
+    image.draft(image.mode, size)
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=1.0)
+
+
+def parse_proof_scale(value: str) -> float:
+    scale = float(value)
+    if not 0 < scale <= 1:
+        raise argparse.ArgumentTypeError(
+            "The proof scale must be above 0 and at most 1."
+        )
+    return scale
+
+
+def save_image(image: "Image.Image", path: str, **params):
+    """
+    Save the image through a temporary file that replaces `path` once it's completely written,
+    so a half-written image can never be mistaken for a finished one.
+    """
+
+    from PIL import Image
+
+    directory, file_name = os.path.split(path)
+    temp_path = os.path.join(
+        directory, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    # like Pillow, only load every image plugin if the common ones don't cover the extension
+    extension = os.path.splitext(path)[1].lower()
+    Image.preinit()
+    image_format = (
+        Image.EXTENSION.get(extension) or Image.registered_extensions()[extension]
+    )
+    try:
+        image.save(temp_path, format=image_format, **params)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
-        try:
-            new_file_name = file_name.replace("'", "’")
-            base_card = Image.open(
-                f"cards/{card_path}{new_file_name}.png"
+    add_card_file(path)
+
+
+def add_card_file(path: str):
+    """
+    Add a file that was just saved to the listing of its folder, if it's been listed.
+    """
+
+    directory, file_name = os.path.split(path)
+    with _card_files_lock:
+        file_names = _card_files.get(os.path.normpath(directory))
+        if file_names is not None:
+            file_names.add(file_name)
+
+
+def image_digest(image: "Image.Image") -> str:
+    """
+    Get a digest of the image's pixels, which only matches another image's if every pixel does.
+    """
+
+    digest = hashlib.sha1(f"{image.mode}:{image.width}x{image.height}".encode("utf8"))
+    for top in range(0, image.height, DIGEST_ROWS):
+        digest.update(
+            image.crop(
+                (0, top, image.width, min(top + DIGEST_ROWS, image.height))
+            ).tobytes()
+        )
+    return digest.hexdigest()
+
+
+def get_saved_info(path: str) -> dict:
+    """
+    Get the text saved with the PNG (like the "Digest" saved by `save_image_if_changed`) from
+    its header, without decoding it.
+    """
+
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            return dict(image.info)
+    except OSError:
+        return {}
+
+
+def save_image_if_changed(
+    image: "Image.Image", path: str, digest: str = None, **params
+) -> bool:
+    """
+    Save the image as a PNG like `save_image`, along with a digest of its pixels, unless the
+    PNG at `path` was saved with the same digest. Then the image is neither encoded nor
+    written, so unchanged outputs keep their files (and modification times) as they are.
+    The digest is computed unless it's given. Returns whether the image was saved.
+    """
+
+    from PIL import PngImagePlugin
+
+    if digest is None:
+        digest = image_digest(image)
+    unchanged = get_saved_info(path).get("Digest") == digest
+    count_write(unchanged)
+    if unchanged:
+        return False
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Digest", digest)
+    save_image(image, path, pnginfo=info, **params)
+    return True
+
+
+def count_write(unchanged: bool):
+    """
+    Count an output towards the writes reported at the end of the run, and whether it was
+    skipped for being unchanged.
+    """
+
+    global _num_writes, _num_unchanged_writes
+    with _writes_lock:
+        _num_writes += 1
+        if unchanged:
+            _num_unchanged_writes += 1
+
+
+def report_unchanged_writes():
+    with _writes_lock:
+        if _num_writes > 0:
+            log(
+                f"\nSkipped writing {_num_unchanged_writes} of {_num_writes} outputs that hadn't changed."
             )
-        except FileNotFoundError:
-            log(f"""Couldn't find "{file_name}" in "{card_path}".""")
-            return None
 
-    return base_card
+
+def save_json(path: str, data):
+    """
+    Save the data as JSON, replacing the file at `path` all at once.
+    """
+
+    directory, file_name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # unique to the process and thread, so runs saving the same file at once don't share it
+    temp_path = os.path.join(
+        directory, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        with open(temp_path, "w", encoding="utf8") as json_file:
+            json.dump(data, json_file, indent=4)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_card_path(folder: str, quarantine: bool = False, proof: bool = False) -> str:
+    return f"{"proof/" if proof else ""}{folder}/{"quarantine/" if quarantine else ""}"
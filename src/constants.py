@@ -2,6 +2,31 @@
 CARD_WIDTH = 1500
 CARD_HEIGHT = 2100
 BATTLE_CARD_MULT = 1.34
+THUMBNAIL_WIDTH = 300
+THUMBNAIL_HEIGHT = 420
+
+# the modes the source images of cards can be in
+SOURCE_MODES = ("RGB", "RGBA")
+
+# the extra outputs cards can be saved as with --outputs, each shrunk to fit in a (width, height)
+# box, encoded with the given options, and saved to its own folder in "cards/"
+OUTPUT_TARGETS = {
+    "web": {
+        "size": (750, 1050),
+        "format": "WEBP",
+        "params": {"quality": 85, "method": 4},
+        "folder": "web_cards",
+    },
+    "thumbnail": {
+        "size": (THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT),
+        "format": "JPEG",
+        "params": {"quality": 85, "optimize": True},
+        "folder": "thumbnails",
+    },
+}
+
+# how many of a card's outputs are encoded at once
+OUTPUT_WORKERS = 4
 
 # the names of the .csv files that hold all the card information
 CARDS = "spreadsheets/The One Set Cards Ranked - Card Ratings.csv"
@@ -9,6 +34,28 @@ TOKENS = "spreadsheets/The One Set Cards Ranked - Tokens.csv"
 TRANSFORM_BACKSIDES = "spreadsheets/The One Set Cards Ranked - Transform Backsides.csv"
 BASIC_LANDS = "spreadsheets/The One Set Cards Ranked - Basic Lands.csv"
 ALT_ARTS = "spreadsheets/The One Set Cards Ranked - Alt Arts.csv"
+SPREADSHEETS = [CARDS, TOKENS, TRANSFORM_BACKSIDES, BASIC_LANDS, ALT_ARTS]
+
+# the kinds of cards that get rendered and tiled
+KIND_CARD = "card"
+KIND_TOKEN = "token"
+KIND_BASIC_LAND = "basic_land"
+KIND_ALT_ART = "alt_art"
+
+# where the manifests of sharded runs are written
+MANIFESTS = "cards/manifests/"
+
+# where the rotated and resized processed cards laid out on tile sheets are cached
+DERIVED_CARDS = "cards/derived_cards/"
+
+# where the decoded overlays are kept for every process to map into memory
+ASSET_STORE = "cards/asset_store/"
+
+# where verify.py writes the processed cards and sheets it found corrupted or the wrong size
+VERIFY_REPORT = "cards/verify_report.json"
+
+# how many processes verify.py checks files in at once
+VERIFY_WORKERS = 4
 
 # which columns in the spreadsheet correspond to which attribute
 CARD_NAME = "Card Name"
@@ -73,3 +120,36 @@ POKER_BORDERS = {
 # tiling
 TILING_WIDTH = 6
 TILING_HEIGHT = 4
+PRINT_DPI = 600
+
+# how many cards of a tile sheet are decoded and pasted into it at once
+TILING_WORKERS = 4
+
+# how many finished bands of sheets are kept to build the next bands on
+SHEET_CANVAS_POOL = 2
+
+# the width and height of the tiles tile sheets saved as TIFFs are split into (a multiple of 16)
+TIFF_TILE_SIZE = 256
+
+# the fields cards can be selected by with --where, and the columns they come from
+WHERE_FIELDS = {
+    "updated": UPDATED,
+    "type": CARD_TYPES,
+    "archetype": ARCHETYPE,
+    "rarity": CARD_RARITY,
+    "color": CARD_COLOR,
+    "date": CARD_DATE,
+}
+
+# render service
+RENDER_SERVICE_HOST = "127.0.0.1"
+RENDER_SERVICE_PORT = 8765
+RENDER_SERVICE_WORKERS = 4
+
+# how long (seconds) a thread waits for other threads to free images before going over the
+# memory budget anyway, in case the threads holding them are waiting on it
+MEMORY_WAIT_TIMEOUT = 5
+
+# watch mode (seconds)
+WATCH_POLL_INTERVAL = 0.5
+WATCH_DEBOUNCE = 1.5
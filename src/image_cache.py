@@ -0,0 +1,101 @@
+"""
+Caches the rotated and resized versions of the processed cards laid out on tile sheets, so
+they only get resampled once per version of the processed card.
+"""
+
+import hashlib
+import os
+from PIL import Image, PngImagePlugin
+
+from common import file_fingerprint, find_card_file, save_image
+from constants import CARD_HEIGHT, CARD_WIDTH, DERIVED_CARDS
+
+
+def fit_image(image: Image.Image, size: tuple[int, int], rotate: bool) -> Image.Image:
+    """
+    Rotate the image a quarter turn counterclockwise (losslessly) if asked, then resize it to the given size.
+    """
+
+    if rotate:
+        image = image.transpose(Image.Transpose.ROTATE_90)
+
+    if image.size != size:
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    return image
+
+
+def derived_image_path(
+    source_path: str, size: tuple[int, int], rotate: bool = False
+) -> str:
+    """
+    Get the path to a copy of the image at `source_path` rotated and resized to `size`,
+    making the copy first unless there's a cached one from the same version of the source.
+    """
+
+    transform = f"{size[0]}x{size[1]}{"-rotated" if rotate else ""}"
+    source_key = f"{os.path.abspath(source_path)}|{transform}"
+    cache_path = (
+        f"{DERIVED_CARDS}{hashlib.sha1(source_key.encode("utf8")).hexdigest()}.png"
+    )
+    fingerprint = f"{file_fingerprint(source_path)}|{transform}"
+
+    try:
+        with Image.open(cache_path) as cached_image:
+            if cached_image.info.get("Source") == fingerprint:
+                return cache_path
+    except OSError:
+        pass
+
+    with Image.open(source_path) as source_image:
+        image = fit_image(source_image, size, rotate)
+        image.load()
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Source", fingerprint)
+    os.makedirs(DERIVED_CARDS, exist_ok=True)
+    save_image(image, cache_path, pnginfo=info, compress_level=1)
+    image.close()
+
+    return cache_path
+
+
+def tile_image_path(
+    file_name: str,
+    card_path: str | list[str],
+    rotate: bool = False,
+    size: tuple[int, int] = (CARD_WIDTH, CARD_HEIGHT),
+) -> str | None:
+    """
+    Get the path to a processed card the way it's laid out on a tile sheet, rotating it first
+    if asked. Returns None if the card file can't be found.
+    """
+
+    source_path = find_card_file(file_name, card_path)
+    if source_path is None:
+        return None
+
+    if not rotate:
+        with Image.open(source_path) as image:
+            if image.size == size:
+                return source_path
+
+    return derived_image_path(source_path, size, rotate)
+
+
+def open_tile_image(
+    file_name: str,
+    card_path: str | list[str],
+    rotate: bool = False,
+    size: tuple[int, int] = (CARD_WIDTH, CARD_HEIGHT),
+) -> Image.Image | None:
+    """
+    Open a processed card the way it's laid out on a tile sheet, rotating it first if asked.
+    Returns None if the card file can't be found.
+    """
+
+    path = tile_image_path(file_name, card_path, rotate, size)
+    if path is None:
+        return None
+
+    return Image.open(path)
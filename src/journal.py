@@ -0,0 +1,125 @@
+"""
+Keeps an append-only journal of the work a run has finished, so an interrupted run can be
+resumed without redoing it. Each run configuration gets its own journal, and an item is only
+journaled once its output is safely on disk.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from constants import MANIFESTS
+from log import log
+
+JOURNALS = f"{MANIFESTS}journals/"
+
+_lock = threading.Lock()
+_journal_file = None
+_journal_path = None
+_done: dict[str, str] = {}
+
+
+def get_journal_path(tool: str, config: dict) -> str:
+    config_key = hashlib.sha1(
+        json.dumps(config, sort_keys=True, default=str).encode("utf8")
+    ).hexdigest()[:12]
+    return f"{JOURNALS}{tool}.{config_key}.jsonl"
+
+
+def _read_journal(path: str) -> dict[str, str]:
+    done = {}
+    try:
+        with open(path, "r", encoding="utf8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line can be cut short if the run was killed while writing it
+                    continue
+                done[entry["item"]] = entry["output"]
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def start_journal(tool: str, config: dict, resume: bool = False):
+    """
+    Start journaling the run. When resuming, the items the last run with the same configuration
+    finished (and whose outputs still exist) count as done; otherwise the journal starts empty.
+    """
+
+    global _journal_file, _journal_path, _done
+    path = get_journal_path(tool, config)
+    os.makedirs(JOURNALS, exist_ok=True)
+
+    with _lock:
+        if resume:
+            _done = {
+                item: output
+                for item, output in _read_journal(path).items()
+                if os.path.isfile(output)
+            }
+            log(f"Resuming {tool}: {len(_done)} items were already done.")
+        else:
+            _done = {}
+
+        if _journal_file is not None:
+            _journal_file.close()
+        _journal_file = open(path, "a" if resume else "w", encoding="utf8")
+        _journal_path = path
+        if resume and _journal_file.tell() > 0:
+            # start on a fresh line in case the last one was cut short
+            _journal_file.write("\n")
+
+
+def is_journaled(item: str) -> bool:
+    with _lock:
+        return item in _done
+
+
+def _sync(path: str):
+    with open(path, "rb+") as output_file:
+        os.fsync(output_file.fileno())
+
+    if hasattr(os, "O_DIRECTORY"):
+        directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def record_done(item: str, output: str):
+    """
+    Journal the item as done once its output is flushed to disk. Does nothing if no journal
+    has been started.
+    """
+
+    if _journal_file is None:
+        return
+
+    _sync(output)
+    with _lock:
+        _done[item] = output
+        _journal_file.write(json.dumps({"item": item, "output": output}) + "\n")
+        _journal_file.flush()
+        os.fsync(_journal_file.fileno())
+
+
+def finish_journal():
+    """
+    Close the run's journal and delete it, since a finished run has nothing left to resume.
+    Does nothing if no journal has been started.
+    """
+
+    global _journal_file, _journal_path, _done
+    with _lock:
+        if _journal_file is None:
+            return
+
+        _journal_file.close()
+        os.remove(_journal_path)
+        _journal_file = None
+        _journal_path = None
+        _done = {}
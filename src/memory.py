@@ -0,0 +1,143 @@
+"""
+Keeps track of how many bytes of decoded images are in memory, holds threads back while the
+run is over its memory budget, and reports the peak usage of each stage of the run.
+"""
+
+from contextlib import contextmanager
+import threading
+from typing import TYPE_CHECKING
+import weakref
+
+from constants import MEMORY_WAIT_TIMEOUT
+from log import log
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_condition = threading.Condition()
+_limit: int | None = None
+_in_use = 0
+_thread_usage: dict[int, int] = {}
+# the threads waiting for memory, oldest first
+_waiting: list[int] = []
+_stage: str | None = None
+_stage_peaks: dict[str, int] = {}
+
+
+def set_memory_limit(limit: int | None):
+    """
+    Set the most bytes of decoded images allowed in memory at once, or None for no limit.
+    """
+
+    global _limit
+    with _condition:
+        _limit = limit
+        _condition.notify_all()
+
+
+def image_bytes(image: "Image.Image") -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _release(num_bytes: int, thread_id: int):
+    global _in_use
+    with _condition:
+        _in_use -= num_bytes
+        _thread_usage[thread_id] -= num_bytes
+        if _thread_usage[thread_id] == 0:
+            del _thread_usage[thread_id]
+        _condition.notify_all()
+
+
+def _must_wait(num_bytes: int, thread_id: int) -> bool:
+    if _limit is None or _in_use + num_bytes <= _limit:
+        return False
+
+    # only other threads' images can be freed while this one waits
+    holders = [holder for holder in _thread_usage if holder != thread_id]
+    if len(holders) == 0:
+        return False
+
+    # if every thread holding images is waiting for memory too, none of them can free any, so
+    # the one that's waited longest goes ahead
+    return not (
+        all(holder in _waiting for holder in holders) and _waiting[0] == thread_id
+    )
+
+
+def track_image(image: "Image.Image", thread_id: int = None) -> "Image.Image":
+    """
+    Count the image's decoded size against the budget until the image is freed, first waiting
+    for other threads to free their images if this one would go over the budget. The image
+    goes over the budget instead if the threads holding memory are all waiting for it too, or
+    if none of their images are freed for `MEMORY_WAIT_TIMEOUT` seconds (e.g. because they're
+    waiting on this thread), so a run never waits forever. Images decoded by worker threads
+    for a thread that waits on them are charged to that thread (`thread_id`), so the workers
+    never wait for memory it holds.
+    """
+
+    global _in_use
+    num_bytes = image_bytes(image)
+    if thread_id is None:
+        thread_id = threading.get_ident()
+
+    with _condition:
+        if _limit is not None and num_bytes > _limit:
+            log(
+                f"An image needs {num_bytes // 2**20} MB, more than the whole memory budget."
+            )
+
+        if _must_wait(num_bytes, thread_id):
+            _waiting.append(thread_id)
+            _condition.notify_all()
+            try:
+                while _must_wait(num_bytes, thread_id):
+                    if not _condition.wait(MEMORY_WAIT_TIMEOUT):
+                        log(
+                            f"No memory was freed for {MEMORY_WAIT_TIMEOUT} s, so an image of {num_bytes // 2**20} MB goes over the memory budget."
+                        )
+                        break
+            finally:
+                _waiting.remove(thread_id)
+                _condition.notify_all()
+
+        _in_use += num_bytes
+        _thread_usage[thread_id] = _thread_usage.get(thread_id, 0) + num_bytes
+        if _stage is not None:
+            _stage_peaks[_stage] = max(_stage_peaks.get(_stage, 0), _in_use)
+
+    weakref.finalize(image, _release, num_bytes, thread_id)
+    return image
+
+
+@contextmanager
+def memory_stage(name: str):
+    """
+    Record the peak memory use of everything run inside this context under the given name.
+    """
+
+    global _stage
+    with _condition:
+        previous_stage = _stage
+        _stage = name
+        _stage_peaks[name] = max(_stage_peaks.get(name, 0), _in_use)
+    try:
+        yield
+    finally:
+        with _condition:
+            _stage = previous_stage
+
+
+def report_memory():
+    log("\n----- PEAK MEMORY -----\n")
+    for stage, peak in _stage_peaks.items():
+        log(f"{stage}: {peak / 2**20:.1f} MB of images")
+
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        log(f"Whole run: {max_rss / 2**10:.1f} MB resident")
@@ -1,6 +1,8 @@
-import io
+from collections.abc import Callable
 from PIL import Image
 
+from common import scale_length
+from memory import track_image
 from model.Layer import Layer
 
 
@@ -18,6 +20,10 @@ class Card:
 
     layers : List[Layer], default: []
         The list of layers. Lower-index layers are rendered first.
+
+    scale : float, default: 1
+        How much to shrink the card by, for quick low-resolution proofs. The base size and
+        layer positions are given at full resolution and scaled automatically.
     """
 
     def __init__(
@@ -25,53 +31,64 @@ class Card:
         base_width: int = 1500,
         base_height: int = 2100,
         layers: list[Layer] = None,
+        scale: float = 1,
     ):
-        self.base_width = base_width
-        self.base_height = base_height
+        self.scale = scale
+        self.base_width = scale_length(base_width, scale)
+        self.base_height = scale_length(base_height, scale)
         self.layers = layers if layers is not None else []
 
-    def _image_is_valid(self, image: Image.Image):
-        try:
-            with io.BytesIO() as buffer:
-                image.save(buffer, format="PNG")
-                buffer.seek(0)
-                with Image.open(buffer) as temp:
-                    temp.verify()
-            return True
-        except Exception as e:
-            return False
-
     def add_layer(
         self,
         image: Image.Image | str,
         index: int = None,
         position: tuple[int, int] = (0, 0),
+        crop: tuple[int, int, int, int] = None,
+        asset: bool = True,
     ):
         """
-        Add a layer with the image at the given path before the given index.
+        Add a layer with the image at the given path before the given index. Images at a path
+        aren't opened until the layers are merged.
 
         Parameters
         ----------
         image: Image.Image | str
-            The Image, or the path to the image, to set the layer to.
+            The Image, or the path to the image, to set the layer to. Images at a path are
+            loaded at the card's scale; Images passed in directly should already be at the
+            card's scale.
 
         index: int, optional
             The index to add the layer before. Adds to the top if not given.
 
         position: tuple[int, int], default: (0, 0)
             The position of the layer relative to the top left corner of the image.
+
+        crop: tuple[int, int, int, int], optional
+            The (left, top, right, bottom) area of the image to display. Displays the whole
+            image if not given.
+
+        asset: bool, default: True
+            Whether the path is a shared overlay loaded once through the asset cache, rather
+            than an image that's freed as soon as it's merged.
         """
 
-        if isinstance(image, str):
-            image = Image.open(image)
+        if self.scale != 1:
+            position = (
+                round(position[0] * self.scale),
+                round(position[1] * self.scale),
+            )
+            if crop is not None:
+                crop = tuple(round(length * self.scale) for length in crop)
 
-        if not self._image_is_valid(image):
-            raise AttributeError
+        if isinstance(image, str):
+            layer = Layer(image, position, crop, self.scale, asset)
+        else:
+            layer = Layer(image, position, crop)
 
         if index == None:
-            self.layers.append(Layer(image, position))
+            self.layers.append(layer)
         else:
-            self.layers.insert(index, Layer(image, position))
+            self.layers.insert(index, layer)
 
     def remove_layer(self, index: int):
         """
@@ -85,9 +102,92 @@ class Card:
 
         self.layers.pop(index)
 
-    def merge_layers(self) -> Image.Image:
+    def _clip_box(self, box: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        left, top, right, bottom = box
+        return (
+            max(left, 0),
+            max(top, 0),
+            min(right, self.base_width),
+            min(bottom, self.base_height),
+        )
+
+    def _visible_layers(
+        self, on_invalid: Callable[[Layer], None] = None
+    ) -> list[Layer]:
+        """
+        Get the layers that can be seen in the merged image, bottom to top.
+
+        Layers completely hidden behind an opaque layer above them are left out, as is
+        everything beneath the topmost opaque layer that covers the whole image. A layer's
+        opacity is only checked (and its image decoded) if it could hide something.
+        """
+
+        canvas_box = (0, 0, self.base_width, self.base_height)
+
+        layers = []
+        boxes = []
+        for layer in self.layers:
+            try:
+                left, top, right, bottom = self._clip_box(layer.box)
+            except AttributeError:
+                if on_invalid is None:
+                    raise
+                on_invalid(layer)
+                continue
+
+            if left < right and top < bottom:
+                layers.append(layer)
+                boxes.append((left, top, right, bottom))
+
+        visible_layers = []
+        opaque_boxes = []
+        for index in reversed(range(len(layers))):
+            layer = layers[index]
+            left, top, right, bottom = boxes[index]
+
+            if any(
+                o_left <= left
+                and o_top <= top
+                and o_right >= right
+                and o_bottom >= bottom
+                for o_left, o_top, o_right, o_bottom in opaque_boxes
+            ):
+                continue
+
+            could_hide = boxes[index] == canvas_box or any(
+                left <= b_left
+                and top <= b_top
+                and right >= b_right
+                and bottom >= b_bottom
+                for b_left, b_top, b_right, b_bottom in boxes[:index]
+            )
+            try:
+                opaque = could_hide and layer.opaque
+            except AttributeError:
+                if on_invalid is None:
+                    raise
+                on_invalid(layer)
+                continue
+
+            visible_layers.append(layer)
+            if opaque:
+                if boxes[index] == canvas_box:
+                    break
+                opaque_boxes.append(boxes[index])
+
+        visible_layers.reverse()
+        return visible_layers
+
+    def merge_layers(self, on_invalid: Callable[[Layer], None] = None) -> Image.Image:
         """
-        Merge all layers into one image.
+        Merge all layers into one image, decoding each layer's image only while it's being
+        merged. The images are freed as they're merged, so the Card is left with no layers.
+
+        Parameters
+        ----------
+        on_invalid: Callable[[Layer], None], optional
+            Called with each layer whose image can't be read, which is then left out.
+            Raises an AttributeError for the first such layer if not given.
 
         Returns
         -------
@@ -98,12 +198,53 @@ class Card:
         if len(self.layers) == 0:
             return None
 
-        base_image = Image.new(
-            "RGBA", (self.base_width, self.base_height), (0, 0, 0, 0)
-        )
-        composite_image = base_image.copy()
+        canvas_box = (0, 0, self.base_width, self.base_height)
+        visible_layers = self._visible_layers(on_invalid)
+
+        composite_image = None
+        if (
+            len(visible_layers) > 0
+            and self._clip_box(visible_layers[0].box) == canvas_box
+            and visible_layers[0].opaque
+        ):
+            bottom_layer = visible_layers.pop(0)
+            bottom_image = bottom_layer.open()
+            if bottom_layer.box != canvas_box:
+                composite_image = track_image(
+                    Image.new("RGBA", (self.base_width, self.base_height), (0, 0, 0, 0))
+                )
+                composite_image.paste(bottom_image, bottom_layer.origin)
+            elif bottom_image.mode != "RGBA":
+                composite_image = track_image(bottom_image.convert("RGBA"))
+            elif bottom_layer.owned:
+                # nothing else needs the layer's pixels, so build on them instead of a copy
+                composite_image = bottom_layer.take()
+            else:
+                composite_image = track_image(bottom_image.copy())
+            bottom_layer.close()
+            composite_image.info = {}
+        else:
+            composite_image = track_image(
+                Image.new("RGBA", (self.base_width, self.base_height), (0, 0, 0, 0))
+            )
+
+        for layer in visible_layers:
+            try:
+                image = layer.open()
+            except AttributeError:
+                if on_invalid is None:
+                    raise
+                on_invalid(layer)
+                continue
+
+            if layer.opaque:
+                composite_image.paste(image, layer.origin)
+            else:
+                composite_image.paste(image, layer.origin, mask=image)
+            layer.close()
 
         for layer in self.layers:
-            composite_image.paste(layer.image, layer.position, mask=layer.image)
+            layer.close()
+        self.layers = []
 
         return composite_image
@@ -0,0 +1,86 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from constants import COLORS, WHERE_FIELDS
+
+
+class CardIndex:
+    """
+    Indexes of one spreadsheet's cards by the attributes cards are usually selected by, built
+    in a single pass so selecting cards doesn't need to scan them all again.
+
+    Attributes
+    ----------
+    names: set[str]
+        The names of every card in the index.
+
+    values: dict[str, dict[str, set[str]]]
+        For each field in `WHERE_FIELDS` (other than the date), the names of the cards with each
+        key of it (see `get_keys`).
+
+    dates: list[tuple[datetime, str]]
+        Every card's creation date and name, sorted by date.
+    """
+
+    def __init__(self, cards: dict[str, dict[str, str]]):
+        self.names = set(cards.keys())
+        self.values = {field: {} for field in WHERE_FIELDS if field != "date"}
+        self.dates = []
+
+        for card_name, card in cards.items():
+            for field, column in WHERE_FIELDS.items():
+                value = card.get(column, "").strip()
+                if len(value) == 0:
+                    continue
+
+                if field == "date":
+                    self.dates.append((datetime.strptime(value, "%m/%d/%Y"), card_name))
+                    continue
+
+                for key in self.get_keys(value, field == "color"):
+                    self.values[field].setdefault(key, set()).add(card_name)
+
+        self.dates.sort()
+
+    @staticmethod
+    def get_keys(value: str, split_colors: bool = False) -> set[str]:
+        """
+        Get the keys a value is indexed by: each of its words, lowercased, with color
+        identities like "WU" split into their colors if it's a color identity.
+        """
+
+        keys = set()
+        for word in value.lower().split():
+            if (
+                split_colors
+                and len(word) > 1
+                and all(char.upper() in COLORS for char in word)
+            ):
+                keys |= set(word)
+            else:
+                keys.add(word)
+        return keys
+
+    def lookup(self, field: str, value: str) -> set[str]:
+        """
+        Get the names of the cards whose field has every word (or color) of the value.
+        """
+
+        names = None
+        for key in self.get_keys(value, field == "color"):
+            matches = self.values[field].get(key, set())
+            names = matches if names is None else names & matches
+        return names or set()
+
+    def between(self, start: datetime = None, end: datetime = None) -> set[str]:
+        """
+        Get the names of the cards created between the dates (inclusive); either end can be open.
+        """
+
+        low = 0 if start is None else bisect_left(self.dates, (start,))
+        high = (
+            len(self.dates)
+            if end is None
+            else bisect_right(self.dates, (end, chr(0x10FFFF)))
+        )
+        return {card_name for _, card_name in self.dates[low:high]}
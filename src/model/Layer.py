@@ -1,19 +1,196 @@
 from PIL import Image
 
+from assets import asset_is_opaque, load_asset
+from common import image_is_opaque, scale_image, scale_length
+from memory import track_image
+
 
 class Layer:
     """
-    A single layer of a card.
+    A single layer of a card. The layer only describes where its image comes from; the
+    pixels aren't decoded until the layer is opened while merging.
 
     Attributes
     ----------
-    image: Image
-        The image displayed on the layer.
+    source: str | Image
+        The path to the image displayed on the layer, or the image itself.
 
     position: tuple[int, int]
         The position of the layer relative to the top left corner of the image.
+
+    crop: tuple[int, int, int, int], optional
+        The (left, top, right, bottom) area of the source image to display, at the layer's
+        scale. The whole image is displayed if not given.
+
+    scale: float, default: 1
+        How much the source image is shrunk by when it's opened.
+
+    asset: bool, default: False
+        Whether the source is a path to a shared overlay loaded through the asset cache.
+
+    origin: tuple[int, int]
+        The position of the top left corner of the layer's image, which assets are trimmed
+        to the visible part of.
+
+    owned: bool
+        Whether the image belongs to this layer alone (rather than being a shared asset),
+        so it can be freed once it's been merged.
+
+    size: tuple[int, int]
+        The size of the layer's image, read from the file header if it hasn't been opened.
+
+    opaque: bool
+        Whether every pixel of the image is fully opaque. Computed the first time it's needed.
+
+    box: tuple[int, int, int, int]
+        The (left, top, right, bottom) area the layer covers on the image.
     """
 
-    def __init__(self, image: Image.Image, position: tuple[int, int]):
-        self.image = image
+    __slots__ = (
+        "source",
+        "position",
+        "crop",
+        "scale",
+        "asset",
+        "_size",
+        "_opaque",
+        "_image",
+    )
+
+    def __init__(
+        self,
+        source: str | Image.Image,
+        position: tuple[int, int],
+        crop: tuple[int, int, int, int] = None,
+        scale: float = 1,
+        asset: bool = False,
+    ):
+        self.source = source
         self.position = position
+        self.crop = crop
+        self.scale = scale
+        self.asset = asset
+        self._size = None
+        self._opaque = None
+        self._image = None
+
+    def __getstate__(self):
+        return (self.source, self.position, self.crop, self.scale, self.asset)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @property
+    def owned(self) -> bool:
+        return not self.asset
+
+    @property
+    def size(self) -> tuple[int, int]:
+        if self._size is None:
+            if self.crop is not None:
+                left, top, right, bottom = self.crop
+                self._size = (right - left, bottom - top)
+            elif self.asset:
+                self._size = load_asset(self.source, self.scale)[0].size
+            elif self._image is not None:
+                self._size = self._image.size
+            elif isinstance(self.source, Image.Image):
+                self._size = self.source.size
+            else:
+                try:
+                    with Image.open(self.source) as image:
+                        width, height = image.size
+                except OSError:
+                    raise AttributeError
+                self._size = (
+                    scale_length(width, self.scale),
+                    scale_length(height, self.scale),
+                )
+        return self._size
+
+    @property
+    def opaque(self) -> bool:
+        if self._opaque is None:
+            if self.asset and self.crop is None:
+                self._opaque = asset_is_opaque(self.source, self.scale)
+            else:
+                self._opaque = image_is_opaque(self.open())
+        return self._opaque
+
+    @property
+    def origin(self) -> tuple[int, int]:
+        if self.asset and self.crop is None:
+            offset = load_asset(self.source, self.scale)[1]
+            return (self.position[0] + offset[0], self.position[1] + offset[1])
+        return self.position
+
+    @property
+    def box(self) -> tuple[int, int, int, int]:
+        left, top = self.origin
+        width, height = self.size
+        return (left, top, left + width, top + height)
+
+    def open(self) -> Image.Image:
+        """
+        Decode the layer's image, keeping it until the layer is closed.
+        Raises an AttributeError if the image can't be read.
+        """
+
+        if self._image is not None:
+            return self._image
+
+        crop = self.crop
+        if self.asset:
+            image, (offset_left, offset_top) = load_asset(self.source, self.scale)
+            if crop is not None:
+                left, top, right, bottom = crop
+                crop = (
+                    left - offset_left,
+                    top - offset_top,
+                    right - offset_left,
+                    bottom - offset_top,
+                )
+        else:
+            try:
+                if isinstance(self.source, Image.Image):
+                    image = self.source
+                else:
+                    image = Image.open(self.source)
+                    if self.scale != 1:
+                        with image:
+                            image = scale_image(image, self.scale)
+                image.load()
+            except (OSError, SyntaxError, ValueError):
+                raise AttributeError
+            track_image(image)
+
+        if crop is not None:
+            cropped_image = image.crop(crop)
+            if self.owned:
+                image.close()
+            image = track_image(cropped_image)
+
+        self._image = image
+        return image
+
+    def close(self):
+        """
+        Let go of the layer's decoded image, freeing it if no one else uses it.
+        """
+
+        if self._image is None:
+            return
+
+        if self.owned or self.crop is not None:
+            self._image.close()
+        self._image = None
+
+    def take(self) -> Image.Image:
+        """
+        Decode the layer's image and hand it over, so it's no longer freed when the layer is
+        closed. Only meant for layers that own their image.
+        """
+
+        image = self.open()
+        self._image = None
+        return image
@@ -0,0 +1,71 @@
+from PIL import Image
+
+from common import get_card_path
+
+# the extensions outputs are saved with, by format (other formats use the format's name)
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "TIFF": "tif"}
+
+
+class OutputTarget:
+    """
+    An extra file each rendered card is saved as, alongside the full-size PNG.
+
+    Attributes
+    ----------
+    name: str
+        What the output is called on the command line (e.g. "web").
+
+    size: tuple[int, int]
+        The (width, height) box the card is shrunk to fit in, keeping its proportions.
+        Cards that already fit aren't enlarged.
+
+    format: str
+        The format Pillow saves the output in (e.g. "WEBP" or "JPEG").
+
+    params: dict
+        The options passed to the encoder (e.g. {"quality": 85}).
+
+    folder: str
+        The folder in "cards/" the outputs are saved to.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        size: tuple[int, int],
+        format: str,
+        params: dict = None,
+        folder: str = None,
+    ):
+        self.name = name
+        self.size = size
+        self.format = format
+        self.params = params if params is not None else {}
+        self.folder = folder if folder is not None else name
+
+    @property
+    def extension(self) -> str:
+        return FORMAT_EXTENSIONS.get(self.format, self.format.lower())
+
+    def get_path(
+        self, file_name: str, quarantine: bool = False, proof: bool = False
+    ) -> str:
+        return f"cards/{get_card_path(self.folder, quarantine, proof)}{file_name}.{self.extension}"
+
+    def fit(self, image: Image.Image) -> Image.Image:
+        """
+        Shrink the image to fit the output's size, and flatten it onto black if the format
+        can't hold transparency. The image passed in is left as it is.
+        """
+
+        scale = min(self.size[0] / image.width, self.size[1] / image.height, 1)
+        size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        if self.format == "JPEG" and image.has_transparency_data:
+            flattened_image = Image.new("RGB", image.size, (0, 0, 0))
+            flattened_image.paste(image, mask=image.getchannel("A"))
+            image = flattened_image
+
+        return image
@@ -0,0 +1,61 @@
+from common import cardname_to_filename
+from constants import CARD_NAME
+
+
+class RenderJob:
+    """
+    A single card to render, along with the collector number that goes on it.
+
+    Attributes
+    ----------
+    kind: str
+        What kind of card this is (one of the `KIND_*` constants).
+
+    card: dict[str, str]
+        The card's row from the spreadsheets.
+
+    number: int
+        The card's collector number.
+
+    num_cards: int
+        The number of cards the collector number is padded to fit.
+
+    parent_card: dict[str, str], optional
+        The front of the card, if the card is a transform backside.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        card: dict[str, str],
+        number: int,
+        num_cards: int,
+        parent_card: dict[str, str] = None,
+    ):
+        self.kind = kind
+        self.card = card
+        self.number = number
+        self.num_cards = num_cards
+        self.parent_card = parent_card
+
+    @property
+    def name(self) -> str:
+        return self.card[CARD_NAME]
+
+    @property
+    def file_name(self) -> str:
+        return cardname_to_filename(self.name)
+
+    @property
+    def root_name(self) -> str:
+        """
+        The name of the card on the spreadsheet row that brought this card in (the front, for backsides).
+        """
+
+        if self.parent_card is not None:
+            return self.parent_card[CARD_NAME]
+        return self.name
+
+    @property
+    def collector_number(self) -> str:
+        return str(self.number).zfill(len(str(self.num_cards)))
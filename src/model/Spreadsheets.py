@@ -0,0 +1,94 @@
+from concurrent.futures import Future
+from functools import cached_property
+
+from common import read_alt_arts, read_basic_lands, read_cards, read_tokens
+from model.CardIndex import CardIndex
+from startup import in_background, wait_for
+
+READERS = {
+    "cards": read_cards,
+    "tokens": read_tokens,
+    "basic_lands": read_basic_lands,
+    "alt_arts": read_alt_arts,
+}
+
+
+class Spreadsheets:
+    """
+    The card information from the spreadsheets, with each kind of card read the first time
+    it's needed, so the cards of one kind can be worked on before the rest have been read.
+    Kinds that are sure to be needed can be read on other threads ahead of time.
+    Unpacks like `process_spreadsheets` into (cards, tokens, basic lands, alt arts).
+
+    Attributes
+    ----------
+    cards: dict[str, dict[str, str | dict[str, str]]]
+        The regular cards, each with its transform backsides.
+
+    tokens: dict[str, dict[str, str]]
+        The tokens, by full token name.
+
+    basic_lands: dict[str, dict[str, str]]
+        The basic lands, by name and descriptor.
+
+    alt_arts: dict[str, dict[str, str | dict[str, str]]]
+        The alternate arts, by name and descriptor, each with its transform backsides.
+
+    num_mainline_cards: int
+        The number of cards the regular cards and basic lands are numbered out of.
+    """
+
+    def __init__(self):
+        self._reading: dict[str, Future] = {}
+        self._indexes: dict[str, CardIndex] = {}
+
+    def read_in_background(self, *kinds: str):
+        """
+        Start reading the given kinds of cards ("cards", "tokens", "basic_lands", "alt_arts")
+        on other threads.
+        """
+
+        for kind in kinds:
+            if kind not in self._reading and kind not in self.__dict__:
+                self._reading[kind] = in_background(f"Reading {kind}", READERS[kind])
+
+    def _read(self, kind: str):
+        reading = self._reading.pop(kind, None)
+        if reading is None:
+            return READERS[kind]()
+        return wait_for(f"reading {kind}", reading)
+
+    @cached_property
+    def cards(self) -> dict[str, dict[str, str | dict[str, str]]]:
+        return self._read("cards")
+
+    @cached_property
+    def tokens(self) -> dict[str, dict[str, str]]:
+        return self._read("tokens")
+
+    @cached_property
+    def basic_lands(self) -> dict[str, dict[str, str]]:
+        return self._read("basic_lands")
+
+    @cached_property
+    def alt_arts(self) -> dict[str, dict[str, str | dict[str, str]]]:
+        return self._read("alt_arts")
+
+    def get_index(self, kind: str) -> CardIndex:
+        """
+        Get the index of the given kind of cards, building it the first time it's asked for.
+        """
+
+        if kind not in self._indexes:
+            self._indexes[kind] = CardIndex(getattr(self, kind))
+        return self._indexes[kind]
+
+    @property
+    def num_mainline_cards(self) -> int:
+        return len(self.cards) + len(self.basic_lands)
+
+    def __iter__(self):
+        yield self.cards
+        yield self.tokens
+        yield self.basic_lands
+        yield self.alt_arts
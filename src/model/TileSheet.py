@@ -0,0 +1,41 @@
+from constants import CARD_HEIGHT, CARD_WIDTH, TILING_WIDTH
+
+
+class TileSheet:
+    """
+    One sheet of cards tiled into a grid.
+
+    Attributes
+    ----------
+    kind: str
+        What's on the sheet ("cards", "tokens", "basic_lands", or "alt_arts"), used to name its file.
+
+    num: int
+        The sheet's number among the sheets of its kind.
+
+    slots: list[tuple[int, str, bool, bool]]
+        The cards on the sheet, as (slot index, card name, whether to rotate it, whether it's a backside).
+
+    final: bool
+        Whether this is the last, partially filled sheet of its kind.
+    """
+
+    def __init__(self, kind: str, num: int):
+        self.kind = kind
+        self.num = num
+        self.slots = []
+        self.final = False
+
+    @property
+    def file_name(self) -> str:
+        return f"{self.kind}{self.num}"
+
+    def get_position(self, slot: int) -> tuple[int, int]:
+        """
+        Get the full-size position of the top left corner of the given slot.
+        """
+
+        return (
+            (slot % TILING_WIDTH) * CARD_WIDTH,
+            (slot // TILING_WIDTH) * CARD_HEIGHT,
+        )
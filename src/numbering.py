@@ -0,0 +1,151 @@
+"""
+Remembers the collector number each card was last rendered with, and what was on each tile sheet
+when it was last tiled, so a run can redo only the outputs that cards being added, removed, or
+redated have renumbered.
+"""
+
+import glob
+import json
+import os
+import re
+
+from common import save_json
+from constants import KIND_ALT_ART, KIND_BASIC_LAND, KIND_CARD, KIND_TOKEN, MANIFESTS
+from log import log
+from model.RenderJob import RenderJob
+from model.TileSheet import TileSheet
+
+SHEET_CARD_KINDS = {
+    "cards": KIND_CARD,
+    "tokens": KIND_TOKEN,
+    "basic_lands": KIND_BASIC_LAND,
+    "alt_arts": KIND_ALT_ART,
+}
+
+
+def get_table_path(
+    table: str, card_path: str, shard: tuple[int, int] | None = None
+) -> str:
+    """
+    Get where the table for the cards in `card_path` (relative to "cards/") is kept, or where
+    the given shard of a run keeps its part of the table until the shards are merged.
+    """
+
+    shard_suffix = f".shard{shard[0]}of{shard[1]}" if shard is not None else ""
+    return f"{MANIFESTS}{table}.{card_path.strip("/").replace("/", ".")}{shard_suffix}.json"
+
+
+def load_table(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf8") as table_file:
+            return json.load(table_file)
+    except FileNotFoundError:
+        return {}
+
+
+def merge_shard_tables(table: str):
+    """
+    Merge the parts of the table every shard of a run saved into the full tables, then delete
+    the parts.
+    """
+
+    for shard_path in sorted(glob.glob(f"{MANIFESTS}{table}.*.shard*of*.json")):
+        path = re.sub(r"\.shard\d+of\d+\.json$", ".json", shard_path)
+        merged = load_table(path)
+        for key, value in load_table(shard_path).items():
+            if isinstance(value, dict):
+                merged.setdefault(key, {}).update(value)
+            else:
+                merged[key] = value
+
+        save_json(path, merged)
+        os.remove(shard_path)
+        log(f"Merged {shard_path} into {path}.")
+
+
+def get_previous_number(
+    numbers: dict[str, dict[str, str]], job: RenderJob
+) -> str | None:
+    return numbers.get(job.kind, {}).get(job.name)
+
+
+def is_renumbered(numbers: dict[str, dict[str, str]], job: RenderJob) -> bool:
+    """
+    Whether the job's card was last rendered with a different collector number (or padding),
+    or has never been rendered.
+    """
+
+    return get_previous_number(numbers, job) != job.collector_number
+
+
+def record_numbers(numbers: dict[str, dict[str, str]], jobs: list[RenderJob]):
+    for job in jobs:
+        numbers.setdefault(job.kind, {})[job.name] = job.collector_number
+
+
+def report_renumbering(
+    numbers: dict[str, dict[str, str]], jobs: list[RenderJob]
+) -> int:
+    """
+    Log every card whose collector number changed since it was last rendered.
+    Returns how many there are.
+    """
+
+    num_renumbered = 0
+    for job in jobs:
+        if not is_renumbered(numbers, job):
+            continue
+
+        previous_number = get_previous_number(numbers, job)
+        log(
+            f"""{"\t" if job.parent_card is not None else ""}"{job.name}": {previous_number or "new"} -> {job.collector_number}"""
+        )
+        num_renumbered += 1
+
+    if num_renumbered == 0:
+        log("No cards were renumbered.")
+    log("")
+
+    return num_renumbered
+
+
+def get_sheet_contents(
+    sheet: TileSheet, numbers: dict[str, dict[str, str]]
+) -> list[list]:
+    """
+    Get what's on the sheet, as [slot index, card name, collector number] for every slot.
+    """
+
+    kind_numbers = numbers.get(SHEET_CARD_KINDS[sheet.kind], {})
+    return [
+        [slot, card_name, kind_numbers.get(card_name)]
+        for slot, card_name, _, _ in sheet.slots
+    ]
+
+
+def report_sheet_changes(
+    sheet: TileSheet, previous_contents: list[list] | None, contents: list[list]
+):
+    """
+    Log the slots of the sheet whose card or collector number changed since it was last tiled.
+    """
+
+    if previous_contents is None:
+        log(f"{sheet.file_name}: not tiled before")
+        return
+
+    previous_slots = {
+        slot: (card_name, number) for slot, card_name, number in previous_contents
+    }
+    slots = {slot: (card_name, number) for slot, card_name, number in contents}
+    for slot in sorted(previous_slots.keys() | slots.keys()):
+        previous_card = previous_slots.get(slot)
+        card = slots.get(slot)
+        if previous_card == card:
+            continue
+
+        before = (
+            f'"{previous_card[0]}" {previous_card[1]}' if previous_card else "empty"
+        )
+        after = f'"{card[0]}" {card[1]}' if card else "empty"
+        log(f"{sheet.file_name} slot {slot + 1}: {before} -> {after}")
@@ -0,0 +1,90 @@
+"""
+Saves each rendered card as every output asked for (the full-size PNG, plus extra sizes and
+formats like web previews and thumbnails) from the one composite in memory, encoding the
+outputs on several threads at once, so an extra output only costs its own resize and encode.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from common import (
+    get_card_path,
+    get_saved_info,
+    image_digest,
+    save_image,
+    save_image_if_changed,
+)
+from constants import OUTPUT_TARGETS, OUTPUT_WORKERS
+from memory import track_image
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+    from model.OutputTarget import OutputTarget
+
+_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_targets: list["OutputTarget"] = []
+
+
+def set_output_targets(names: list[str] | None):
+    """
+    Set the extra outputs (by their names in `OUTPUT_TARGETS`) every card is saved as.
+    """
+
+    global _targets
+    from model.OutputTarget import OutputTarget
+
+    _targets = [OutputTarget(name, **OUTPUT_TARGETS[name]) for name in names or []]
+
+
+def save_output(
+    image: "Image.Image", target: "OutputTarget", path: str, thread_id: int = None
+):
+    output_image = target.fit(image)
+    if output_image is not image:
+        track_image(output_image, thread_id)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_image(output_image, path, **target.params)
+
+
+def save_card(
+    image: "Image.Image", file_name: str, quarantine: bool = False, proof: bool = False
+):
+    """
+    Save the rendered card to the processed cards, and as every extra output on other threads.
+    The full-size PNG isn't written again if it's unchanged, and then neither are the card's
+    extra outputs, unless they're missing.
+    """
+
+    global _executor
+    path = f"cards/{get_card_path("processed_cards", quarantine, proof)}{file_name}.png"
+    if len(_targets) == 0:
+        save_image_if_changed(image, path)
+        return
+
+    digest = image_digest(image)
+    changed = get_saved_info(path).get("Digest") != digest
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=OUTPUT_WORKERS, thread_name_prefix="outputs"
+            )
+
+    # the outputs are charged to this thread, which holds the card while it waits on them
+    thread_id = threading.get_ident()
+    futures = []
+    for target in _targets:
+        target_path = target.get_path(file_name, quarantine, proof)
+        if changed or not os.path.isfile(target_path):
+            futures.append(
+                _executor.submit(save_output, image, target, target_path, thread_id)
+            )
+
+    save_image_if_changed(image, path, digest)
+    for future in futures:
+        future.result()
@@ -0,0 +1,297 @@
+"""
+Exports tile sheets as print-ready multi-page PDFs, one page per sheet, without compositing the
+sheets. Each card is placed at its slot as its own image. PNGs without transparency are embedded
+as-is (PDF can read PNG's compressed data directly); other cards are decoded one at a time.
+"""
+
+import os
+import struct
+import zlib
+from PIL import Image
+
+from common import cardname_to_filename, find_card_file
+from constants import CARD_HEIGHT, CARD_WIDTH, PRINT_DPI, TILING_HEIGHT, TILING_WIDTH
+from log import log
+from model.TileSheet import TileSheet
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+POINTS_PER_PIXEL = 72 / PRINT_DPI
+COPY_BLOCK_SIZE = 2**20
+
+
+class PdfWriter:
+    """
+    Writes a PDF one object at a time, so only the object being written needs to be in memory.
+
+    Attributes
+    ----------
+    file: BinaryIO
+        The file the PDF is written to.
+
+    offsets: dict[int, int]
+        The byte offset of each object written so far, by object number.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.offsets = {}
+        self._next_number = 1
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self) -> int:
+        """
+        Get an object number to write the object with later.
+        """
+
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def write_object(self, body: bytes, number: int = None) -> int:
+        if number is None:
+            number = self.reserve()
+        self.offsets[number] = self.file.tell()
+        self.file.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+        return number
+
+    def begin_stream(self, dictionary: str, length: int) -> int:
+        """
+        Start a stream object of the given length; its data is then written straight to `file`.
+        """
+
+        number = self.reserve()
+        self.offsets[number] = self.file.tell()
+        self.file.write(
+            f"{number} 0 obj\n<< {dictionary} /Length {length} >>\nstream\n".encode()
+        )
+        return number
+
+    def end_stream(self):
+        self.file.write(b"\nendstream\nendobj\n")
+
+    def write_stream(self, dictionary: str, data: bytes) -> int:
+        number = self.begin_stream(dictionary, len(data))
+        self.file.write(data)
+        self.end_stream()
+        return number
+
+    def close(self, root: int):
+        """
+        Write the cross-reference table and trailer that finish the PDF.
+        """
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self._next_number}\n0000000000 65535 f \n".encode())
+        for number in range(1, self._next_number):
+            self.file.write(f"{self.offsets[number]:010} 00000 n \n".encode())
+        self.file.write(
+            f"trailer\n<< /Size {self._next_number} /Root {root} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+
+
+def read_png_layout(path: str) -> dict | None:
+    """
+    Read the header of the PNG at `path` and find its image data, without decoding it.
+    Returns None if the PNG's data can't be embedded in a PDF as-is (it has transparency,
+    is interlaced, or has an unsupported bit depth) or the file isn't a PNG.
+    """
+
+    with open(path, "rb") as png_file:
+        if png_file.read(8) != PNG_SIGNATURE:
+            return None
+
+        layout = {"palette": None, "data": []}
+        while True:
+            chunk_header = png_file.read(8)
+            if len(chunk_header) < 8:
+                return None
+            length, chunk_type = struct.unpack(">I4s", chunk_header)
+
+            if chunk_type == b"IHDR":
+                (
+                    layout["width"],
+                    layout["height"],
+                    layout["bit_depth"],
+                    layout["color_type"],
+                    _,
+                    _,
+                    interlace,
+                ) = struct.unpack(">IIBBBBB", png_file.read(length))
+                if interlace != 0:
+                    return None
+            elif chunk_type == b"PLTE":
+                layout["palette"] = png_file.read(length)
+            elif chunk_type == b"tRNS":
+                return None
+            elif chunk_type == b"IDAT":
+                layout["data"].append((png_file.tell(), length))
+                png_file.seek(length, 1)
+            elif chunk_type == b"IEND":
+                break
+            else:
+                png_file.seek(length, 1)
+            png_file.seek(4, 1)
+
+    color_type, bit_depth = layout["color_type"], layout["bit_depth"]
+    if color_type in (0, 2) and bit_depth == 8:
+        layout["colors"] = 1 if color_type == 0 else 3
+        return layout
+    if color_type == 3 and layout["palette"] is not None:
+        layout["colors"] = 1
+        return layout
+    return None
+
+
+def write_png_image(pdf: PdfWriter, path: str, layout: dict) -> int:
+    """
+    Embed the PNG's compressed data as an image, copying it over a block at a time.
+    """
+
+    if layout["color_type"] == 0:
+        color_space = "/DeviceGray"
+    elif layout["color_type"] == 2:
+        color_space = "/DeviceRGB"
+    else:
+        palette = layout["palette"]
+        color_space = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{palette.hex()}>]"
+
+    number = pdf.begin_stream(
+        f"/Type /XObject /Subtype /Image /Width {layout["width"]} /Height {layout["height"]}"
+        f" /ColorSpace {color_space} /BitsPerComponent {layout["bit_depth"]}"
+        f" /Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {layout["colors"]}"
+        f" /BitsPerComponent {layout["bit_depth"]} /Columns {layout["width"]} >>",
+        sum(length for _, length in layout["data"]),
+    )
+    with open(path, "rb") as png_file:
+        for offset, length in layout["data"]:
+            png_file.seek(offset)
+            while length > 0:
+                block = png_file.read(min(length, COPY_BLOCK_SIZE))
+                pdf.file.write(block)
+                length -= len(block)
+    pdf.end_stream()
+    return number
+
+
+def write_decoded_image(pdf: PdfWriter, path: str) -> int:
+    """
+    Decode the image and embed it, with its transparency as a soft mask if it has any.
+    """
+
+    with Image.open(path) as image:
+        if image.mode not in ("L", "RGB", "LA", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+        mask = None
+        if "A" in image.getbands():
+            alpha = image.getchannel("A")
+            if alpha.getextrema()[0] < 255:
+                mask = pdf.write_stream(
+                    f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}"
+                    " /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode",
+                    zlib.compress(alpha.tobytes(), 1),
+                )
+            image = image.convert("L" if image.mode == "LA" else "RGB")
+
+        return pdf.write_stream(
+            f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}"
+            f" /ColorSpace {"/DeviceGray" if image.mode == "L" else "/DeviceRGB"}"
+            f" /BitsPerComponent 8 /Filter /FlateDecode{f" /SMask {mask} 0 R" if mask else ""}",
+            zlib.compress(image.tobytes(), 1),
+        )
+
+
+def get_placement(sheet: TileSheet, slot: int, rotate: bool) -> str:
+    """
+    Get the matrix that stretches an image over the slot, turned a quarter turn
+    counterclockwise if asked.
+    """
+
+    page_height = TILING_HEIGHT * CARD_HEIGHT * POINTS_PER_PIXEL
+    left, top = sheet.get_position(slot)
+    x = left * POINTS_PER_PIXEL
+    y = page_height - (top + CARD_HEIGHT) * POINTS_PER_PIXEL
+    width = CARD_WIDTH * POINTS_PER_PIXEL
+    height = CARD_HEIGHT * POINTS_PER_PIXEL
+
+    if rotate:
+        return f"0 {height:g} {-width:g} 0 {x + width:g} {y:g} cm"
+    return f"{width:g} 0 0 {height:g} {x:g} {y:g} cm"
+
+
+def export_sheets_pdf(
+    sheets: list[TileSheet], card_path: str | list[str], path: str
+) -> int:
+    """
+    Write the sheets to a PDF at `path`, one page per sheet, with every card at its slot.
+    Returns the number of cards whose image data was embedded without decoding it.
+    """
+
+    page_width = TILING_WIDTH * CARD_WIDTH * POINTS_PER_PIXEL
+    page_height = TILING_HEIGHT * CARD_HEIGHT * POINTS_PER_PIXEL
+    num_embedded = 0
+
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as pdf_file:
+            pdf = PdfWriter(pdf_file)
+            pages = pdf.reserve()
+
+            page_numbers = []
+            for sheet in sheets:
+                images = []
+                content = []
+                for slot, card_name, rotate, backside in sheet.slots:
+                    log(
+                        f"""{"\t" if backside else ""}Placing "{card_name}".""",
+                        do_print=False,
+                    )
+
+                    file_name = cardname_to_filename(card_name)
+                    card_image_path = find_card_file(file_name, card_path)
+                    if card_image_path is None:
+                        continue
+
+                    try:
+                        layout = read_png_layout(card_image_path)
+                        if layout is not None:
+                            image = write_png_image(pdf, card_image_path, layout)
+                            num_embedded += 1
+                        else:
+                            image = write_decoded_image(pdf, card_image_path)
+                    except (OSError, SyntaxError, ValueError, struct.error):
+                        log(
+                            f"""Card file "{file_name}" cannot be opened or is otherwise corrupted."""
+                        )
+                        continue
+
+                    images.append(f"/Im{slot} {image} 0 R")
+                    content.append(
+                        f"q {get_placement(sheet, slot, rotate)} /Im{slot} Do Q"
+                    )
+
+                contents = pdf.write_stream("", "\n".join(content).encode())
+                page_numbers.append(
+                    pdf.write_object(
+                        f"<< /Type /Page /Parent {pages} 0 R"
+                        f" /MediaBox [0 0 {page_width:g} {page_height:g}]"
+                        f" /Resources << /XObject << {" ".join(images)} >> >>"
+                        f" /Contents {contents} 0 R >>".encode()
+                    )
+                )
+                log(f"\nAdded {sheet.file_name} as page {len(page_numbers)}.\n")
+
+            pdf.write_object(
+                f"<< /Type /Pages /Kids [{" ".join(f"{page} 0 R" for page in page_numbers)}]"
+                f" /Count {len(page_numbers)} >>".encode(),
+                pages,
+            )
+            root = pdf.write_object(f"<< /Type /Catalog /Pages {pages} 0 R >>".encode())
+            pdf.close(root)
+
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return num_embedded
@@ -0,0 +1,139 @@
+"""
+Saves tile sheets as PNGs a band of rows at a time, compressing each band as soon as it's
+built and streaming it to the file, so only about a band of the sheet is ever in memory and
+the size of the grid isn't limited by it.
+"""
+
+from collections.abc import Iterable, Iterator
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from PIL import Image, ImageChops
+
+from common import DIGEST_ROWS, add_card_file, count_write, get_saved_info
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the PNG color types of the modes images can be saved in
+COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+
+# the filter type byte each row starts with; rows are stored as their difference from the
+# row above, which compresses about as well as Pillow's adaptive filtering for card sheets
+UP_FILTER = b"\x02"
+
+# the length of a digest in hex, the same as `image_digest`'s
+DIGEST_LENGTH = hashlib.sha1().digest_size * 2
+
+
+def write_chunk(png_file, chunk_type: bytes, data: bytes):
+    png_file.write(struct.pack(">I", len(data)))
+    png_file.write(chunk_type)
+    png_file.write(data)
+    png_file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def filter_rows(band: Image.Image, row_above: Image.Image | None) -> bytes:
+    """
+    Get the band's rows with PNG's Up filter applied, each after its filter type byte, given
+    the row above the band (None for the first band).
+    """
+
+    above = Image.new(band.mode, band.size)
+    if row_above is not None:
+        above.paste(row_above, (0, 0))
+    above.paste(band.crop((0, 0, band.width, band.height - 1)), (0, 1))
+
+    filtered = ImageChops.subtract_modulo(band, above).tobytes()
+    stride = len(filtered) // band.height
+    return b"".join(
+        UP_FILTER + filtered[start : start + stride]
+        for start in range(0, len(filtered), stride)
+    )
+
+
+def get_strips(bands: Iterable[Image.Image]) -> Iterator[Image.Image]:
+    """
+    Split the bands into strips of at most `DIGEST_ROWS` rows, so a band's bytes are never all
+    copied at once.
+    """
+
+    for band in bands:
+        for top in range(0, band.height, DIGEST_ROWS):
+            yield band.crop((0, top, band.width, min(top + DIGEST_ROWS, band.height)))
+
+
+def save_png_bands_if_changed(
+    bands: Iterable[Image.Image],
+    size: tuple[int, int],
+    mode: str,
+    path: str,
+    digest: str = None,
+) -> bool:
+    """
+    Save the image made of the bands (full-width runs of rows, top to bottom) as a PNG, along
+    with a digest like `save_image_if_changed`'s. A given digest (of whatever the image is
+    made from) is checked before the bands are built, so an unchanged image isn't built or
+    encoded at all. Without one, the digest is of the pixels, hashed while they're encoded,
+    and an unchanged image's encoding is thrown away instead of replacing the file. Returns
+    whether the image was saved.
+    """
+
+    saved_digest = get_saved_info(path).get("Digest")
+    if digest is not None and digest == saved_digest:
+        count_write(True)
+        return False
+
+    width, height = size
+    pixel_digest = (
+        hashlib.sha1(f"{mode}:{width}x{height}".encode("utf8"))
+        if digest is None
+        else None
+    )
+    directory, file_name = os.path.split(path)
+    temp_path = os.path.join(
+        directory, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        with open(temp_path, "wb") as png_file:
+            png_file.write(PNG_SIGNATURE)
+            write_chunk(
+                png_file,
+                b"IHDR",
+                struct.pack(">IIBBBBB", width, height, 8, COLOR_TYPES[mode], 0, 0, 0),
+            )
+            # the digest is filled in once every band has been read
+            digest_position = png_file.tell()
+            write_chunk(png_file, b"tEXt", b"Digest\x00" + b"0" * DIGEST_LENGTH)
+
+            compressor = zlib.compressobj()
+            row_above = None
+            for strip in get_strips(bands):
+                if pixel_digest is not None:
+                    pixel_digest.update(strip.tobytes())
+
+                data = compressor.compress(filter_rows(strip, row_above))
+                if len(data) > 0:
+                    write_chunk(png_file, b"IDAT", data)
+                row_above = strip.crop((0, strip.height - 1, strip.width, strip.height))
+            write_chunk(png_file, b"IDAT", compressor.flush())
+            write_chunk(png_file, b"IEND", b"")
+
+            if digest is None:
+                digest = pixel_digest.hexdigest()
+            png_file.seek(digest_position)
+            write_chunk(png_file, b"tEXt", b"Digest\x00" + digest.encode("ascii"))
+
+        unchanged = digest == saved_digest
+        count_write(unchanged)
+        if not unchanged:
+            os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if unchanged:
+        return False
+    add_card_file(path)
+    return True
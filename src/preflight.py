@@ -0,0 +1,258 @@
+"""
+Checks everything a run needs before anything is rendered, reading only the headers of the
+images, so every problem with the spreadsheets, source images and overlays is reported at
+once, in seconds, instead of turning up partway through the run.
+"""
+
+import argparse
+from datetime import datetime
+import os
+import struct
+import sys
+import time
+
+from common import find_card_file, process_spreadsheets, read_spreadsheet
+from constants import (
+    ALT_ARTS,
+    CARD_COLOR,
+    CARD_DATE,
+    CARD_NAME,
+    CARDS,
+    COLORS,
+    DESCRIPTOR,
+    FRONT_CARD_DESCRIPTOR,
+    FRONT_CARD_NAME,
+    KIND_ALT_ART,
+    KIND_BASIC_LAND,
+    KIND_CARD,
+    KIND_TOKEN,
+    SOURCE_MODES,
+    TRANSFORM_BACKSIDES,
+)
+from log import log, reset_log
+from model.RenderJob import RenderJob
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the modes Pillow opens 8-bit PNGs of each color type in
+PNG_COLOR_TYPES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+
+_failed: set[str] = set()
+
+
+def read_png_header(path: str) -> tuple[tuple[int, int], str] | None:
+    """
+    Read the size and mode of a PNG from its header alone.
+    Returns None if the file can't be read or isn't a PNG.
+    """
+
+    try:
+        with open(path, "rb") as png_file:
+            header = png_file.read(26)
+    except OSError:
+        return None
+
+    if len(header) < 26 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", header[16:26])
+    if color_type not in PNG_COLOR_TYPES:
+        return None
+
+    mode = PNG_COLOR_TYPES[color_type]
+    if bit_depth != 8:
+        mode = f"{mode} ({bit_depth}-bit)"
+    return (width, height), mode
+
+
+def has_valid_date(row: dict[str, str]) -> bool:
+    try:
+        datetime.strptime(row[CARD_DATE], "%m/%d/%Y")
+    except ValueError:
+        return False
+    return True
+
+
+def is_color_identity(color: str) -> bool:
+    return color == "Colorless" or (
+        all(char in COLORS for char in color) and len(set(color)) == len(color)
+    )
+
+
+def check_row(row: dict[str, str], kind: str) -> list[str]:
+    """
+    Check the card's spreadsheet row, returning its problems.
+    """
+
+    problems = []
+    if not has_valid_date(row):
+        problems.append(f"""its date "{row[CARD_DATE]}" isn't a date like 12/31/2024""")
+
+    # tokens with bad color identities are already left out when they're read
+    color = row[CARD_COLOR].strip()
+    if kind in (KIND_CARD, KIND_ALT_ART) and not is_color_identity(color):
+        problems.append(f"""its color identity "{color}" isn't valid""")
+
+    return problems
+
+
+def check_backside_fronts() -> dict[str, list[str]]:
+    """
+    Check that the front card of every transform backside is on the spreadsheets, returning
+    the problems with each backside, by name.
+    """
+
+    problems = {}
+
+    card_names = {row[CARD_NAME] for row in read_spreadsheet(CARDS)}
+    for row in read_spreadsheet(TRANSFORM_BACKSIDES):
+        if row[FRONT_CARD_NAME] not in card_names:
+            problems.setdefault(row[CARD_NAME], []).append(
+                f"""its front card "{row[FRONT_CARD_NAME]}" isn't on the spreadsheets"""
+            )
+
+    alt_art_rows = list(read_spreadsheet(ALT_ARTS))
+    alt_art_names = {
+        f"{row[CARD_NAME]} - {row[DESCRIPTOR]}"
+        for row in alt_art_rows
+        if len(row[FRONT_CARD_NAME].strip()) == 0
+    }
+    for row in alt_art_rows:
+        front_card_name = row[FRONT_CARD_NAME].strip()
+        if len(front_card_name) == 0:
+            continue
+
+        full_front_card_name = f"{front_card_name} - {row[FRONT_CARD_DESCRIPTOR]}"
+        if full_front_card_name not in alt_art_names:
+            problems.setdefault(f"{row[CARD_NAME]} - {row[DESCRIPTOR]}", []).append(
+                f"""its front card "{full_front_card_name}" isn't on the spreadsheets"""
+            )
+
+    return problems
+
+
+def check_job(job: RenderJob) -> list[str]:
+    """
+    Check the job's source image and every overlay its card is made of, reading only their
+    headers. Returns the job's problems.
+    """
+
+    from collection_info import layout_job
+
+    source_path = find_card_file(job.file_name, log_missing=False)
+    if source_path is None:
+        return [f"""its source image "{job.file_name}.png" is missing"""]
+
+    card = layout_job(job)
+    problems = []
+
+    header = read_png_header(source_path)
+    expected_size = (card.base_width, card.base_height)
+    if header is None:
+        problems.append(f"""its source image "{source_path}" can't be read""")
+    else:
+        (width, height), mode = header
+        if (width, height) != expected_size:
+            problems.append(
+                f"its source image is {width}x{height} instead of {expected_size[0]}x{expected_size[1]}"
+            )
+        if mode not in SOURCE_MODES:
+            problems.append(
+                f"its source image is {mode} instead of {" or ".join(SOURCE_MODES)}"
+            )
+
+    for layer in card.layers:
+        if not layer.asset:
+            continue
+
+        if not os.path.isfile(layer.source):
+            problems.append(f"""its overlay "{layer.source}" is missing""")
+        elif read_png_header(layer.source) is None:
+            problems.append(f"""its overlay "{layer.source}" can't be read""")
+
+    return problems
+
+
+def run_preflight(
+    cards: dict[str, dict[str, str | dict[str, str]]],
+    tokens: dict[str, dict[str, str]],
+    basic_lands: dict[str, dict[str, str]],
+    alt_arts: dict[str, dict[str, str | dict[str, str]]],
+) -> dict[str, list[str]]:
+    """
+    Check every card without rendering any of them, logging every problem found. Cards whose
+    date can't be read are taken out of the spreadsheets, since they can't be put in order;
+    the other cards with problems fail preflight, so they're skipped when rendering.
+    Returns the problems with each card, by name.
+    """
+
+    from collection_info import get_render_jobs
+
+    log("\n----- PREFLIGHT -----\n")
+    start = time.perf_counter()
+
+    problems = check_backside_fronts()
+
+    for kind, rows in (
+        (KIND_CARD, cards),
+        (KIND_TOKEN, tokens),
+        (KIND_BASIC_LAND, basic_lands),
+        (KIND_ALT_ART, alt_arts),
+    ):
+        for name in list(rows.keys()):
+            row = rows[name]
+            backsides = row.get("Transform Backsides", [])
+            for backside in list(backsides):
+                backside_problems = check_row(backside, kind)
+                if len(backside_problems) > 0:
+                    problems.setdefault(backside[CARD_NAME], []).extend(
+                        backside_problems
+                    )
+                if not has_valid_date(backside):
+                    backsides.remove(backside)
+
+            row_problems = check_row(row, kind)
+            if len(row_problems) > 0:
+                problems.setdefault(name, []).extend(row_problems)
+            if not has_valid_date(row):
+                del rows[name]
+
+    for job in get_render_jobs(cards, tokens, basic_lands, alt_arts):
+        job_problems = check_job(job)
+        if len(job_problems) > 0:
+            problems.setdefault(job.name, []).extend(job_problems)
+
+    for name, card_problems in problems.items():
+        for problem in card_problems:
+            log(f""""{name}": {problem}.""")
+
+    num_problems = sum(len(card_problems) for card_problems in problems.values())
+    seconds = time.perf_counter() - start
+    if num_problems == 0:
+        log(f"No problems found ({seconds:.1f} s).")
+    else:
+        log(
+            f"\nFound {num_problems} problems with {len(problems)} cards ({seconds:.1f} s)."
+        )
+
+    _failed.update(problems.keys())
+    return problems
+
+
+def failed_preflight(name: str) -> bool:
+    return name in _failed
+
+
+def main():
+    reset_log()
+    problems = run_preflight(*process_spreadsheets())
+    if len(problems) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the spreadsheets, source images and overlays without rendering anything."
+    )
+    parser.parse_args()
+    main()
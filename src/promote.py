@@ -0,0 +1,273 @@
+"""
+Promotes approved cards and tile sheets out of quarantine into the main folders by moving (or
+hard-linking) their files and updating the manifests to match, so approving a quarantined
+batch never means rendering or tiling it again.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import threading
+
+from common import (
+    cardname_to_filename,
+    get_card_path,
+    list_card_files,
+    parse_proof_scale,
+    save_json,
+)
+from constants import MANIFESTS, OUTPUT_TARGETS
+from log import log
+from numbering import get_table_path, load_table
+from tiff_export import SHEET_INDEX
+
+
+def promote_file(source: str, destination: str, keep: bool = False):
+    """
+    Put the file at `source` in place of `destination` in one step, so nothing ever sees a
+    half-written file there. The file is moved, or hard-linked if it's to be kept in
+    quarantine too (copied if the file system can't link it).
+    """
+
+    if not keep:
+        os.replace(source, destination)
+        return
+
+    directory, file_name = os.path.split(destination)
+    temp_path = os.path.join(
+        directory, f".{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copy2(source, temp_path)
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def promote_folder(
+    folder: str, proof: bool, file_names: set[str], keep: bool = False
+) -> dict[str, str]:
+    """
+    Promote the given files from the quarantine folder into the main one.
+    Returns the new path of each promoted file, by its path in quarantine.
+    """
+
+    quarantine_path = get_card_path(folder, quarantine=True, proof=proof)
+    main_path = get_card_path(folder, quarantine=False, proof=proof)
+    os.makedirs(f"cards/{main_path}", exist_ok=True)
+
+    moved_paths = {}
+    for file_name in sorted(file_names):
+        source = f"cards/{quarantine_path}{file_name}"
+        destination = f"cards/{main_path}{file_name}"
+        try:
+            promote_file(source, destination, keep)
+        except OSError as e:
+            log(f"""Couldn't promote "{source}" ({e}).""")
+            continue
+        moved_paths[source] = destination
+        log(f"Promoted {source}", do_print=False)
+
+    return moved_paths
+
+
+def promote_numbers(proof: bool, file_names: set[str], keep: bool = False):
+    """
+    Move the collector numbers the promoted cards (by file name) were rendered with into the
+    main folder's table, so renumbering checks treat them like cards rendered there.
+    """
+
+    quarantine_table_path = get_table_path(
+        "collector_numbers", get_card_path("processed_cards", True, proof)
+    )
+    main_table_path = get_table_path(
+        "collector_numbers", get_card_path("processed_cards", False, proof)
+    )
+    quarantine_numbers = load_table(quarantine_table_path)
+    if len(quarantine_numbers) == 0:
+        return
+    main_numbers = load_table(main_table_path)
+
+    for kind, numbers in quarantine_numbers.items():
+        for card_name in [
+            name for name in numbers if cardname_to_filename(name) in file_names
+        ]:
+            main_numbers.setdefault(kind, {})[card_name] = numbers[card_name]
+            if not keep:
+                del numbers[card_name]
+
+    save_json(main_table_path, main_numbers)
+    save_json(quarantine_table_path, quarantine_numbers)
+
+
+def promote_sheet_tables(proof: bool, sheet_files: set[str], keep: bool = False):
+    """
+    Move what's recorded about the promoted sheets (what's on them, and where each card is on
+    the TIFF ones) from the quarantine folder's records into the main folder's.
+    """
+
+    quarantine_path = get_card_path("card_tilings", quarantine=True, proof=proof)
+    main_path = get_card_path("card_tilings", quarantine=False, proof=proof)
+
+    sheet_names = {os.path.splitext(sheet_file)[0] for sheet_file in sheet_files}
+    quarantine_contents_path = get_table_path("tile_sheets", quarantine_path)
+    main_contents_path = get_table_path("tile_sheets", main_path)
+    quarantine_contents = load_table(quarantine_contents_path)
+    if any(sheet in sheet_names for sheet in quarantine_contents):
+        main_contents = load_table(main_contents_path)
+        for sheet in [sheet for sheet in quarantine_contents if sheet in sheet_names]:
+            main_contents[sheet] = quarantine_contents[sheet]
+            if not keep:
+                del quarantine_contents[sheet]
+        save_json(main_contents_path, main_contents)
+        save_json(quarantine_contents_path, quarantine_contents)
+
+    quarantine_index_path = f"cards/{quarantine_path}{SHEET_INDEX}"
+    main_index_path = f"cards/{main_path}{SHEET_INDEX}"
+    quarantine_index = load_table(quarantine_index_path)
+    promoted_regions = {
+        card_name: region
+        for card_name, region in quarantine_index.items()
+        if region["sheet"] in sheet_files
+    }
+    if len(promoted_regions) == 0:
+        return
+
+    main_index = {
+        card_name: region
+        for card_name, region in load_table(main_index_path).items()
+        if region["sheet"] not in sheet_files
+    }
+    main_index.update(promoted_regions)
+    save_json(main_index_path, main_index)
+    if not keep:
+        for card_name in promoted_regions:
+            del quarantine_index[card_name]
+        save_json(quarantine_index_path, quarantine_index)
+
+
+def update_manifests(moved_paths: dict[str, str]):
+    """
+    Point the outputs of the shard manifests at the promoted files' new paths.
+    """
+
+    for path in glob.glob(f"{MANIFESTS}*.json"):
+        with open(path, "r", encoding="utf8") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        outputs = manifest.get("outputs") if isinstance(manifest, dict) else None
+        if not isinstance(outputs, dict):
+            continue
+        if not any(output in moved_paths for output in outputs.values()):
+            continue
+
+        manifest["outputs"] = {
+            name: moved_paths.get(output, output) for name, output in outputs.items()
+        }
+        save_json(path, manifest)
+
+
+def main(
+    card_names: list[str] = None,
+    do_sheets: bool = True,
+    keep: bool = False,
+    proof_scale: float = None,
+):
+    proof = proof_scale is not None
+
+    quarantined_cards = {
+        file_name
+        for file_name in list_card_files(get_card_path("processed_cards", True, proof))
+        if file_name.endswith(".png") and not file_name.startswith(".")
+    }
+    if card_names is not None:
+        wanted_names = {cardname_to_filename(card_name) for card_name in card_names}
+        quarantined_cards = {
+            file_name
+            for file_name in quarantined_cards
+            if file_name[:-4].replace("’", "'") in wanted_names
+        }
+
+    moved_paths = promote_folder("processed_cards", proof, quarantined_cards, keep)
+    promoted_cards = {
+        os.path.basename(path)[:-4].replace("’", "'") for path in moved_paths
+    }
+    promote_numbers(proof, promoted_cards, keep)
+
+    # along with the extra outputs (web previews, thumbnails, etc.) saved with them
+    for target in OUTPUT_TARGETS.values():
+        quarantined_outputs = {
+            file_name
+            for file_name in list_card_files(
+                get_card_path(target["folder"], True, proof)
+            )
+            if os.path.splitext(file_name)[0].replace("’", "'") in promoted_cards
+        }
+        moved_paths.update(
+            promote_folder(target["folder"], proof, quarantined_outputs, keep)
+        )
+    log(f"Promoted {len(promoted_cards)} cards.")
+
+    # sheets can hold cards that weren't approved, so they're only promoted with every card
+    if do_sheets and card_names is None:
+        quarantined_sheets = {
+            file_name
+            for file_name in list_card_files(get_card_path("card_tilings", True, proof))
+            if file_name.endswith((".png", ".tif", ".pdf"))
+            and not file_name.startswith(".")
+        }
+        sheet_moved_paths = promote_folder(
+            "card_tilings", proof, quarantined_sheets, keep
+        )
+        promote_sheet_tables(
+            proof, {os.path.basename(path) for path in sheet_moved_paths}, keep
+        )
+        moved_paths.update(sheet_moved_paths)
+        log(f"Promoted {len(sheet_moved_paths)} sheets.")
+
+    update_manifests(moved_paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Promote approved quarantined cards and sheets into the main folders."
+    )
+
+    parser.add_argument(
+        "-cn",
+        "--card-names",
+        nargs="+",
+        help="Only promote these cards (their sheets are left in quarantine).",
+        dest="card_names",
+    )
+    parser.add_argument(
+        "-ns",
+        "--no-sheets",
+        action="store_false",
+        help="Skip promoting the quarantined tile sheets.",
+        dest="sheets",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep",
+        action="store_true",
+        help="Hard-link the files into the main folders instead of moving them, keeping the quarantine as it is.",
+        dest="keep",
+    )
+    parser.add_argument(
+        "-p",
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Promote the proofs in 'cards/proof' instead.",
+        dest="proof_scale",
+    )
+
+    args = parser.parse_args()
+    main(args.card_names, args.sheets, args.keep, args.proof_scale)
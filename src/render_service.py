@@ -0,0 +1,326 @@
+"""
+Serves card renders over local HTTP, keeping the spreadsheets and assets loaded between requests.
+
+GET  /render?name=<card name>          The rendered card as PNG bytes (nothing is saved).
+GET  /render?name=<card name>&save=1   Renders and saves the card, returns {"paths": {name: path}}.
+POST /render {"names": [...]}          Renders and saves every named card, returns {"paths": {...}}.
+GET  /sheet?kind=cards&num=<n>         Re-tiles a sheet, returns {"path": path}. Add &format=png for its bytes.
+
+Bad requests, missing cards or sheets, and failed renders are answered with {"error": message}.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import threading
+from urllib.parse import parse_qs, urlparse
+
+from card_tiling import (
+    build_tile_sheets,
+    plan_alt_art_sheets,
+    plan_basic_land_sheets,
+    plan_card_sheets,
+    plan_token_sheets,
+)
+from collection_info import get_file_states, get_render_jobs, render_job
+from common import get_card_path, parse_proof_scale, process_spreadsheets
+from constants import (
+    RENDER_SERVICE_HOST,
+    RENDER_SERVICE_PORT,
+    RENDER_SERVICE_WORKERS,
+    SPREADSHEETS,
+)
+from log import log, reset_log
+from model.RenderJob import RenderJob
+
+SHEET_KINDS = {
+    "cards": plan_card_sheets,
+    "tokens": plan_token_sheets,
+    "basic_lands": plan_basic_land_sheets,
+    "alt_arts": plan_alt_art_sheets,
+}
+
+
+class RenderService:
+    """
+    The loaded spreadsheets and the worker pool that renders cards from them.
+
+    Attributes
+    ----------
+    quarantine: bool
+        Whether saved cards and sheets go in the quarantine folders.
+
+    proof_scale: float, optional
+        The scale to render proofs at, or None to render at full size.
+    """
+
+    def __init__(
+        self,
+        workers: int = RENDER_SERVICE_WORKERS,
+        quarantine: bool = False,
+        proof_scale: float = None,
+    ):
+        self.quarantine = quarantine
+        self.proof_scale = proof_scale
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._spreadsheet_lock = threading.Lock()
+        self._tiling_lock = threading.Lock()
+        self._sheet_states = None
+        self._reload_spreadsheets()
+
+    def _reload_spreadsheets(self):
+        with self._spreadsheet_lock:
+            sheet_states = get_file_states(SPREADSHEETS)
+            if sheet_states == self._sheet_states:
+                return
+
+            self.spreadsheets = process_spreadsheets()
+            jobs = get_render_jobs(*self.spreadsheets)
+            self._jobs = {}
+            for job in jobs:
+                self._jobs[job.name] = job
+                self._jobs.setdefault(job.file_name, job)
+            self._sheet_states = sheet_states
+            log(f"Loaded {len(jobs)} cards from the spreadsheets.")
+
+    def get_job(self, name: str) -> RenderJob | None:
+        self._reload_spreadsheets()
+        return self._jobs.get(name)
+
+    def render_png(self, name: str) -> bytes | None:
+        job = self.get_job(name)
+        if job is None:
+            return None
+
+        def render() -> bytes | None:
+            image = render_job(job, self.quarantine, self.proof_scale, save=False)
+            if image is None:
+                return None
+            with io.BytesIO() as buffer:
+                image.save(buffer, format="PNG", compress_level=1)
+                return buffer.getvalue()
+
+        return self._pool.submit(render).result()
+
+    def render_files(self, names: list[str]) -> dict[str, str | None]:
+        jobs = {name: self.get_job(name) for name in names}
+        futures = {
+            name: self._pool.submit(render_job, job, self.quarantine, self.proof_scale)
+            for name, job in jobs.items()
+            if job is not None
+        }
+
+        card_path = get_card_path(
+            "processed_cards", self.quarantine, self.proof_scale is not None
+        )
+        paths = {}
+        for name, job in jobs.items():
+            if job is None or futures[name].result() is None:
+                paths[name] = None
+            else:
+                paths[name] = f"cards/{card_path}{job.file_name}.png"
+        return paths
+
+    def tile_sheet(self, kind: str, num: int) -> str | None:
+        """
+        Re-tile the given sheet of the kind. Returns the sheet's path, or None if there's no
+        such sheet.
+        """
+
+        self._reload_spreadsheets()
+        cards, tokens, basic_lands, alt_arts = self.spreadsheets
+
+        with self._tiling_lock:
+            if kind == "cards":
+                sheets = plan_card_sheets(
+                    cards,
+                    min_tile_num=num,
+                    max_tile_num=num,
+                    quarantine=self.quarantine,
+                    proof_scale=self.proof_scale,
+                )
+            else:
+                cards_of_kind = {
+                    "tokens": tokens,
+                    "basic_lands": basic_lands,
+                    "alt_arts": alt_arts,
+                }[kind]
+                sheets = SHEET_KINDS[kind](
+                    cards_of_kind, self.quarantine, self.proof_scale
+                )
+
+            paths = build_tile_sheets(
+                [sheet for sheet in sheets if sheet.num == num],
+                self.quarantine,
+                self.proof_scale,
+            )
+
+        if len(paths) == 0 or not os.path.isfile(paths[0]):
+            return None
+        return paths[0]
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    service: RenderService = None
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, value):
+        self._send(status, json.dumps(value).encode("utf8"), "application/json")
+
+    def _handle(self, handler):
+        """
+        Run the request's handler, answering with the error if rendering or tiling fails
+        instead of dropping the connection.
+        """
+
+        try:
+            handler()
+        except Exception as e:
+            log(f"""Request "{self.path}" failed: {e!r}""")
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def _get(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/render" and "name" in query:
+            if query.get("save") == "1":
+                self._send_json(
+                    200, {"paths": self.service.render_files([query["name"]])}
+                )
+                return
+
+            png = self.service.render_png(query["name"])
+            if png is None:
+                self._send_json(
+                    404, {"error": f"""Couldn't render "{query["name"]}"."""}
+                )
+            else:
+                self._send(200, png, "image/png")
+
+        elif (
+            url.path == "/sheet" and query.get("kind") in SHEET_KINDS and "num" in query
+        ):
+            if not query["num"].isdigit() or int(query["num"]) < 1:
+                self._send_json(
+                    400, {"error": "The sheet number must be a whole number from 1."}
+                )
+                return
+
+            path = self.service.tile_sheet(query["kind"], int(query["num"]))
+            if path is None:
+                self._send_json(
+                    404,
+                    {"error": f"""There's no {query["kind"]} sheet {query["num"]}."""},
+                )
+                return
+            if query.get("format") != "png":
+                self._send_json(200, {"path": path})
+                return
+
+            try:
+                with open(path, "rb") as sheet_file:
+                    self._send(200, sheet_file.read(), "image/png")
+            except FileNotFoundError:
+                self._send_json(404, {"error": f"""Sheet "{path}" wasn't created."""})
+
+        else:
+            self._send_json(400, {"error": "Unknown request."})
+
+    def _post(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "The request body isn't valid JSON."})
+            return
+
+        if (
+            url.path == "/render"
+            and isinstance(body, dict)
+            and isinstance(body.get("names"), list)
+            and all(isinstance(name, str) for name in body["names"])
+        ):
+            self._send_json(200, {"paths": self.service.render_files(body["names"])})
+        else:
+            self._send_json(400, {"error": "Unknown request."})
+
+    def log_message(self, format: str, *args):
+        log(f"{self.address_string()} {format % args}", do_print=False)
+
+
+def main(
+    port: int = RENDER_SERVICE_PORT,
+    workers: int = RENDER_SERVICE_WORKERS,
+    quarantine: bool = False,
+    proof_scale: float = None,
+):
+    reset_log()
+    if proof_scale is not None:
+        for folder in ("processed_cards", "card_tilings"):
+            os.makedirs(
+                f"cards/{get_card_path(folder, quarantine, proof=True)}", exist_ok=True
+            )
+    RenderRequestHandler.service = RenderService(workers, quarantine, proof_scale)
+
+    server = ThreadingHTTPServer((RENDER_SERVICE_HOST, port), RenderRequestHandler)
+    log(f"\n----- SERVING RENDERS ON http://{RENDER_SERVICE_HOST}:{port} -----\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("\n----- STOPPED SERVING -----\n")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve renders of The One Set cards.")
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=RENDER_SERVICE_PORT,
+        help="The local port to listen on.",
+        dest="port",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=RENDER_SERVICE_WORKERS,
+        help="How many cards to render at once.",
+        dest="workers",
+    )
+    parser.add_argument(
+        "-q",
+        "--quarantine",
+        action="store_true",
+        help="Put all the cards generated into a quarantine folder.",
+        dest="quarantine",
+    )
+    parser.add_argument(
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Render quick proofs at this fraction of full size (e.g. 0.25) into 'cards/proof'.",
+        dest="proof_scale",
+    )
+
+    args = parser.parse_args()
+    main(args.port, args.workers, args.quarantine, args.proof_scale)
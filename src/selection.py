@@ -0,0 +1,119 @@
+"""
+Selects cards by their attributes (for --where) using an index of each spreadsheet, so picking
+out e.g. every Poker card or every mythic created since a date doesn't scan every card.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import re
+
+from constants import CARD_NAME, WHERE_FIELDS
+from log import log
+from model.CardIndex import CardIndex
+from model.Spreadsheets import Spreadsheets
+
+WHERE_PATTERN = re.compile(r"^\s*(\w+)\s*(>=|<=|!=|=|>|<)\s*(.*?)\s*$")
+
+
+def parse_date(value: str) -> datetime:
+    for date_format in ("%Y-%m-%d", "%m/%d/%Y"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError
+
+
+def parse_where(value: str) -> tuple[str, str, list[str] | datetime]:
+    match = WHERE_PATTERN.match(value)
+    if match is None:
+        raise argparse.ArgumentTypeError(
+            "Each condition must look like 'FIELD=VALUE', e.g. 'archetype=Poker'."
+        )
+
+    field, operator, values = match.groups()
+    field = field.lower()
+    if field not in WHERE_FIELDS:
+        raise argparse.ArgumentTypeError(
+            f"Cards can only be selected by {", ".join(WHERE_FIELDS)}."
+        )
+
+    if field == "date":
+        try:
+            return field, operator, parse_date(values)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Dates must look like '2024-01-31' or '1/31/2024'."
+            )
+
+    if operator not in ("=", "!="):
+        raise argparse.ArgumentTypeError(
+            f"Only dates can be compared with '{operator}'."
+        )
+
+    return (
+        field,
+        operator,
+        [value for value in values.split(",") if len(value.strip()) > 0],
+    )
+
+
+def select_from_index(
+    index: CardIndex, conditions: list[tuple[str, str, list[str] | datetime]]
+) -> set[str]:
+    """
+    Get the names of the indexed cards that meet every condition. A condition with several
+    comma-separated values is met by a card with any of them.
+    """
+
+    names = index.names
+    for field, operator, values in conditions:
+        if field == "date":
+            date = values
+            if operator == ">=":
+                matches = index.between(start=date)
+            elif operator == ">":
+                matches = index.between(start=date + timedelta(days=1))
+            elif operator == "<=":
+                matches = index.between(end=date)
+            elif operator == "<":
+                matches = index.between(end=date - timedelta(days=1))
+            else:
+                matches = index.between(date, date)
+                if operator == "!=":
+                    matches = index.names - matches
+        else:
+            matches = set().union(*(index.lookup(field, value) for value in values))
+            if operator == "!=":
+                matches = index.names - matches
+
+        names = names & matches
+        if len(names) == 0:
+            break
+
+    return names
+
+
+def select_cards(
+    spreadsheets: Spreadsheets,
+    kinds: tuple[str, ...],
+    conditions: list[tuple[str, str, list[str] | datetime]],
+) -> set[str]:
+    """
+    Get the names of the cards of the given kinds ("cards", "tokens", "basic_lands",
+    "alt_arts") that meet every condition, along with the names of their transform backsides.
+    Each kind's index is built once for the spreadsheets and reused by later selections.
+    """
+
+    selected_names = set()
+    for kind in kinds:
+        cards = getattr(spreadsheets, kind)
+        for card_name in select_from_index(spreadsheets.get_index(kind), conditions):
+            selected_names.add(card_name)
+            selected_names.update(
+                backside[CARD_NAME]
+                for backside in cards[card_name].get("Transform Backsides", [])
+            )
+
+    log(f"Selected {len(selected_names)} cards.")
+    return selected_names
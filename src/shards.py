@@ -0,0 +1,83 @@
+"""
+Splits a run across several machines. Each shard renders or tiles every Nth item, keeping the
+numbering of the full run, and writes a manifest of its outputs that can be merged afterwards.
+"""
+
+import argparse
+import glob
+import json
+
+from common import save_json
+from constants import MANIFESTS
+from log import log
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("The shard must look like 'i/N', e.g. '2/4'.")
+
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("The shard index must be between 1 and N.")
+
+    return index, count
+
+
+def in_shard(index: int, shard: tuple[int, int] | None) -> bool:
+    """
+    Whether the item at the given (0-based) index of the full run belongs to the shard.
+    """
+
+    if shard is None:
+        return True
+    return index % shard[1] == shard[0] - 1
+
+
+def write_shard_manifest(tool: str, shard: tuple[int, int], outputs: dict[str, str]):
+    save_json(
+        f"{MANIFESTS}{tool}.shard{shard[0]}of{shard[1]}.json",
+        {"shard": shard[0], "shards": shard[1], "outputs": outputs},
+    )
+
+
+def merge_shard_manifests(tool: str) -> bool:
+    """
+    Merge the manifests written by every shard of a run into one manifest.
+    Returns False (and merges nothing) if any shard hasn't finished.
+    """
+
+    manifests = []
+    for path in glob.glob(f"{MANIFESTS}{tool}.shard*of*.json"):
+        with open(path, "r", encoding="utf8") as manifest_file:
+            manifests.append(json.load(manifest_file))
+
+    if len(manifests) == 0:
+        log(f"No shard manifests found for {tool}.")
+        return False
+
+    shard_counts = {manifest["shards"] for manifest in manifests}
+    if len(shard_counts) > 1:
+        log(
+            f"The {tool} shard manifests come from runs split {len(shard_counts)} different ways."
+        )
+        return False
+
+    num_shards = shard_counts.pop()
+    missing_shards = set(range(1, num_shards + 1)) - {
+        manifest["shard"] for manifest in manifests
+    }
+    if len(missing_shards) > 0:
+        log(
+            f"Missing {tool} shards: {", ".join(str(s) for s in sorted(missing_shards))}."
+        )
+        return False
+
+    outputs = {}
+    for manifest in sorted(manifests, key=lambda manifest: manifest["shard"]):
+        outputs.update(manifest["outputs"])
+
+    save_json(f"{MANIFESTS}{tool}.json", {"shards": num_shards, "outputs": outputs})
+
+    log(f"Merged {num_shards} {tool} shard manifests ({len(outputs)} outputs).")
+    return True
@@ -0,0 +1,79 @@
+"""
+Gets runs going sooner by reading the spreadsheets and listing the card folders on other threads
+while the main thread carries on, and times each step of starting up so a slow start can be
+tracked down.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
+import time
+
+from log import log
+
+_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_steps: dict[str, float] = {}
+
+
+def record_step(name: str, seconds: float):
+    with _lock:
+        _steps[name] = _steps.get(name, 0) + seconds
+
+
+def begin_startup():
+    """
+    Record how long Python took to start and import everything, up to the start of the run.
+    """
+
+    record_step("Starting Python and importing (CPU time)", time.process_time())
+
+
+@contextmanager
+def startup_step(name: str):
+    """
+    Record how long everything run inside this context takes under the given name.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_step(name, time.perf_counter() - start)
+
+
+def _run_step(name: str, function, args: tuple):
+    with startup_step(name):
+        return function(*args)
+
+
+def in_background(name: str, function, *args) -> Future:
+    """
+    Start calling the function on another thread, timing it under the given name.
+    """
+
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix="startup")
+    return _executor.submit(_run_step, name, function, args)
+
+
+def wait_for(name: str, future: Future):
+    """
+    Get the result of something started in the background, recording how long the main thread
+    was held up waiting for it.
+    """
+
+    if future.done():
+        return future.result()
+
+    with startup_step(f"Waiting for {name}"):
+        return future.result()
+
+
+def report_startup():
+    log("\n----- STARTUP TIME -----\n")
+    with _lock:
+        for name, seconds in _steps.items():
+            log(f"{name}: {seconds * 1000:.1f} ms")
@@ -0,0 +1,358 @@
+"""
+Saves tile sheets as tiled TIFFs, with a sidecar index of where each card is on which sheet, so
+a single card can be pulled back out of a sheet by reading and decoding only the tiles it covers
+rather than the whole sheet.
+"""
+
+import argparse
+from collections.abc import Iterable
+import json
+import os
+import struct
+import zlib
+from PIL import Image
+
+from common import (
+    cardname_to_filename,
+    get_card_path,
+    parse_proof_scale,
+    save_image,
+    scale_length,
+)
+from constants import CARD_HEIGHT, CARD_WIDTH, TIFF_TILE_SIZE
+from log import log
+from model.TileSheet import TileSheet
+
+SHEET_INDEX = "sheet_index.json"
+
+# the TIFF tags that are written and read
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC_INTERPRETATION = 262
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+
+# the TIFF field types used, as (type code, struct format)
+SHORT = (3, "H")
+LONG = (4, "I")
+
+DEFLATE = 8
+RGB = 2
+UNASSOCIATED_ALPHA = 2
+
+
+def get_tile_grid(size: tuple[int, int]) -> tuple[int, int]:
+    """
+    Get how many tiles across and down cover an image of the given size.
+    """
+
+    return (
+        (size[0] + TIFF_TILE_SIZE - 1) // TIFF_TILE_SIZE,
+        (size[1] + TIFF_TILE_SIZE - 1) // TIFF_TILE_SIZE,
+    )
+
+
+def write_tiled_tiff_bands(
+    bands: Iterable[Image.Image], size: tuple[int, int], mode: str, path: str
+):
+    """
+    Save the image made of the given RGB or RGBA bands (full-width runs of rows, top to
+    bottom) as a Deflate-compressed tiled TIFF, encoding each row of tiles as soon as its rows
+    are in, so only about a band of the image is in memory at once. The file replaces `path`
+    once it's completely written.
+    """
+
+    num_bands = len(mode)
+    width, height = size
+
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as tiff_file:
+            # the header's IFD offset is filled in once the IFD is written after the tiles
+            tiff_file.write(b"II*\x00\x00\x00\x00\x00")
+
+            offsets = []
+            byte_counts = []
+
+            def write_tile_row(rows: Image.Image):
+                for left in range(0, width, TIFF_TILE_SIZE):
+                    # edge tiles are padded out to the full tile size, as TIFF expects
+                    tile = rows.crop((left, 0, left + TIFF_TILE_SIZE, TIFF_TILE_SIZE))
+                    data = zlib.compress(tile.tobytes())
+                    offsets.append(tiff_file.tell())
+                    byte_counts.append(len(data))
+                    tiff_file.write(data)
+
+            # the rows left over from the last band that don't fill a row of tiles yet
+            pending_rows = None
+            for band in bands:
+                if pending_rows is None:
+                    rows = band
+                else:
+                    rows = Image.new(mode, (width, pending_rows.height + band.height))
+                    rows.paste(pending_rows, (0, 0))
+                    rows.paste(band, (0, pending_rows.height))
+
+                top = 0
+                while rows.height - top >= TIFF_TILE_SIZE:
+                    write_tile_row(rows.crop((0, top, width, top + TIFF_TILE_SIZE)))
+                    top += TIFF_TILE_SIZE
+                pending_rows = (
+                    rows.crop((0, top, width, rows.height))
+                    if top < rows.height
+                    else None
+                )
+            if pending_rows is not None:
+                write_tile_row(pending_rows)
+
+            entries = [
+                (IMAGE_WIDTH, LONG, [width]),
+                (IMAGE_LENGTH, LONG, [height]),
+                (BITS_PER_SAMPLE, SHORT, [8] * num_bands),
+                (COMPRESSION, SHORT, [DEFLATE]),
+                (PHOTOMETRIC_INTERPRETATION, SHORT, [RGB]),
+                (SAMPLES_PER_PIXEL, SHORT, [num_bands]),
+                (PLANAR_CONFIGURATION, SHORT, [1]),
+                (TILE_WIDTH, LONG, [TIFF_TILE_SIZE]),
+                (TILE_LENGTH, LONG, [TIFF_TILE_SIZE]),
+                (TILE_OFFSETS, LONG, offsets),
+                (TILE_BYTE_COUNTS, LONG, byte_counts),
+            ]
+            if num_bands == 4:
+                entries.append((EXTRA_SAMPLES, SHORT, [UNASSOCIATED_ALPHA]))
+            write_ifd(tiff_file, entries)
+
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_ifd(tiff_file, entries: list[tuple[int, tuple[int, str], list[int]]]):
+    """
+    Write the image file directory at the end of the file and point the header at it. Values
+    that don't fit in an entry are written just before the directory.
+    """
+
+    entry_data = []
+    for tag, (field_type, value_format), values in entries:
+        data = struct.pack(f"<{len(values)}{value_format}", *values)
+        if len(data) <= 4:
+            entry_data.append((tag, field_type, len(values), data.ljust(4, b"\x00")))
+            continue
+
+        if tiff_file.tell() % 2 == 1:
+            tiff_file.write(b"\x00")
+        offset = tiff_file.tell()
+        tiff_file.write(data)
+        entry_data.append((tag, field_type, len(values), struct.pack("<I", offset)))
+
+    if tiff_file.tell() % 2 == 1:
+        tiff_file.write(b"\x00")
+    ifd_offset = tiff_file.tell()
+    tiff_file.write(struct.pack("<H", len(entry_data)))
+    for tag, field_type, count, value in entry_data:
+        tiff_file.write(struct.pack("<HHI", tag, field_type, count) + value)
+    tiff_file.write(struct.pack("<I", 0))
+
+    tiff_file.seek(4)
+    tiff_file.write(struct.pack("<I", ifd_offset))
+
+
+def read_tiff_layout(tiff_file) -> dict[int, list[int]]:
+    """
+    Read the tags of the first image in a little-endian TIFF written by
+    `write_tiled_tiff_bands`.
+    """
+
+    if tiff_file.read(4) != b"II*\x00":
+        raise ValueError("not a little-endian TIFF")
+    (ifd_offset,) = struct.unpack("<I", tiff_file.read(4))
+    tiff_file.seek(ifd_offset)
+    (num_entries,) = struct.unpack("<H", tiff_file.read(2))
+
+    formats = {SHORT[0]: SHORT[1], LONG[0]: LONG[1]}
+    tags = {}
+    for tag, field_type, count, value in struct.iter_unpack(
+        "<HHI4s", tiff_file.read(12 * num_entries)
+    ):
+        if field_type not in formats:
+            continue
+
+        value_format = f"<{count}{formats[field_type]}"
+        if struct.calcsize(value_format) <= 4:
+            tags[tag] = list(struct.unpack_from(value_format, value))
+        else:
+            position = tiff_file.tell()
+            tiff_file.seek(struct.unpack("<I", value)[0])
+            tags[tag] = list(
+                struct.unpack(
+                    value_format, tiff_file.read(struct.calcsize(value_format))
+                )
+            )
+            tiff_file.seek(position)
+
+    if tags.get(COMPRESSION) != [DEFLATE] or TILE_WIDTH not in tags:
+        raise ValueError("not a Deflate-compressed tiled TIFF")
+    return tags
+
+
+def read_tiff_region(path: str, box: tuple[int, int, int, int]) -> Image.Image:
+    """
+    Read the given region of a tiled TIFF, decoding only the tiles that overlap it.
+    """
+
+    left, top, right, bottom = box
+    with open(path, "rb") as tiff_file:
+        tags = read_tiff_layout(tiff_file)
+        tile_width, tile_height = tags[TILE_WIDTH][0], tags[TILE_LENGTH][0]
+        mode = "RGBA" if tags[SAMPLES_PER_PIXEL][0] == 4 else "RGB"
+        tiles_across = (tags[IMAGE_WIDTH][0] + tile_width - 1) // tile_width
+
+        first_column, last_column = left // tile_width, (right - 1) // tile_width
+        first_row, last_row = top // tile_height, (bottom - 1) // tile_height
+        region = Image.new(
+            mode,
+            (
+                (last_column - first_column + 1) * tile_width,
+                (last_row - first_row + 1) * tile_height,
+            ),
+        )
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                index = row * tiles_across + column
+                tiff_file.seek(tags[TILE_OFFSETS][index])
+                data = zlib.decompress(tiff_file.read(tags[TILE_BYTE_COUNTS][index]))
+                region.paste(
+                    Image.frombytes(mode, (tile_width, tile_height), data),
+                    (
+                        (column - first_column) * tile_width,
+                        (row - first_row) * tile_height,
+                    ),
+                )
+
+    crop_left = left - first_column * tile_width
+    crop_top = top - first_row * tile_height
+    return region.crop(
+        (crop_left, crop_top, crop_left + right - left, crop_top + bottom - top)
+    )
+
+
+def get_card_regions(sheet: TileSheet, scale: float = 1) -> dict[str, dict]:
+    """
+    Get where each card is on the sheet once it's saved at the given scale, as the sheet's file,
+    the card's box on it, and whether the card is rotated.
+    """
+
+    width, height = scale_length(CARD_WIDTH, scale), scale_length(CARD_HEIGHT, scale)
+    regions = {}
+    for slot, card_name, rotate, _ in sheet.slots:
+        left, top = sheet.get_position(slot)
+        if scale != 1:
+            left, top = round(left * scale), round(top * scale)
+        regions[card_name] = {
+            "sheet": f"{sheet.file_name}.tif",
+            "box": [left, top, left + width, top + height],
+            "rotated": rotate,
+        }
+    return regions
+
+
+def load_sheet_index(tilings_path: str) -> dict[str, dict]:
+    try:
+        with open(
+            f"cards/{tilings_path}{SHEET_INDEX}", "r", encoding="utf8"
+        ) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {}
+
+
+def extract_card(card_name: str, tilings_path: str) -> Image.Image | None:
+    """
+    Read a card back out of the tiled TIFF sheet it's on, turned upright again if it was
+    rotated onto the sheet. Returns None if the card isn't on any sheet.
+    """
+
+    region = load_sheet_index(tilings_path).get(card_name)
+    if region is None:
+        return None
+
+    image = read_tiff_region(
+        f"cards/{tilings_path}{region["sheet"]}", tuple(region["box"])
+    )
+    if region["rotated"]:
+        image = image.transpose(Image.Transpose.ROTATE_270)
+    return image
+
+
+def main(
+    card_names: list[str],
+    output_path: str,
+    quarantine: bool = False,
+    proof_scale: float = None,
+):
+    tilings_path = get_card_path("card_tilings", quarantine, proof_scale is not None)
+    os.makedirs(output_path, exist_ok=True)
+
+    for card_name in card_names:
+        try:
+            image = extract_card(card_name, tilings_path)
+        except (OSError, ValueError, struct.error, zlib.error):
+            log(
+                f"""The sheet holding "{card_name}" cannot be opened or is otherwise corrupted."""
+            )
+            continue
+
+        if image is None:
+            log(f"""Could not find "{card_name}" on any TIFF sheet.""")
+            continue
+
+        path = os.path.join(output_path, f"{cardname_to_filename(card_name)}.png")
+        save_image(image, path)
+        log(f"""Extracted "{card_name}" to {path}.""")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract cards from the tile sheets saved with card_tiling.py -tif."
+    )
+
+    parser.add_argument(
+        "card_names",
+        nargs="+",
+        metavar="CARD_NAME",
+        help="The names of the cards to extract.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="cards/extracted_cards/",
+        help="The folder to save the extracted cards to.",
+        dest="output_path",
+    )
+    parser.add_argument(
+        "-q",
+        "--quarantine",
+        action="store_true",
+        help="Extract from the sheets in the quarantine folder.",
+        dest="quarantine",
+    )
+    parser.add_argument(
+        "-p",
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Extract from the proof sheets tiled at this fraction of full size.",
+        dest="proof_scale",
+    )
+
+    args = parser.parse_args()
+    main(args.card_names, args.output_path, args.quarantine, args.proof_scale)
@@ -0,0 +1,284 @@
+"""
+Checks every processed card and tile sheet (quarantined ones too) for corruption without
+rendering anything: every PNG chunk's checksum, that the compressed pixels inflate to exactly
+the rows the header says, and that the image is the size it should be. The files are checked
+in several processes at once, and the bad ones are written to a JSON report.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import struct
+import sys
+import time
+import zlib
+
+from common import get_card_path, parse_proof_scale, save_json, scale_length
+from constants import (
+    CARD_HEIGHT,
+    CARD_WIDTH,
+    TILING_HEIGHT,
+    TILING_WIDTH,
+    VERIFY_REPORT,
+    VERIFY_WORKERS,
+)
+from log import log, reset_log
+from tiff_export import (
+    IMAGE_LENGTH,
+    IMAGE_WIDTH,
+    SAMPLES_PER_PIXEL,
+    TILE_BYTE_COUNTS,
+    TILE_LENGTH,
+    TILE_OFFSETS,
+    TILE_WIDTH,
+    read_tiff_layout,
+)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the number of samples in a pixel of each PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# how many bytes of pixels are inflated at a time, so a whole sheet is never in memory
+INFLATE_BYTES = 1 << 22
+
+# the sizes of processed cards: standard cards, and battles (which are landscape)
+CARD_SIZES = ((CARD_WIDTH, CARD_HEIGHT), (2814, 2010))
+
+
+def check_png(path: str) -> tuple[tuple[int, int], str | None]:
+    """
+    Check the PNG's structure and every chunk's CRC, and inflate its pixels a piece at a time
+    to check there's exactly a row of them (with a valid filter type) for each row of the
+    image. Returns the image's size and its problem, if any.
+    """
+
+    size = (0, 0)
+    with open(path, "rb") as png_file:
+        if png_file.read(8) != PNG_SIGNATURE:
+            return size, "it isn't a PNG"
+
+        decompressor = None
+        row_length = 0
+        num_bytes = 0
+        while True:
+            header = png_file.read(8)
+            if len(header) < 8:
+                return size, "it ends before its IEND chunk (truncated)"
+
+            length, chunk_type = struct.unpack(">I4s", header)
+            data = png_file.read(length)
+            crc = png_file.read(4)
+            if len(crc) < 4:
+                return (
+                    size,
+                    f"it's cut off in its {chunk_type.decode("latin-1")} chunk (truncated)",
+                )
+            if struct.unpack(">I", crc)[0] != zlib.crc32(data, zlib.crc32(chunk_type)):
+                return size, f"its {chunk_type.decode("latin-1")} chunk fails its CRC"
+
+            if decompressor is None:
+                if chunk_type != b"IHDR" or length != 13:
+                    return size, "it doesn't start with an IHDR chunk"
+
+                width, height, bit_depth, color_type, _, _, interlace = struct.unpack(
+                    ">IIBBBBB", data
+                )
+                size = (width, height)
+                if color_type not in PNG_CHANNELS or interlace not in (0, 1):
+                    return size, "its header isn't valid"
+                if interlace == 1:
+                    return size, "it's interlaced, which cards and sheets never are"
+
+                # each row is a filter type byte followed by the row's samples
+                row_length = 1 + (width * PNG_CHANNELS[color_type] * bit_depth + 7) // 8
+                decompressor = zlib.decompressobj()
+            elif chunk_type == b"IDAT":
+                try:
+                    while True:
+                        pixels = decompressor.decompress(data, INFLATE_BYTES)
+                        data = decompressor.unconsumed_tail
+                        first_row = -num_bytes % row_length
+                        if max(pixels[first_row::row_length], default=0) > 4:
+                            return size, "its pixels have an invalid filter type"
+                        num_bytes += len(pixels)
+                        if len(data) == 0 and len(pixels) < INFLATE_BYTES:
+                            break
+                except zlib.error:
+                    return size, "its pixels can't be inflated"
+            elif chunk_type == b"IEND":
+                break
+
+    if decompressor is None or not decompressor.eof:
+        return size, "its pixels end early (truncated)"
+    if num_bytes != size[1] * row_length:
+        return (
+            size,
+            f"it has {num_bytes} bytes of pixels instead of {size[1] * row_length}",
+        )
+    return size, None
+
+
+def check_tiff(path: str) -> tuple[tuple[int, int], str | None]:
+    """
+    Check that every tile of the tiled TIFF inflates to a whole tile of pixels, one tile at a
+    time. Returns the image's size and its problem, if any.
+    """
+
+    with open(path, "rb") as tiff_file:
+        try:
+            tags = read_tiff_layout(tiff_file)
+        except (ValueError, struct.error):
+            return (0, 0), "it isn't a tiled TIFF sheet"
+
+        width, height = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+        tile_width, tile_height = tags[TILE_WIDTH][0], tags[TILE_LENGTH][0]
+        tile_bytes = tile_width * tile_height * tags[SAMPLES_PER_PIXEL][0]
+        num_tiles = ((width + tile_width - 1) // tile_width) * (
+            (height + tile_height - 1) // tile_height
+        )
+        if (
+            len(tags[TILE_OFFSETS]) != num_tiles
+            or len(tags[TILE_BYTE_COUNTS]) != num_tiles
+        ):
+            return (
+                width,
+                height,
+            ), f"it has {len(tags[TILE_OFFSETS])} tiles instead of {num_tiles}"
+
+        for index, (offset, byte_count) in enumerate(
+            zip(tags[TILE_OFFSETS], tags[TILE_BYTE_COUNTS])
+        ):
+            tiff_file.seek(offset)
+            try:
+                data = zlib.decompress(tiff_file.read(byte_count))
+            except zlib.error:
+                return (width, height), f"its tile {index} can't be inflated"
+            if len(data) != tile_bytes:
+                return (width, height), f"its tile {index} isn't a whole tile"
+
+    return (width, height), None
+
+
+def check_file(path: str, expected_sizes: tuple[tuple[int, int], ...]) -> str | None:
+    """
+    Check the card or sheet at the given path. Returns its problem, if any.
+    """
+
+    try:
+        if path.endswith(".tif"):
+            size, problem = check_tiff(path)
+        else:
+            size, problem = check_png(path)
+    except OSError as e:
+        return f"it can't be read ({e})"
+
+    if problem is None and size not in expected_sizes:
+        sizes = " or ".join(f"{width}x{height}" for width, height in expected_sizes)
+        problem = f"it's {size[0]}x{size[1]} instead of {sizes}"
+    return problem
+
+
+def list_files(folder: str, proof: bool, extensions: tuple[str, ...]) -> list[str]:
+    """
+    List the files with the given extensions in the folder and its quarantine.
+    """
+
+    paths = []
+    for quarantine in (False, True):
+        directory = f"cards/{get_card_path(folder, quarantine, proof)}"
+        try:
+            with os.scandir(directory) as entries:
+                paths.extend(
+                    f"{directory}{entry.name}"
+                    for entry in entries
+                    if entry.is_file()
+                    and entry.name.endswith(extensions)
+                    and not entry.name.startswith(".")
+                )
+        except FileNotFoundError:
+            continue
+
+    return sorted(paths)
+
+
+def run_verify(proof_scale: float = None) -> dict[str, str]:
+    """
+    Check every processed card and tile sheet, logging the bad ones and writing them to the
+    report. Returns the problem with each bad file, by path.
+    """
+
+    log("\n----- VERIFY -----\n")
+    start = time.perf_counter()
+
+    scale = proof_scale or 1
+    card_sizes = tuple(
+        (scale_length(width, scale), scale_length(height, scale))
+        for width, height in CARD_SIZES
+    )
+    sheet_sizes = (
+        (
+            scale_length(CARD_WIDTH * TILING_WIDTH, scale),
+            scale_length(CARD_HEIGHT * TILING_HEIGHT, scale),
+        ),
+    )
+    card_paths = list_files("processed_cards", proof_scale is not None, (".png",))
+    sheet_paths = list_files("card_tilings", proof_scale is not None, (".png", ".tif"))
+    paths = card_paths + sheet_paths
+    expected_sizes = [card_sizes] * len(card_paths) + [sheet_sizes] * len(sheet_paths)
+
+    with ProcessPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+        problems = {
+            path: problem
+            for path, problem in zip(
+                paths, pool.map(check_file, paths, expected_sizes, chunksize=4)
+            )
+            if problem is not None
+        }
+
+    for path, problem in problems.items():
+        log(f""""{path}": {problem}.""")
+
+    save_json(
+        VERIFY_REPORT,
+        {
+            "checked": len(paths),
+            "bad": [
+                {"path": path, "problem": problem} for path, problem in problems.items()
+            ],
+        },
+    )
+
+    seconds = time.perf_counter() - start
+    if len(problems) == 0:
+        log(f"All {len(paths)} files are intact ({seconds:.1f} s).")
+    else:
+        log(
+            f"\n{len(problems)} of {len(paths)} files are corrupted or the wrong size ({seconds:.1f} s); see {VERIFY_REPORT}."
+        )
+    return problems
+
+
+def main(proof_scale: float = None):
+    reset_log()
+    problems = run_verify(proof_scale)
+    if len(problems) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check every processed card and tile sheet for corruption, and that each is the right size."
+    )
+
+    parser.add_argument(
+        "-p",
+        "--proof",
+        type=parse_proof_scale,
+        metavar="SCALE",
+        help="Check the proofs in 'cards/proof' (rendered at this scale) instead.",
+        dest="proof_scale",
+    )
+
+    args = parser.parse_args()
+    main(args.proof_scale)